@@ -8,4 +8,96 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 # Проверка, что токен загрузился
 if not BOT_TOKEN:
-    raise ValueError("Не найден BOT_TOKEN в .env файле!")
\ No newline at end of file
+    raise ValueError("Не найден BOT_TOKEN в .env файле!")
+
+# Трассировка SQL: запросы дольше порога (в мс) логируются вместе с EXPLAIN QUERY PLAN
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+
+# По сколько строк читает `async for` по курсору: каждая порция — один переход в поток SQLite
+DB_ITER_CHUNK_SIZE = int(os.getenv("DB_ITER_CHUNK_SIZE", "500"))
+
+# Логи старше этого числа дней сворачиваются в годовые битовые карты
+LOG_ARCHIVE_AFTER_DAYS = int(os.getenv("LOG_ARCHIVE_AFTER_DAYS", "90"))
+
+# Удалённые привычки вычищаются в фоне: по стольку строк за транзакцию, раз в столько секунд
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_INTERVAL_SECONDS = int(os.getenv("PURGE_INTERVAL_SECONDS", "30"))
+
+# Резервные копии БД: куда класть, сколько хранить, по сколько страниц копировать за шаг
+# и сколько спать между шагами (секунды). После BACKUP_MAX_RESTARTS перезапусков из-за записи
+# копирование добирается одним снимком.
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.05"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+# Сторож цикла событий: после скольких мс без «пульса» снимать стек и как часто мерить задержку (с)
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1"))
+
+# /profile: куда писать .pstats, предельная длина окна (с) и сколько строк в сводке
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "15"))
+
+# Картинка /statsimg: формат (png — палитровый, webp, jpeg) и желаемый предел размера в байтах
+STATS_IMAGE_FORMAT = os.getenv("STATS_IMAGE_FORMAT", "png")
+STATS_IMAGE_MAX_BYTES = int(os.getenv("STATS_IMAGE_MAX_BYTES", "40000"))
+
+# Часовой пояс для пользователей, которые его не указали (IANA, например Europe/Moscow).
+# Пусто — пояс сервера, как раньше.
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE") or None
+
+# Сколько мест показывать в /top
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+
+# Насколько далеко назад (в минутах) тик напоминаний догоняет пропущенные минуты после простоя
+REMINDER_CATCHUP_MINUTES = int(os.getenv("REMINDER_CATCHUP_MINUTES", "120"))
+
+# Очередь напоминаний: размер порции, период разбора (сек), число попыток и паузы между ними (сек)
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_DRAIN_SECONDS = int(os.getenv("OUTBOX_DRAIN_SECONDS", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BASE_BACKOFF = float(os.getenv("OUTBOX_BASE_BACKOFF", "30"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "3600"))
+
+# Telegram ID администраторов через запятую — им доступны служебные команды
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+def _rate(name: str, default: str) -> tuple[float, float]:
+    """Читает лимит вида «скорость/запас», например «0.1/3» — раз в 10 с, до 3 подряд"""
+    rate, capacity = os.getenv(name, default).split("/")
+    return float(rate), float(capacity)
+
+# Ограничение частоты запросов от одного пользователя
+THROTTLE_USER = _rate("THROTTLE_USER", "3/10")  # общий лимит на все действия
+THROTTLE_CLASSES = {
+    "heavy": _rate("THROTTLE_HEAVY", "0.1/3"),  # /statsimg, /reset, /export и т.п.
+    "command": _rate("THROTTLE_COMMAND", "1/5"),  # остальные команды и сообщения
+    "callback": _rate("THROTTLE_CALLBACK", "2/8"),  # нажатия кнопок
+}
+THROTTLE_MAX_BUCKETS = int(os.getenv("THROTTLE_MAX_BUCKETS", "100000"))
+
+# Исходящие запросы к Telegram: общий лимит (в секунду), лимит на личный чат и на группу
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE_PER_MIN = float(os.getenv("SEND_GROUP_RATE_PER_MIN", "20"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "2"))
+
+# Сколько привычек показывать на одной странице /list и /today
+HABITS_PAGE_SIZE = int(os.getenv("HABITS_PAGE_SIZE", "10"))
+
+# Несколько экземпляров бота: задачи планировщика выполняет только держатель аренды.
+# Аренда живёт LEADER_LEASE_TTL секунд и продлевается каждые LEADER_RENEW_SECONDS
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "10"))
+LEADER_RENEW_SECONDS = float(os.getenv("LEADER_RENEW_SECONDS", "3"))
+
+# Инлайн-поиск привычек (@bot текст): сколько секунд и сколько запросов держать в кэше
+INLINE_CACHE_TTL = float(os.getenv("INLINE_CACHE_TTL", "30"))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "10000"))
+
+# Доски общих челленджей перерисовываются пачкой не чаще раза в столько секунд
+CHALLENGE_BOARD_INTERVAL = float(os.getenv("CHALLENGE_BOARD_INTERVAL", "10"))
@@ -0,0 +1,131 @@
+# database/backup.py
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from config.settings import BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, BACKUP_MAX_RESTARTS
+from database.db import DB_PATH
+
+BACKUP_PREFIX = "habits-"
+BACKUP_SUFFIX = ".db.gz"
+
+
+class _TooManyRestarts(Exception):
+    """Базу меняют быстрее, чем успеваем скопировать по шагам"""
+
+
+def _remove_database_file(path: str):
+    """Удаляет файл БД вместе с его -wal и -shm, если SQLite их успел создать"""
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def _copy_database(target_path: str) -> int:
+    """Копирует БД через online backup API SQLite порциями по BACKUP_PAGES_PER_STEP страниц.
+    Между шагами блокировка отпускается, и бот спокойно пишет. Если запись идёт так часто, что
+    копирование раз за разом начинается заново, — добираем одним шагом: в режиме WAL это
+    одно чтение снимка, писателей оно не задерживает. Возвращает число страниц."""
+    source = sqlite3.connect(DB_PATH)
+    target = sqlite3.connect(target_path)
+    restarts = 0
+    last_remaining = None
+    pages = 0
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining, pages
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1  # исходную БД изменили — SQLite начал копирование сначала
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining, pages = remaining, total
+
+    try:
+        try:
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        except _TooManyRestarts:
+            print(f"⚠️ [BACKUP] Копирование перезапускалось {restarts} раз — копируем одним снимком")
+            source.backup(target)
+        # Копия наследует режим WAL исходной БД. Снимок должен быть одним самодостаточным
+        # файлом: без этого он открывался бы с -wal/-shm рядом (и при проверке, и при восстановлении)
+        target.execute("PRAGMA journal_mode = DELETE").fetchone()
+    finally:
+        target.close()
+        source.close()
+    return pages
+
+
+def _verify_snapshot(path: str) -> str:
+    """Распаковывает снимок во временный файл и прогоняет PRAGMA integrity_check"""
+    fd, plain_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        with gzip.open(path, "rb") as src, open(plain_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        # immutable: файл никто не пишет — SQLite не создаёт рядом ни -wal, ни -shm
+        db = sqlite3.connect(f"file:{plain_path}?mode=ro&immutable=1", uri=True)
+        try:
+            rows = db.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            db.close()
+        return "; ".join(row[0] for row in rows)
+    finally:
+        _remove_database_file(plain_path)
+
+
+def _make_backup() -> tuple[str, int]:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}"
+    path = os.path.join(BACKUP_DIR, name)
+
+    fd, plain_path = tempfile.mkstemp(suffix=".db", dir=BACKUP_DIR)
+    os.close(fd)
+    try:
+        pages = _copy_database(plain_path)
+        # Сжимаем во временное имя и только потом переименовываем — недописанных архивов не бывает
+        with open(plain_path, "rb") as src, gzip.open(path + ".tmp", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(path + ".tmp", path)
+    finally:
+        _remove_database_file(plain_path)
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+    return path, pages
+
+
+def list_backups() -> list[str]:
+    """Снимки в BACKUP_DIR, от новых к старым"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    names = [n for n in os.listdir(BACKUP_DIR) if n.startswith(BACKUP_PREFIX) and n.endswith(BACKUP_SUFFIX)]
+    return [os.path.join(BACKUP_DIR, n) for n in sorted(names, reverse=True)]
+
+
+def _rotate_backups(keep: int) -> list[str]:
+    removed = list_backups()[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+async def verify_backup(path: str) -> bool:
+    """Проверяет, что снимок открывается и цел"""
+    result = await asyncio.to_thread(_verify_snapshot, path)
+    if result != "ok":
+        print(f"❌ [BACKUP] Снимок {os.path.basename(path)} повреждён: {result}")
+    return result == "ok"
+
+
+async def backup_database(keep: int = BACKUP_KEEP) -> dict:
+    """Делает сжатый снимок БД, проверяет его и удаляет лишние старые.
+    Вся работа идёт в отдельном потоке — цикл событий бота не ждёт ни копирования, ни gzip."""
+    path, pages = await asyncio.to_thread(_make_backup)
+    ok = await verify_backup(path)
+    removed = await asyncio.to_thread(_rotate_backups, keep) if ok else []
+
+    size = os.path.getsize(path)
+    print(f"💾 [BACKUP] Снимок {os.path.basename(path)}: {pages} страниц, {size} байт, проверка: {'ok' if ok else 'ОШИБКА'}")
+    return {"path": path, "pages": pages, "size": size, "ok": ok, "removed": len(removed)}
@@ -0,0 +1,59 @@
+# database/check_init.py
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import database.db as db
+
+# Проверка миграций перед выкладкой: python -m database.check_init
+# init_db прогоняется дважды (миграция + быстрый выход по версии) на пустой БД и на копии
+# habits.db из репозитория — всегда с трассировкой запросов, как в проде по умолчанию.
+
+
+def _copy_shipped(target: str) -> bool:
+    """Копирует habits.db через backup API, чтобы захватить и то, что ещё лежит в WAL"""
+    source = os.path.join(db.BASE_DIR, "habits.db")
+    if not os.path.exists(source):
+        return False
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return True
+
+
+async def check_init_db() -> bool:
+    tmp = tempfile.mkdtemp(prefix="habits-check-")
+    saved = db.DB_PATH, db.QUERY_LOG_ENABLED
+    db.QUERY_LOG_ENABLED = True
+    ok = True
+    try:
+        targets = [("пустая БД", os.path.join(tmp, "fresh.db"))]
+        shipped = os.path.join(tmp, "shipped.db")
+        if _copy_shipped(shipped):
+            targets.append(("копия habits.db", shipped))
+        else:
+            print("⚠️ [CHECK] habits.db не найден — проверяем только пустую БД")
+
+        for label, path in targets:
+            db.DB_PATH = path
+            try:
+                await db.init_db()
+                await db.init_db()
+                print(f"✅ [CHECK] init_db: {label}")
+            except Exception as e:
+                ok = False
+                print(f"❌ [CHECK] init_db упал ({label}): {type(e).__name__}: {e}")
+    finally:
+        db.DB_PATH, db.QUERY_LOG_ENABLED = saved
+        shutil.rmtree(tmp, ignore_errors=True)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_init_db()) else 1)
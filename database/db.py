@@ -1,15 +1,55 @@
 # database/db.py
 import aiosqlite
+import asyncio
 import os
-from datetime import date
+import re
+import secrets
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+from config.settings import QUERY_LOG_ENABLED, SLOW_QUERY_MS, PURGE_BATCH_SIZE, DB_ITER_CHUNK_SIZE
+from database.query_log import TracedConnection
+from database.log_bitmap import DAY_DONE, day_index, decode_year, get_day, set_days
+from utils.timezones import local_today, to_utc_minute, utc_offset_minutes
 
 # Определяем путь до корня проекта и файл БД
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(BASE_DIR, "habits.db")
 
+# Версия схемы: увеличивай при каждом изменении init_db, иначе изменения не применятся
+SCHEMA_VERSION = 13
+
+@asynccontextmanager
+async def connect():
+    """Открывает соединение с БД. Если включена трассировка — каждый запрос замеряется,
+    а медленные пишутся в лог вместе с планом выполнения и местом вызова."""
+    async with aiosqlite.connect(DB_PATH, iter_chunk_size=DB_ITER_CHUNK_SIZE) as db:
+        # Без этого SQLite не проверяет внешние ключи и не выполняет ON DELETE CASCADE
+        await db.execute("PRAGMA foreign_keys = ON")
+        if not QUERY_LOG_ENABLED:
+            yield db
+            return
+        traced = TracedConnection(db, SLOW_QUERY_MS)
+        try:
+            yield traced
+        finally:
+            await traced.flush()
+
 async def init_db():
-    """Создаёт все таблицы, если их ещё нет + обновляет структуру при необходимости"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Создаёт все таблицы, если их ещё нет + обновляет структуру при необходимости.
+    Если версия схемы в файле БД уже актуальная — сразу выходит."""
+    async with connect() as db:
+        # WAL: чтение (в том числе резервное копирование) не блокирует запись. Настройка
+        # хранится в самом файле БД, повторный вызов ничего не стоит. PRAGMA возвращает
+        # строку с новым режимом — дочитываем её, иначе оператор остаётся незавершённым
+        await (await db.execute("PRAGMA journal_mode = WAL")).fetchone()
+
+        cursor = await db.execute("PRAGMA user_version")
+        (version,) = await cursor.fetchone()
+        if version == SCHEMA_VERSION:
+            print(f"✅ [DB] Схема БД актуальна (версия {version})")
+            return
+
         # Таблица пользователей
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -28,6 +68,38 @@ async def init_db():
             await db.execute("ALTER TABLE users ADD COLUMN reminder_time TEXT DEFAULT NULL")
             print("➕ [DB] Добавлен столбец 'reminder_time' в таблицу 'users'")
 
+        # Добавляем столбец leaderboard_opt_in (участие в /top), если его нет
+        if "leaderboard_opt_in" not in column_names:
+            await db.execute("ALTER TABLE users ADD COLUMN leaderboard_opt_in INTEGER NOT NULL DEFAULT 0")
+            print("➕ [DB] Добавлен столбец 'leaderboard_opt_in' в таблицу 'users'")
+
+        # Добавляем столбец is_blocked (пользователь заблокировал бота), если его нет
+        if "is_blocked" not in column_names:
+            await db.execute("ALTER TABLE users ADD COLUMN is_blocked INTEGER NOT NULL DEFAULT 0")
+            print("➕ [DB] Добавлен столбец 'is_blocked' в таблицу 'users'")
+
+        # Часовой пояс пользователя (IANA, например Europe/Moscow; NULL — пояс по умолчанию)
+        # и время напоминания, пересчитанное в минуту суток по UTC
+        if "tz" not in column_names:
+            await db.execute("ALTER TABLE users ADD COLUMN tz TEXT DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'tz' в таблицу 'users'")
+        if "reminder_utc_minute" not in column_names:
+            await db.execute("ALTER TABLE users ADD COLUMN reminder_utc_minute INTEGER DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'reminder_utc_minute' в таблицу 'users'")
+            await _refresh_reminder_buckets(db)
+
+        # За какой (местный) день пользователю уже поставлено напоминание — чтобы догоняющий
+        # тик планировщика не напомнил дважды
+        if "last_reminded_date" not in column_names:
+            await db.execute("ALTER TABLE users ADD COLUMN last_reminded_date TEXT DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'last_reminded_date' в таблицу 'users'")
+
+        # Поиск пользователей на конкретную минуту напоминания (по UTC)
+        await db.execute("DROP INDEX IF EXISTS idx_users_reminder_time")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_reminder_utc ON users(reminder_utc_minute) WHERE is_blocked = 0"
+        )
+
         # Таблица привычек
         await db.execute("""
             CREATE TABLE IF NOT EXISTS habits (
@@ -40,6 +112,54 @@ async def init_db():
         """)
         print("✅ [DB] Таблица 'habits' создана или уже существует")
 
+        # Удалённые привычки сразу скрываются (deleted_at), а их логи вычищаются в фоне
+        cursor = await db.execute("PRAGMA table_info(habits)")
+        habit_columns = [col[1] for col in await cursor.fetchall()]
+        if "deleted_at" not in habit_columns:
+            await db.execute("ALTER TABLE habits ADD COLUMN deleted_at TIMESTAMP DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'deleted_at' в таблицу 'habits'")
+
+        # Расписание: маска дней недели (бит 0 — понедельник, 127 — каждый день)
+        # или цель «N раз в неделю» (per_week, тогда маска не используется)
+        if "schedule_mask" not in habit_columns:
+            await db.execute("ALTER TABLE habits ADD COLUMN schedule_mask INTEGER NOT NULL DEFAULT 127")
+            print("➕ [DB] Добавлен столбец 'schedule_mask' в таблицу 'habits'")
+        if "per_week" not in habit_columns:
+            await db.execute("ALTER TABLE habits ADD COLUMN per_week INTEGER DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'per_week' в таблицу 'habits'")
+
+        # Количественные привычки: дневная цель (литры, страницы...) и единица измерения.
+        # target IS NULL — обычная привычка «сделал / не сделал»
+        if "target" not in habit_columns:
+            await db.execute("ALTER TABLE habits ADD COLUMN target REAL DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'target' в таблицу 'habits'")
+        if "unit" not in habit_columns:
+            await db.execute("ALTER TABLE habits ADD COLUMN unit TEXT DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'unit' в таблицу 'habits'")
+
+        # Привычка участника общего челленджа (у каждого участника — своя привычка-копия)
+        if "challenge_id" not in habit_columns:
+            await db.execute("ALTER TABLE habits ADD COLUMN challenge_id INTEGER DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'challenge_id' в таблицу 'habits'")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_habits_deleted ON habits(habit_id) WHERE deleted_at IS NOT NULL"
+        )
+
+        # Привычки пользователя по порядку ID — для списков и постраничного вывода
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_habits_user ON habits(user_id, habit_id)")
+
+        # Одно название — одна живая привычка у пользователя (без учёта регистра): на этом индексе
+        # держится upsert в add_habit. Удалённые не мешают завести привычку с тем же названием.
+        # Старые дубли («Run» и «run») сначала переименовываем, иначе индекс не построить.
+        # Если он всё же не создастся — миграция падает, версия схемы не меняется, и при
+        # следующем запуске попытка повторится.
+        renamed_habits = await _rename_duplicate_habits(db)
+        await db.execute("DROP INDEX IF EXISTS idx_habits_user_name")
+        await db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_habits_user_name ON habits(user_id, name COLLATE NOCASE) "
+            "WHERE deleted_at IS NULL"
+        )
+
         # Таблица логов выполнения
         await db.execute("""
             CREATE TABLE IF NOT EXISTS habit_logs (
@@ -53,17 +173,197 @@ async def init_db():
         """)
         print("✅ [DB] Таблица 'habit_logs' создана или уже существует")
 
+        # Сколько записано за день у количественной привычки (done = дневная цель достигнута)
+        cursor = await db.execute("PRAGMA table_info(habit_logs)")
+        if "value" not in [col[1] for col in await cursor.fetchall()]:
+            await db.execute("ALTER TABLE habit_logs ADD COLUMN value REAL DEFAULT NULL")
+            print("➕ [DB] Добавлен столбец 'value' в таблицу 'habit_logs'")
+
+        # Нарастающие итоги количественных привычек — обновляются при каждой записи,
+        # чтобы /stats не пересчитывал их по логам (а старые логи ещё и свёрнуты в битовые карты)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS habit_totals (
+                habit_id INTEGER PRIMARY KEY,
+                first_date TEXT NOT NULL,  -- первый день с записью, YYYY-MM-DD
+                days_logged INTEGER NOT NULL DEFAULT 0,  -- дней с ненулевым значением
+                value_sum REAL NOT NULL DEFAULT 0,
+                target_hits INTEGER NOT NULL DEFAULT 0,  -- дней, когда цель достигнута
+                FOREIGN KEY (habit_id) REFERENCES habits(habit_id) ON DELETE CASCADE
+            )
+        """)
+        print("✅ [DB] Таблица 'habit_totals' создана или уже существует")
+
+        # Общие челленджи: число участников и отметок за день — счётчики, которые двигаются
+        # при вступлении/выходе и при каждой отметке, а не пересчитываются по логам участников
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS challenges (
+                challenge_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                owner_id INTEGER NOT NULL,
+                code TEXT NOT NULL UNIQUE,  -- код для /challenge join
+                member_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS challenge_members (
+                challenge_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                board_message_id INTEGER DEFAULT NULL,  -- закреплённая доска в личке участника
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (challenge_id, user_id),
+                FOREIGN KEY (challenge_id) REFERENCES challenges(challenge_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_challenge_members_user ON challenge_members(user_id)")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS challenge_daily (
+                challenge_id INTEGER NOT NULL,
+                date TEXT NOT NULL,  -- местная дата участника, YYYY-MM-DD
+                done_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (challenge_id, date),
+                FOREIGN KEY (challenge_id) REFERENCES challenges(challenge_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        # Челленджи, чьи доски нужно перерисовать: сюда пишет отметка, разбирает фоновая задача
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS challenge_board_dirty (
+                challenge_id INTEGER PRIMARY KEY
+            )
+        """)
+        print("✅ [DB] Таблицы челленджей созданы или уже существуют")
+
+        # Архив старых логов: одна битовая карта на привычку за год
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS habit_log_archive (
+                habit_id INTEGER NOT NULL,
+                year INTEGER NOT NULL,
+                bits BLOB NOT NULL,  -- 2 бита на день: 00 нет отметки, 01 сделано, 10 пропущено
+                PRIMARY KEY (habit_id, year),
+                FOREIGN KEY (habit_id) REFERENCES habits(habit_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        print("✅ [DB] Таблица 'habit_log_archive' создана или уже существует")
+
+        # Ночные агрегаты: нарастающие итоги по привычке на каждый день с отметками
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS habit_daily_aggregates (
+                habit_id INTEGER NOT NULL,
+                date TEXT NOT NULL,  -- формат YYYY-MM-DD
+                done_total INTEGER NOT NULL,  -- сделано дней с начала истории по эту дату включительно
+                skipped_total INTEGER NOT NULL,
+                PRIMARY KEY (habit_id, date),
+                FOREIGN KEY (habit_id) REFERENCES habits(habit_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        # Привычки, которые дозаполнили задним числом: агрегаты нужно пересчитать с from_date
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS habit_rollup_dirty (
+                habit_id INTEGER PRIMARY KEY,
+                from_date TEXT NOT NULL
+            )
+        """)
+        # Служебные значения (до какой даты посчитаны агрегаты и т.п.)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS app_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        print("✅ [DB] Таблицы агрегатов созданы или уже существуют")
+
+        # Очередь исходящих напоминаний: переживает рестарт, повторяет отправку с паузой
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS reminder_outbox (
+                outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                reminder_date TEXT NOT NULL,  -- на какой день напоминание, YYYY-MM-DD
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',  -- pending / sent / failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,  -- unix time
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(user_id, reminder_date)
+            )
+        """)
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON reminder_outbox(next_attempt_at) WHERE status = 'pending'"
+        )
+        print("✅ [DB] Таблица 'reminder_outbox' создана или уже существует")
+
+        # Аренды (leases): кто из запущенных экземпляров бота сейчас ведущий
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL  -- unix time
+            )
+        """)
+        print("✅ [DB] Таблица 'leases' создана или уже существует")
+
+        # Полнотекстовый индекс по названиям привычек для инлайн-поиска. rowid = habit_id,
+        # owner — токен владельца «u<user_id>»: поиск сразу ограничен привычками одного пользователя.
+        # prefix='1 2 3' — готовые индексы коротких префиксов: поиск на каждое нажатие клавиши.
+        # unicode61 снимает диакритику только с латиницы, поэтому ё → е делаем сами (_FTS_NAME).
+        cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'habits_fts'")
+        if not await cursor.fetchone():
+            await db.execute("""
+                CREATE VIRTUAL TABLE habits_fts USING fts5(
+                    owner, name,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '1 2 3'
+                )
+            """)
+            await db.execute(
+                f"INSERT INTO habits_fts (rowid, owner, name) "
+                f"SELECT habit_id, 'u' || user_id, {_FTS_NAME} FROM habits WHERE deleted_at IS NULL"
+            )
+            print("✅ [DB] Создан поисковый индекс 'habits_fts'")
+        if renamed_habits:
+            await _fts_index(db, renamed_habits)
+
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         await db.commit()
-        print("💾 [DB] Все изменения сохранены")
+        print(f"💾 [DB] Все изменения сохранены, версия схемы: {SCHEMA_VERSION}")
 
         # Проверка: какие таблицы есть?
         cursor = await db.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = await cursor.fetchall()
         print("📋 [DB] Существующие таблицы:", [t[0] for t in tables])
 
+async def _rename_duplicate_habits(db) -> list[int]:
+    """Живые привычки пользователя с одинаковым (без учёта регистра) названием: самая старая
+    остаётся как есть, остальные получают суффикс « (2)», « (3)»... История не теряется.
+    Возвращает ID переименованных."""
+    cursor = await db.execute("""
+        SELECT habit_id, user_id, name FROM (
+            SELECT habit_id, user_id, name, ROW_NUMBER() OVER (
+                PARTITION BY user_id, name COLLATE NOCASE ORDER BY habit_id
+            ) AS copy
+            FROM habits WHERE deleted_at IS NULL
+        ) WHERE copy > 1 ORDER BY habit_id
+    """)
+    renamed = []
+    for habit_id, user_id, name in await cursor.fetchall():
+        number = 2
+        while True:
+            candidate = f"{name} ({number})"
+            cursor = await db.execute(
+                "SELECT 1 FROM habits WHERE user_id = ? AND name = ? COLLATE NOCASE AND deleted_at IS NULL",
+                (user_id, candidate)
+            )
+            if not await cursor.fetchone():
+                break
+            number += 1
+        await db.execute("UPDATE habits SET name = ? WHERE habit_id = ?", (candidate, habit_id))
+        renamed.append(habit_id)
+        print(f"✏️ [DB] Привычка {habit_id} пользователя {user_id}: «{name}» → «{candidate}» (дубль названия)")
+    return renamed
+
 async def add_user(user_id: int, username: str = None):
     """Добавляет пользователя, если его ещё нет"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         await db.execute(
             "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
             (user_id, username)
@@ -71,43 +371,96 @@ async def add_user(user_id: int, username: str = None):
         await db.commit()
         print(f"👤 [DB] Пользователь {user_id} добавлен или уже существует")
 
-async def add_habit(user_id: int, habit_name: str) -> int | None:
-    """Добавляет привычку, если такой ещё нет. Если есть — возвращает существующий ID."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Сначала проверяем, есть ли уже такая привычка у пользователя
-        cursor = await db.execute(
-            "SELECT habit_id FROM habits WHERE user_id = ? AND name = ? COLLATE NOCASE",
-            (user_id, habit_name)
-        )
-        existing = await cursor.fetchone()
+async def add_habit(user_id: int, habit_name: str) -> tuple[int, bool]:
+    """Добавляет привычку, если такой ещё нет (название без учёта регистра).
+    Возвращает (habit_id, created): created=False — привычка уже была."""
+    async with connect() as db:
+        habit_id, created = await _upsert_habit(db, user_id, habit_name)
+        await db.commit()
+
+    if created:
+        print(f"📝 [DB] Привычка '{habit_name}' (ID: {habit_id}) добавлена для пользователя {user_id}")
+    else:
+        print(f"🔁 [DB] Привычка '{habit_name}' уже существует (ID: {habit_id})")
+    return habit_id, created
 
-        if existing:
-            habit_id = existing[0]
-            print(f"🔁 [DB] Привычка '{habit_name}' уже существует (ID: {habit_id})")
-            return habit_id
+_FTS_NAME = "replace(replace(name, 'ё', 'е'), 'Ё', 'Е')"
 
-        # Если не нашли — добавляем новую
-        await add_user(user_id)
+async def _upsert_habit(db, user_id: int, habit_name: str) -> tuple[int, bool]:
+    """Заводит привычку в транзакции вызывающего или находит уже существующую: (habit_id, created)"""
+    # Пользователь и привычка — в одной транзакции, без отдельной проверки «есть ли уже»
+    await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+    cursor = await db.execute(
+        "INSERT INTO habits (user_id, name) VALUES (?, ?) ON CONFLICT DO NOTHING RETURNING habit_id",
+        (user_id, habit_name)
+    )
+    row = await cursor.fetchone()
+    if row:
+        await _fts_index(db, [row[0]])
+        return row[0], True
 
+    # Уже есть — индекс idx_habits_user_name находит её сразу
+    cursor = await db.execute(
+        "SELECT habit_id FROM habits WHERE user_id = ? AND name = ? COLLATE NOCASE AND deleted_at IS NULL",
+        (user_id, habit_name)
+    )
+    return (await cursor.fetchone())[0], False
+
+async def _fts_index(db, habit_ids: list[int]):
+    """(Пере)индексирует названия привычек в habits_fts — в транзакции вызывающего"""
+    placeholders = ",".join("?" * len(habit_ids))
+    await db.execute(f"DELETE FROM habits_fts WHERE rowid IN ({placeholders})", habit_ids)
+    await db.execute(
+        f"INSERT INTO habits_fts (rowid, owner, name) SELECT habit_id, 'u' || user_id, {_FTS_NAME} "
+        f"FROM habits WHERE habit_id IN ({placeholders}) AND deleted_at IS NULL",
+        habit_ids
+    )
+
+def _fts_query(user_id: int, text: str) -> str:
+    """Запрос FTS5: привычки пользователя, где каждое слово из text — начало какого-то слова названия.
+    Слова берём в кавычки, чтобы символы вроде * или : не ломали синтаксис MATCH."""
+    words = re.findall(r"[^\W_]+", text.replace("ё", "е").replace("Ё", "Е"))
+    terms = " AND ".join(f'name : "{word}" *' for word in words)
+    return f'owner : "u{user_id}"' + (f" AND {terms}" if terms else "")
+
+async def search_user_habits(user_id: int, text: str, limit: int = 50) -> list[tuple[int, str]]:
+    """Поиск по названиям привычек пользователя (по началу слов, без учёта регистра): [(habit_id, name), ...]"""
+    async with connect() as db:
         cursor = await db.execute(
-            "INSERT INTO habits (user_id, name) VALUES (?, ?) RETURNING habit_id",
-            (user_id, habit_name)
+            "SELECT h.habit_id, h.name FROM habits_fts f JOIN habits h ON h.habit_id = f.rowid "
+            "WHERE habits_fts MATCH ? ORDER BY f.rowid LIMIT ?",
+            (_fts_query(user_id, text), limit)
         )
-        row = await cursor.fetchone()
-        await db.commit()
+        return await cursor.fetchall()
 
-        if row:
-            habit_id = row[0]
-            print(f"📝 [DB] Привычка '{habit_name}' (ID: {habit_id}) добавлена для пользователя {user_id}")
-            return habit_id
-        else:
-            print(f"❌ [DB] Ошибка при добавлении привычки '{habit_name}'")
-            return None
+async def _user_today(db, user_id: int) -> date:
+    """Сегодняшняя дата в часовом поясе пользователя (один поиск по первичному ключу)"""
+    cursor = await db.execute("SELECT tz FROM users WHERE user_id = ?", (user_id,))
+    row = await cursor.fetchone()
+    return local_today(row[0] if row else None)
+
+async def _habit_today(db, habit_id: int) -> date:
+    """Сегодняшняя дата в часовом поясе владельца привычки"""
+    cursor = await db.execute(
+        "SELECT u.tz FROM habits h JOIN users u ON u.user_id = h.user_id WHERE h.habit_id = ?",
+        (habit_id,)
+    )
+    row = await cursor.fetchone()
+    return local_today(row[0] if row else None)
+
+async def get_user_today(user_id: int) -> date:
+    """Сегодняшняя дата для пользователя — граница дня для отметок, цепочек и статистики"""
+    async with connect() as db:
+        return await _user_today(db, user_id)
 
 async def mark_habit_done(habit_id: int, done: bool = True):
-    """Отмечает выполнение привычки на сегодня"""
-    today = date.today().isoformat()  # "2025-04-05"
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Отмечает выполнение привычки на сегодня (по часовому поясу владельца)"""
+    async with connect() as db:
+        today = (await _habit_today(db, habit_id)).isoformat()  # "2025-04-05"
+        cursor = await db.execute(
+            "SELECT done, value IS NOT NULL FROM habit_logs WHERE habit_id = ? AND date = ?", (habit_id, today)
+        )
+        old_done, valued = map(bool, await cursor.fetchone() or (False, False))
         await db.execute(
             """
             INSERT INTO habit_logs (habit_id, date, done)
@@ -116,64 +469,463 @@ async def mark_habit_done(habit_id: int, done: bool = True):
             """,
             (habit_id, today, done)
         )
+        # Как и в mark_habits_batch: ручная отметка дня со значением меняет число дней с целью
+        if valued and bool(done) != old_done:
+            await db.execute(
+                "UPDATE habit_totals SET target_hits = target_hits + ? WHERE habit_id = ?",
+                (bool(done) - old_done, habit_id)
+            )
+        await _count_challenge_marks(db, [(habit_id, today, old_done, bool(done))])
         await db.commit()
         status = "✅" if done else "❌"
         print(f"[DB] Привычка {habit_id} отмечена как {status} на {today}")
 
-async def get_habit_streak(habit_id: int) -> int:
-    """Возвращает текущую цепочку дней подряд (streak)"""
-    today = date.today()
-    async with aiosqlite.connect(DB_PATH) as db:
+async def mark_habits_batch(user_id: int, marks: list[tuple[int, str, bool]]) -> dict[int, int]:
+    """Отмечает сразу много (habit_id, дата YYYY-MM-DD, сделано) одной транзакцией.
+    Чужие и несуществующие привычки молча отбрасываются.
+    Возвращает {habit_id: текущая цепочка} для привычек, которые удалось отметить."""
+    if not marks:
+        return {}
+
+    habit_ids = sorted({habit_id for habit_id, _, _ in marks})
+    placeholders = ",".join("?" * len(habit_ids))
+
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
         cursor = await db.execute(
+            f"SELECT habit_id FROM habits WHERE user_id = ? AND habit_id IN ({placeholders}) AND deleted_at IS NULL",
+            (user_id, *habit_ids)
+        )
+        owned = {row[0] for row in await cursor.fetchall()}
+        rows = [(habit_id, day, done) for habit_id, day, done in marks if habit_id in owned]
+
+        # Что было в эти дни до отметки: (сделано, есть значение)
+        old_logs = {}
+        days = sorted({day for _, day, _ in rows})
+        if days:
+            cursor = await db.execute(
+                f"SELECT habit_id, date, done, value IS NOT NULL FROM habit_logs WHERE habit_id IN ({placeholders}) "
+                f"AND date IN ({','.join('?' * len(days))})",
+                (*habit_ids, *days)
+            )
+            old_logs = {(habit_id, day): (bool(done), bool(valued)) for habit_id, day, done, valued in await cursor.fetchall()}
+
+        # Дни количественных привычек, где уже записано значение: ручная отметка меняет число
+        # дней с достигнутой целью — держим habit_totals в согласии с логами
+        hits: dict[int, int] = {}
+        changes = []
+        for habit_id, day, done in rows:
+            old_done, valued = old_logs.get((habit_id, day), (False, False))
+            if valued:
+                hits[habit_id] = hits.get(habit_id, 0) + bool(done) - old_done
+            changes.append((habit_id, day, old_done, bool(done)))
+            old_logs[(habit_id, day)] = (bool(done), valued)
+        await _count_challenge_marks(db, changes)
+        await db.executemany(
+            "UPDATE habit_totals SET target_hits = target_hits + ? WHERE habit_id = ?",
+            [(delta, habit_id) for habit_id, delta in hits.items() if delta]
+        )
+
+        await db.executemany(
             """
-            SELECT date FROM habit_logs
-            WHERE habit_id = ? AND done = 1
-            ORDER BY date DESC
+            INSERT INTO habit_logs (habit_id, date, done)
+            VALUES (?, ?, ?)
+            ON CONFLICT(habit_id, date) DO UPDATE SET done = excluded.done
             """,
-            (habit_id,)
+            rows
         )
-        rows = await cursor.fetchall()
 
-        if not rows:
-            return 0
+        # Отметки задним числом сдвигают нарастающие итоги — пересчитаем их ночью
+        today = await _user_today(db, user_id)
+        today_iso = today.isoformat()
+        dirty = {}
+        for habit_id, day, _ in rows:
+            if day < today_iso:
+                dirty[habit_id] = min(day, dirty.get(habit_id, day))
+        await db.executemany(
+            """
+            INSERT INTO habit_rollup_dirty (habit_id, from_date) VALUES (?, ?)
+            ON CONFLICT(habit_id) DO UPDATE SET from_date = MIN(from_date, excluded.from_date)
+            """,
+            list(dirty.items())
+        )
+        await db.commit()
+        print(f"[DB] Пакетная отметка: {len(rows)} записей для пользователя {user_id}")
+
+        return {habit_id: await _current_streak(db, habit_id, today) for habit_id in sorted(owned)}
+
+async def log_habit_amount(user_id: int, habit_id: int, amount: float, day: date | None = None) -> dict | None:
+    """Добавляет количество (литры, страницы...) к записи за день — по умолчанию за сегодня.
+    День засчитывается сделанным, когда набрана дневная цель (без цели — любое ненулевое значение).
+    В той же транзакции сдвигает нарастающие итоги habit_totals на разницу «было → стало».
+    None — если привычки нет или она чужая."""
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute(
+            "SELECT name, target, unit FROM habits WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
+            (habit_id, user_id)
+        )
+        habit = await cursor.fetchone()
+        if not habit:
+            await db.rollback()
+            return None
+        name, target, unit = habit
 
-        streak = 0
-        expected_date = today
+        today = await _user_today(db, user_id)
+        day = day or today
+        cursor = await db.execute(
+            "SELECT value, done FROM habit_logs WHERE habit_id = ? AND date = ?",
+            (habit_id, day.isoformat())
+        )
+        old = await cursor.fetchone()
+        old_value = old[0] if old and old[0] is not None else 0.0
+        old_hit = bool(old and old[0] is not None and old[1])
 
-        for (log_date,) in rows:
-            log_date = date.fromisoformat(log_date)
-            if log_date == expected_date:
+        value = max(old_value + amount, 0.0)
+        reached = value >= target if target else value > 0
+
+        await db.execute(
+            """
+            INSERT INTO habit_logs (habit_id, date, done, value)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(habit_id, date) DO UPDATE SET done = excluded.done, value = excluded.value
+            """,
+            (habit_id, day.isoformat(), reached, value)
+        )
+        await db.execute(
+            """
+            INSERT INTO habit_totals (habit_id, first_date, days_logged, value_sum, target_hits)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(habit_id) DO UPDATE SET
+                first_date = MIN(first_date, excluded.first_date),
+                days_logged = days_logged + excluded.days_logged,
+                value_sum = value_sum + excluded.value_sum,
+                target_hits = target_hits + excluded.target_hits
+            """,
+            (habit_id, day.isoformat(), (value > 0) - (old_value > 0), value - old_value, reached - old_hit)
+        )
+        await _count_challenge_marks(db, [(habit_id, day.isoformat(), bool(old and old[1]), reached)])
+        if day < today:
+            await db.execute(
+                """
+                INSERT INTO habit_rollup_dirty (habit_id, from_date) VALUES (?, ?)
+                ON CONFLICT(habit_id) DO UPDATE SET from_date = MIN(from_date, excluded.from_date)
+                """,
+                (habit_id, day.isoformat())
+            )
+        await db.commit()
+        print(f"📏 [DB] Привычка {habit_id}: {value:g} из {target or 0:g} на {day}")
+
+        return {
+            "name": name,
+            "value": value,
+            "target": target,
+            "unit": unit,
+            "reached": reached,
+            "streak": await _live_streak(db, habit_id, today),
+        }
+
+async def set_habit_target(habit_id: int, user_id: int, target: float | None, unit: str | None = None) -> bool:
+    """Ставит дневную цель количественной привычки (None — снова «сделал / не сделал»).
+    Уже записанные дни не пересчитываются: цель действует с сегодняшнего дня."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "UPDATE habits SET target = ?, unit = ? WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
+            (target, unit if target else None, habit_id, user_id)
+        )
+        await db.commit()
+        return cursor.rowcount > 0
+
+async def get_habit_totals(user_id: int) -> list[dict]:
+    """Итоги количественных привычек пользователя: сумма, среднее за день с записью и доля
+    дней с достигнутой целью среди дней по расписанию с первой записи. Всё — из habit_totals,
+    без прохода по логам."""
+    async with connect() as db:
+        today = await _user_today(db, user_id)
+        cursor = await db.execute(
+            """
+            SELECT h.name, h.target, h.unit, h.schedule_mask, h.per_week,
+                   t.first_date, t.days_logged, t.value_sum, t.target_hits
+            FROM habits h JOIN habit_totals t ON t.habit_id = h.habit_id
+            WHERE h.user_id = ? AND h.deleted_at IS NULL
+            ORDER BY h.habit_id
+            """,
+            (user_id,)
+        )
+        totals = []
+        for name, target, unit, mask, per_week, first_date, days_logged, value_sum, hits in await cursor.fetchall():
+            due = _due_days(mask, per_week, date.fromisoformat(first_date), today)
+            totals.append({
+                "name": name,
+                "target": target,
+                "unit": unit,
+                "sum": value_sum,
+                "avg": value_sum / days_logged if days_logged else 0.0,
+                "days": days_logged,
+                "hit_rate": min(hits / due, 1.0) if due else 0.0,
+            })
+        return totals
+
+async def _load_habit_history(db, habit_id: int, since: date | None = None) -> dict[date, bool]:
+    """Собирает историю привычки {дата: сделано} из архива и из свежих логов (начиная с since).
+    Строки habit_logs важнее архива (например, если день дозаполнили задним числом)."""
+    since = since or date.min
+    history = {}
+    cursor = await db.execute(
+        "SELECT year, bits FROM habit_log_archive WHERE habit_id = ? AND year >= ? ORDER BY year",
+        (habit_id, since.year)
+    )
+    for year, bits in await cursor.fetchall():
+        history.update((day, done) for day, done in decode_year(year, bits).items() if day >= since)
+
+    cursor = await db.execute(
+        "SELECT date, done FROM habit_logs WHERE habit_id = ? AND date >= ?",
+        (habit_id, since.isoformat())
+    )
+    for log_date, done in await cursor.fetchall():
+        history[date.fromisoformat(log_date)] = bool(done)
+    return history
+
+EVERY_DAY = 0b1111111  # маска расписания «каждый день»
+
+def _is_due(mask: int, day: date) -> bool:
+    """Нужно ли выполнять привычку в этот день по маске дней недели"""
+    return bool(mask >> day.weekday() & 1)
+
+def _due_days(mask: int, per_week: int | None, start: date, end: date) -> float:
+    """Сколько дней в отрезке [start, end] привычку нужно выполнить по расписанию"""
+    days = (end - start).days + 1
+    if days <= 0:
+        return 0
+    if per_week:
+        return days * per_week / 7
+    weeks, rest = divmod(days, 7)
+    # Полные недели — через число единиц в маске, остаток (< 7 дней) — по битам
+    rest_mask = sum(1 << ((start.weekday() + i) % 7) for i in range(rest))
+    return weeks * mask.bit_count() + (mask & rest_mask).bit_count()
+
+async def _habit_schedule(db, habit_id: int) -> tuple[int, int | None]:
+    cursor = await db.execute("SELECT schedule_mask, per_week FROM habits WHERE habit_id = ?", (habit_id,))
+    row = await cursor.fetchone()
+    return row if row else (EVERY_DAY, None)
+
+def _longest_streak(history: dict[date, bool], mask: int = EVERY_DAY, per_week: int | None = None,
+                    today: date | None = None) -> int:
+    """Самая длинная цепочка выполненных дней с учётом расписания:
+    дни не по расписанию цепочку не рвут; для «N раз в неделю» цепочка — это подряд идущие
+    недели, где цель выполнена (считаем в сделанных днях). Неделя с today ещё идёт —
+    как и в _current_streak, её дни засчитываются, даже если цель пока не набрана."""
+    done_days = sorted(d for d, done in history.items() if done)
+    if not done_days:
+        return 0
+
+    best = current = 0
+    if per_week:
+        weeks: dict[date, int] = {}
+        for day in done_days:
+            monday = day - timedelta(days=day.weekday())
+            weeks[monday] = weeks.get(monday, 0) + 1
+        week, last = min(weeks), max(weeks)
+        this_week = today - timedelta(days=today.weekday()) if today else None
+        while week <= last:
+            count = weeks.get(week, 0)
+            current = current + count if count >= per_week or week == this_week else 0
+            best = max(best, current)
+            week += timedelta(days=7)
+        return best
+
+    day, last = done_days[0], done_days[-1]
+    while day <= last:
+        if history.get(day):
+            current += 1
+            best = max(best, current)
+        elif _is_due(mask, day):
+            current = 0
+        day += timedelta(days=1)
+    return best
+
+async def _current_streak(db, habit_id: int, today: date) -> int:
+    """Считает текущую цепочку на уже открытом соединении: идём назад от today,
+    пока дни отмечены как сделанные (в логах или в архиве). Дни не по расписанию
+    пропускаем; для «N раз в неделю» идём по неделям."""
+    mask, per_week = await _habit_schedule(db, habit_id)
+    cursor = await db.execute(
+        "SELECT date, done FROM habit_logs WHERE habit_id = ?",
+        (habit_id,)
+    )
+    recent = {date.fromisoformat(d): bool(done) for d, done in await cursor.fetchall()}
+    oldest_recent = min(recent) if recent else None
+    archive_year, archive_bits = None, None
+
+    async def done_on(day: date) -> bool | None:
+        """Сделано ли в этот день; None — раньше истории уже нет"""
+        nonlocal archive_year, archive_bits
+        if day in recent:
+            return recent[day]
+        # Старые дни лежат в архиве — подгружаем по году
+        if archive_year != day.year:
+            archive_year = day.year
+            cursor = await db.execute(
+                "SELECT bits FROM habit_log_archive WHERE habit_id = ? AND year = ?",
+                (habit_id, archive_year)
+            )
+            row = await cursor.fetchone()
+            archive_bits = row[0] if row else None
+        if archive_bits is not None:
+            return get_day(archive_bits, day_index(day)) == DAY_DONE
+        return False if oldest_recent and day >= oldest_recent else None
+
+    streak = 0
+    if per_week:
+        # Текущая неделя ещё идёт — её сделанные дни засчитываем в любом случае
+        week_start = today - timedelta(days=today.weekday())
+        for i in range(today.weekday() + 1):
+            if await done_on(week_start + timedelta(days=i)):
                 streak += 1
-                expected_date = expected_date.replace(day=expected_date.day - 1)
-            else:
+        # Прошлые недели — пока в каждой цель выполнена
+        while True:
+            week_start -= timedelta(days=7)
+            count = 0
+            for i in range(7):
+                if await done_on(week_start + timedelta(days=i)):
+                    count += 1
+            if count < per_week:
                 break
-
+            streak += count
         return streak
 
+    expected_date = today
+    while True:
+        done = await done_on(expected_date)
+        if done is None:
+            break
+        if done:
+            streak += 1
+        elif _is_due(mask, expected_date):
+            break
+        expected_date -= timedelta(days=1)
+
+    return streak
+
+async def get_habit_streak(habit_id: int) -> int:
+    """Возвращает текущую цепочку дней подряд (streak)"""
+    async with connect() as db:
+        return await _current_streak(db, habit_id, await _habit_today(db, habit_id))
+
+async def _live_streak(db, habit_id: int, today: date) -> int:
+    """Цепочка, которая ещё «жива»: заканчивается сегодня или вчера, если сегодня пока не отмечено"""
+    streak = await _current_streak(db, habit_id, today)
+    _, per_week = await _habit_schedule(db, habit_id)
+    if streak or per_week:
+        return streak  # у «N раз в неделю» текущая неделя и так не рвёт цепочку
+    cursor = await db.execute(
+        "SELECT 1 FROM habit_logs WHERE habit_id = ? AND date = ? AND value IS NULL",
+        (habit_id, today.isoformat())
+    )
+    if await cursor.fetchone():
+        return 0  # сегодня явно пропущено — цепочка прервана (а не «цель пока не набрана»)
+    return await _current_streak(db, habit_id, today - timedelta(days=1))
+
+async def get_user_live_streak(user_id: int) -> int:
+    """Лучшая «живая» цепочка среди всех привычек пользователя"""
+    async with connect() as db:
+        today = await _user_today(db, user_id)
+        cursor = await db.execute("SELECT habit_id FROM habits WHERE user_id = ? AND deleted_at IS NULL", (user_id,))
+        best = 0
+        for (habit_id,) in await cursor.fetchall():
+            best = max(best, await _live_streak(db, habit_id, today))
+        return best
+
+async def set_leaderboard_opt_in(user_id: int, enabled: bool, display_name: str = None):
+    """Включает или выключает участие пользователя в рейтинге /top"""
+    async with connect() as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
+            (user_id, display_name)
+        )
+        await db.execute(
+            "UPDATE users SET leaderboard_opt_in = ?, username = COALESCE(?, username) WHERE user_id = ?",
+            (int(enabled), display_name, user_id)
+        )
+        await db.commit()
+        print(f"🏆 [DB] Участие пользователя {user_id} в рейтинге: {'да' if enabled else 'нет'}")
+
+async def get_leaderboard_members() -> list[tuple[int, str]]:
+    """Все, кто согласился участвовать в рейтинге: [(user_id, имя), ...]"""
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT user_id, COALESCE(username, 'Аноним') FROM users WHERE leaderboard_opt_in = 1"
+        )
+        return await cursor.fetchall()
+
 async def get_user_habits(user_id: int):
     """Получает список привычек пользователя: [(habit_id, name), ...]"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         cursor = await db.execute(
-            "SELECT habit_id, name FROM habits WHERE user_id = ?",
+            "SELECT habit_id, name FROM habits WHERE user_id = ? AND deleted_at IS NULL",
             (user_id,)
         )
         rows = await cursor.fetchall()
         return rows
 
+async def get_user_habits_page(user_id: int, after_id: int | None = None, before_id: int | None = None,
+                               limit: int = 10) -> tuple[list[tuple[int, str]], bool, bool]:
+    """Страница привычек по ключу habit_id (keyset), без OFFSET:
+    after_id — следующая страница, before_id — предыдущая, ничего — первая.
+    Возвращает (привычки, есть_предыдущая, есть_следующая)."""
+    async with connect() as db:
+        if before_id is not None:
+            cursor = await db.execute(
+                "SELECT habit_id, name FROM habits WHERE user_id = ? AND habit_id < ? AND deleted_at IS NULL ORDER BY habit_id DESC LIMIT ?",
+                (user_id, before_id, limit + 1)
+            )
+            rows = await cursor.fetchall()
+            has_prev = len(rows) > limit
+            rows = rows[:limit][::-1]
+        else:
+            cursor = await db.execute(
+                "SELECT habit_id, name FROM habits WHERE user_id = ? AND habit_id > ? AND deleted_at IS NULL ORDER BY habit_id LIMIT ?",
+                (user_id, after_id or 0, limit + 1)
+            )
+            rows = await cursor.fetchall()
+            has_prev = None
+            has_next = len(rows) > limit
+            rows = rows[:limit]
+
+        if not rows:
+            return [], False, False
+
+        # Вторая граница — одной проверкой по индексу
+        if has_prev is None:
+            cursor = await db.execute(
+                "SELECT 1 FROM habits WHERE user_id = ? AND habit_id < ? AND deleted_at IS NULL LIMIT 1",
+                (user_id, rows[0][0])
+            )
+            has_prev = await cursor.fetchone() is not None
+        else:
+            cursor = await db.execute(
+                "SELECT 1 FROM habits WHERE user_id = ? AND habit_id > ? AND deleted_at IS NULL LIMIT 1",
+                (user_id, rows[-1][0])
+            )
+            has_next = await cursor.fetchone() is not None
+
+        return rows, has_prev, has_next
+
 async def get_user_stats(user_id: int):
     """Возвращает статистику пользователя: всего привычек, выполнено/пропущено сегодня, лучшая цепочка"""
-    today = date.today().isoformat()
+    async with connect() as db:
+        today_date = await _user_today(db, user_id)
+        today = today_date.isoformat()
 
-    async with aiosqlite.connect(DB_PATH) as db:
         # Всего привычек
-        cursor = await db.execute("SELECT COUNT(*) FROM habits WHERE user_id = ?", (user_id,))
+        cursor = await db.execute("SELECT COUNT(*) FROM habits WHERE user_id = ? AND deleted_at IS NULL", (user_id,))
         total_habits = (await cursor.fetchone())[0]
 
         # Выполнено сегодня
         cursor = await db.execute("""
             SELECT COUNT(*) FROM habit_logs hl
             JOIN habits h ON hl.habit_id = h.habit_id
-            WHERE h.user_id = ? AND hl.date = ? AND hl.done = 1
+            WHERE h.user_id = ? AND h.deleted_at IS NULL AND hl.date = ? AND hl.done = 1
         """, (user_id, today))
         done_today = (await cursor.fetchone())[0]
 
@@ -181,37 +933,26 @@ async def get_user_stats(user_id: int):
         cursor = await db.execute("""
             SELECT COUNT(*) FROM habit_logs hl
             JOIN habits h ON hl.habit_id = h.habit_id
-            WHERE h.user_id = ? AND hl.date = ? AND hl.done = 0
+            WHERE h.user_id = ? AND h.deleted_at IS NULL AND hl.date = ? AND hl.done = 0 AND hl.value IS NULL
         """, (user_id, today))
         skipped_today = (await cursor.fetchone())[0]
 
-        # Лучшая цепочка среди всех привычек
-        cursor = await db.execute("""
-            SELECT h.name, MAX(streak_table.streak) as max_streak
-            FROM habits h
-            JOIN (
-                SELECT habit_id, COUNT(*) as streak
-                FROM (
-                    SELECT habit_id, date, done,
-                           date(date, '-' || ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY date DESC) || ' days') as grp
-                    FROM habit_logs
-                    WHERE done = 1
-                )
-                GROUP BY habit_id, grp
-            ) as streak_table ON h.habit_id = streak_table.habit_id
-            WHERE h.user_id = ?
-            GROUP BY h.habit_id
-            ORDER BY max_streak DESC
-            LIMIT 1
-        """, (user_id,))
-        best_streak_row = await cursor.fetchone()
-        best_streak_name = best_streak_row[0] if best_streak_row else None
-        best_streak_value = best_streak_row[1] if best_streak_row else 0
+        # Лучшая цепочка среди всех привычек (по логам и архиву)
+        cursor = await db.execute(
+            "SELECT habit_id, name, schedule_mask, per_week FROM habits WHERE user_id = ? AND deleted_at IS NULL",
+            (user_id,)
+        )
+        best_streak_name = None
+        best_streak_value = 0
+        for habit_id, name, mask, per_week in await cursor.fetchall():
+            value = _longest_streak(await _load_habit_history(db, habit_id), mask, per_week, today_date)
+            if value > best_streak_value:
+                best_streak_name, best_streak_value = name, value
 
         # Текущая цепочка по последней привычке
         cursor = await db.execute("""
             SELECT habit_id, name FROM habits
-            WHERE user_id = ?
+            WHERE user_id = ? AND deleted_at IS NULL
             ORDER BY habit_id DESC LIMIT 1
         """, (user_id,))
         last_habit = await cursor.fetchone()
@@ -230,19 +971,271 @@ async def get_user_stats(user_id: int):
             "current_streak": {"name": current_streak_name, "value": current_streak_value}
         }
 
+# Привычка «на сегодня»: бит дня недели в маске, а для «N раз в неделю» — цель ещё не набрана.
+# Параметры: бит сегодняшнего дня, понедельник и сегодняшняя дата. Условие не оборачивает
+# индексные столбцы в функции: привычки ищутся по idx_habits_user, отметки — по UNIQUE(habit_id, date).
+_DUE_TODAY_SQL = """
+    h.deleted_at IS NULL AND (
+        (h.per_week IS NULL AND h.schedule_mask & ? != 0)
+        OR (h.per_week IS NOT NULL AND h.per_week > (
+            SELECT COUNT(*) FROM habit_logs l
+            WHERE l.habit_id = h.habit_id AND l.date BETWEEN ? AND ? AND l.done = 1
+        ))
+    )
+"""
+
+def _due_today_params(day: date) -> tuple[int, str, str]:
+    monday = day - timedelta(days=day.weekday())
+    return 1 << day.weekday(), monday.isoformat(), day.isoformat()
+
+async def get_users_to_remind(first_minute: int, last_minute: int) -> list[tuple[int, str | None, str | None, int]]:
+    """Пользователи, чьё время напоминания попало в минуты [first_minute, last_minute]
+    (минуты от начала эпохи, UTC): [(user_id, tz, last_reminded_date, reminder_utc_minute), ...].
+    Заблокировавших бота пропускаем. Один поиск по индексу на весь тик — пояса уже учтены
+    в reminder_utc_minute. Есть ли у пользователя привычки на сегодня, проверяет
+    get_habits_due_today: у пользователей одной минуты «сегодня» может быть разным."""
+    first, last = first_minute % 1440, last_minute % 1440
+    if last_minute - first_minute >= 1439:
+        condition, params = "reminder_utc_minute IS NOT NULL", ()
+    elif first <= last:
+        condition, params = "reminder_utc_minute BETWEEN ? AND ?", (first, last)
+    else:
+        # Окно переходит через полночь по UTC
+        condition, params = "(reminder_utc_minute >= ? OR reminder_utc_minute <= ?)", (first, last)
+
+    async with connect() as db:
+        cursor = await db.execute(
+            f"SELECT user_id, tz, last_reminded_date, reminder_utc_minute FROM users WHERE {condition} AND is_blocked = 0",
+            params
+        )
+        return await cursor.fetchall()
+
+async def get_reminder_cursor() -> int | None:
+    """До какой минуты (от начала эпохи, UTC) напоминания уже разобраны"""
+    async with connect() as db:
+        value = await _get_state(db, "reminder_cursor")
+        return int(value) if value else None
+
+async def _refresh_reminder_buckets(db) -> int:
+    """Пересчитывает reminder_utc_minute из местного reminder_time: по одному UPDATE на пояс,
+    смещение пояса считается один раз (так переход на летнее время сдвигает всех сразу)"""
+    cursor = await db.execute("SELECT DISTINCT tz FROM users WHERE reminder_time IS NOT NULL")
+    updated = 0
+    for (tz,) in await cursor.fetchall():
+        minute = (
+            "(CAST(substr(reminder_time, 1, 2) AS INTEGER) * 60"
+            " + CAST(substr(reminder_time, 4, 2) AS INTEGER) - :offset + 2880) % 1440"
+        )
+        cursor = await db.execute(
+            f"""
+            UPDATE users SET reminder_utc_minute = {minute}
+            WHERE tz IS :tz AND reminder_time IS NOT NULL AND reminder_utc_minute IS NOT {minute}
+            """,
+            {"offset": utc_offset_minutes(tz), "tz": tz}
+        )
+        updated += cursor.rowcount
+    return updated
+
+async def refresh_reminder_buckets() -> int:
+    """Раз в час: сдвигает напоминания тех, у кого сменилось смещение пояса (летнее время)"""
+    async with connect() as db:
+        updated = await _refresh_reminder_buckets(db)
+        await db.commit()
+    if updated:
+        print(f"🕒 [DB] Пересчитано время напоминаний по UTC: {updated}")
+    return updated
+
+async def set_user_timezone(user_id: int, tz: str):
+    """Сохраняет часовой пояс пользователя и переводит его напоминание в новый пояс"""
+    async with connect() as db:
+        await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        cursor = await db.execute("SELECT reminder_time FROM users WHERE user_id = ?", (user_id,))
+        (reminder_time,) = await cursor.fetchone()
+        await db.execute(
+            "UPDATE users SET tz = ?, reminder_utc_minute = ? WHERE user_id = ?",
+            (tz, to_utc_minute(reminder_time, tz) if reminder_time else None, user_id)
+        )
+        await db.commit()
+        print(f"🌍 [DB] Часовой пояс пользователя {user_id}: {tz}")
+
+async def get_user_timezone(user_id: int) -> str | None:
+    async with connect() as db:
+        cursor = await db.execute("SELECT tz FROM users WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+async def get_habits_due_today(user_id: int, day: date | None = None,
+                               first_id: int | None = None, last_id: int | None = None) -> list[tuple[int, str]]:
+    """Привычки пользователя, которые по расписанию нужно сделать сегодня: [(habit_id, name), ...]
+    («сегодня» — по часовому поясу пользователя, если day не передан).
+    first_id/last_id — только привычки одной страницы (границы включительно)."""
+    async with connect() as db:
+        day = day or await _user_today(db, user_id)
+        cursor = await db.execute(
+            f"SELECT h.habit_id, h.name FROM habits h WHERE h.user_id = ? "
+            f"AND h.habit_id BETWEEN ? AND ? AND {_DUE_TODAY_SQL} ORDER BY h.habit_id",
+            (user_id, first_id or 0, last_id if last_id is not None else 2 ** 63 - 1, *_due_today_params(day))
+        )
+        return await cursor.fetchall()
+
+async def set_habit_schedule(habit_id: int, user_id: int, mask: int = EVERY_DAY, per_week: int | None = None) -> bool:
+    """Задаёт расписание привычки: маска дней недели или «N раз в неделю». True — если обновили."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "UPDATE habits SET schedule_mask = ?, per_week = ? WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
+            (mask, per_week, habit_id, user_id)
+        )
+        await db.commit()
+        return cursor.rowcount > 0
+
+async def get_habit_schedule(habit_id: int, user_id: int) -> tuple[str, int, int | None] | None:
+    """(название, маска, per_week) привычки пользователя или None"""
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT name, schedule_mask, per_week FROM habits WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
+            (habit_id, user_id)
+        )
+        return await cursor.fetchone()
+
+async def set_user_blocked(user_id: int, blocked: bool):
+    """Помечает, что пользователь заблокировал бота (или снова с ним общается)"""
+    async with connect() as db:
+        await db.execute("UPDATE users SET is_blocked = ? WHERE user_id = ?", (int(blocked), user_id))
+        if blocked:
+            await db.execute(
+                "UPDATE reminder_outbox SET status = 'failed', last_error = 'blocked' WHERE user_id = ? AND status = 'pending'",
+                (user_id,)
+            )
+        await db.commit()
+
+async def enqueue_reminders(reminders: list[tuple[int, str, str]], due_at: float, cursor: int | None = None) -> int:
+    """Кладёт напоминания (user_id, дата, текст) в очередь. Повтор на ту же дату игнорируется.
+    В той же транзакции отмечает last_reminded_date и, если передан, сдвигает курсор
+    планировщика — так минута либо разобрана целиком, либо не разобрана вовсе."""
+    async with connect() as db:
+        result = await db.executemany(
+            """
+            INSERT OR IGNORE INTO reminder_outbox (user_id, reminder_date, text, next_attempt_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            [(user_id, day, text, due_at) for user_id, day, text in reminders]
+        )
+        added = max(result.rowcount, 0)
+        await db.executemany(
+            "UPDATE users SET last_reminded_date = ? WHERE user_id = ?",
+            [(day, user_id) for user_id, day, _ in reminders]
+        )
+        if cursor is not None:
+            await _set_state(db, "reminder_cursor", str(cursor))
+        await db.commit()
+        return added
+
+async def get_due_reminders(now: float, limit: int) -> list[tuple[int, int, str, str, int, str | None]]:
+    """Напоминания, которые пора отправить: [(outbox_id, user_id, дата, текст, попыток, пояс), ...]"""
+    async with connect() as db:
+        cursor = await db.execute(
+            """
+            SELECT o.outbox_id, o.user_id, o.reminder_date, o.text, o.attempts, u.tz
+            FROM reminder_outbox o LEFT JOIN users u ON u.user_id = o.user_id
+            WHERE o.status = 'pending' AND o.next_attempt_at <= ?
+            ORDER BY o.next_attempt_at LIMIT ?
+            """,
+            (now, limit)
+        )
+        return await cursor.fetchall()
+
+async def mark_reminders_sent(outbox_ids: list[int]):
+    async with connect() as db:
+        await db.executemany(
+            "UPDATE reminder_outbox SET status = 'sent', last_error = NULL WHERE outbox_id = ?",
+            [(outbox_id,) for outbox_id in outbox_ids]
+        )
+        await db.commit()
+
+async def reschedule_reminder(outbox_id: int, next_attempt_at: float, error: str, count_attempt: bool = True):
+    """Откладывает отправку; count_attempt=False — для RetryAfter, это не наша ошибка"""
+    async with connect() as db:
+        await db.execute(
+            """
+            UPDATE reminder_outbox
+            SET next_attempt_at = ?, last_error = ?, attempts = attempts + ?
+            WHERE outbox_id = ?
+            """,
+            (next_attempt_at, error, int(count_attempt), outbox_id)
+        )
+        await db.commit()
+
+async def fail_reminder(outbox_id: int, error: str):
+    async with connect() as db:
+        await db.execute(
+            "UPDATE reminder_outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE outbox_id = ?",
+            (error, outbox_id)
+        )
+        await db.commit()
+
+async def get_outbox_counts() -> dict[str, int]:
+    """Сколько напоминаний в очереди по статусам: {'pending': .., 'sent': .., 'failed': ..}"""
+    async with connect() as db:
+        cursor = await db.execute("SELECT status, COUNT(*) FROM reminder_outbox GROUP BY status")
+        counts = {"pending": 0, "sent": 0, "failed": 0}
+        counts.update(dict(await cursor.fetchall()))
+        return counts
+
+async def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """Берёт или продлевает аренду name на ttl секунд. True — аренда наша: она была свободна,
+    истекла или уже принадлежала holder. Проверка и запись — один атомарный UPSERT."""
+    now = time.time()
+    async with connect() as db:
+        cursor = await db.execute(
+            """
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """,
+            (name, holder, now + ttl, now)
+        )
+        await db.commit()
+        return cursor.rowcount > 0
+
+async def release_lease(name: str, holder: str):
+    """Отпускает аренду, если она наша, — резервный экземпляр подхватит её без ожидания"""
+    async with connect() as db:
+        await db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        await db.commit()
+
+async def get_lease(name: str) -> tuple[str, float] | None:
+    """(holder, expires_at) текущей аренды или None"""
+    async with connect() as db:
+        cursor = await db.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,))
+        return await cursor.fetchone()
+
+async def purge_old_reminders(keep_days: int = 7) -> int:
+    """Удаляет отправленные и проваленные напоминания старше keep_days дней"""
+    cutoff = (date.today() - timedelta(days=keep_days)).isoformat()
+    async with connect() as db:
+        cursor = await db.execute(
+            "DELETE FROM reminder_outbox WHERE status != 'pending' AND reminder_date < ?",
+            (cutoff,)
+        )
+        await db.commit()
+        return max(cursor.rowcount, 0)
+
 async def set_user_reminder_time(user_id: int, reminder_time: str):
-    """Устанавливает время напоминания для пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Устанавливает время напоминания для пользователя (местное время; в БД ещё и минута по UTC)"""
+    async with connect() as db:
+        cursor = await db.execute("SELECT tz FROM users WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+        utc_minute = to_utc_minute(reminder_time, row[0] if row else None) if reminder_time else None
         await db.execute(
-            "UPDATE users SET reminder_time = ? WHERE user_id = ?",
-            (reminder_time, user_id)
+            "UPDATE users SET reminder_time = ?, reminder_utc_minute = ? WHERE user_id = ?",
+            (reminder_time, utc_minute, user_id)
         )
         await db.commit()
         print(f"⏰ [DB] Установлено время напоминания {reminder_time} для пользователя {user_id}")
 
 async def get_user_reminder_time(user_id: int) -> str | None:
     """Получает время напоминания пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         cursor = await db.execute(
             "SELECT reminder_time FROM users WHERE user_id = ?",
             (user_id,)
@@ -257,56 +1250,615 @@ async def update_habit_name(habit_id: int, new_name: str) -> bool:
     if len(new_name) > 100:
         return False
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE habits SET name = ? WHERE habit_id = ?",
-            (new_name.strip(), habit_id)
-        )
+    async with connect() as db:
+        try:
+            cursor = await db.execute(
+                "UPDATE habits SET name = ? WHERE habit_id = ? AND deleted_at IS NULL",
+                (new_name.strip(), habit_id)
+            )
+        except aiosqlite.IntegrityError:
+            return False  # у пользователя уже есть привычка с таким названием
+        updated = cursor.rowcount > 0  # если 0 — значит, не было такой привычки
+        if updated:
+            await _fts_index(db, [habit_id])
         await db.commit()
+        return updated
 
-        cursor = await db.execute("SELECT changes()")
-        changes = await cursor.fetchone()
-        return changes[0] > 0  # если 0 — значит, не было такой привычки
+async def _habit_belongs_to_user(db, habit_id: int, user_id: int) -> bool:
+    """Проверяет, что привычка существует и принадлежит пользователю"""
+    cursor = await db.execute(
+        "SELECT 1 FROM habits WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
+        (habit_id, user_id)
+    )
+    return await cursor.fetchone() is not None
 
 async def delete_habit(habit_id: int, user_id: int) -> bool:
-    """Удаляет привычку и её логи, если она принадлежит пользователю. Возвращает True, если успешно."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Сначала проверяем, принадлежит ли привычка пользователю
+    """Удаляет привычку, если она принадлежит пользователю. Возвращает True, если успешно.
+    Привычка сразу пропадает отовсюду, а её логи вычищает purge_deleted_habits в фоне."""
+    async with connect() as db:
         cursor = await db.execute(
-            "SELECT 1 FROM habits WHERE habit_id = ? AND user_id = ?",
+            "UPDATE habits SET deleted_at = CURRENT_TIMESTAMP WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
             (habit_id, user_id)
         )
-        if not await cursor.fetchone():
+        deleted = cursor.rowcount > 0
+        await db.execute("DELETE FROM habit_rollup_dirty WHERE habit_id = ?", (habit_id,))
+        if deleted:
+            await db.execute("DELETE FROM habits_fts WHERE rowid = ?", (habit_id,))
+            await _leave_challenges(db, user_id, [habit_id])
+        await db.commit()
+        return deleted
+
+async def reset_user_data(user_id: int) -> bool:
+    """Полностью удаляет все привычки и логи пользователя. Возвращает True, если успешно.
+    Как и delete_habit — логически сразу, физически в фоне."""
+    async with connect() as db:
+        await db.execute(
+            "DELETE FROM habit_rollup_dirty WHERE habit_id IN (SELECT habit_id FROM habits WHERE user_id = ?)",
+            (user_id,)
+        )
+        cursor = await db.execute(
+            "SELECT habit_id FROM habits WHERE user_id = ? AND deleted_at IS NULL", (user_id,)
+        )
+        await _leave_challenges(db, user_id, [row[0] for row in await cursor.fetchall()])
+        cursor = await db.execute(
+            "UPDATE habits SET deleted_at = CURRENT_TIMESTAMP WHERE user_id = ? AND deleted_at IS NULL",
+            (user_id,)
+        )
+        await db.execute("DELETE FROM habits_fts WHERE habits_fts MATCH ?", (_fts_query(user_id, ""),))
+        await db.commit()
+        return cursor.rowcount > 0  # если 0 — значит, не было данных
+
+async def reset_user_stats_only(user_id: int) -> bool:
+    """Удаляет только историю выполнения, привычки (и их ID) остаются.
+    Строк немного: старше LOG_ARCHIVE_AFTER_DAYS логи уже свёрнуты в годовые битовые карты."""
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute(
+            "SELECT habit_id FROM habits WHERE user_id = ? AND deleted_at IS NULL", (user_id,)
+        )
+        habit_ids = [row[0] for row in await cursor.fetchall()]
+        if not habit_ids:
+            await db.rollback()
             return False
+        placeholders = ",".join("?" * len(habit_ids))
 
-        # Удаляем логи
-        await db.execute("DELETE FROM habit_logs WHERE habit_id = ?", (habit_id,))
-        # Удаляем саму привычку
-        await db.execute("DELETE FROM habits WHERE habit_id = ? AND user_id = ?", (habit_id, user_id))
+        # Отметки пропадают — забираем их и из общих досок челленджей
+        cursor = await db.execute(
+            f"SELECT habit_id, date FROM habit_logs WHERE habit_id IN ({placeholders}) AND done = 1",
+            habit_ids
+        )
+        await _count_challenge_marks(db, [(habit_id, day, True, False) for habit_id, day in await cursor.fetchall()])
+
+        removed = 0
+        for table in ("habit_logs", "habit_log_archive", "habit_daily_aggregates", "habit_rollup_dirty", "habit_totals"):
+            cursor = await db.execute(f"DELETE FROM {table} WHERE habit_id IN ({placeholders})", habit_ids)
+            removed += cursor.rowcount
         await db.commit()
+        return removed > 0
 
-        cursor = await db.execute("SELECT changes()")
-        changes = await cursor.fetchone()
-        return changes[0] > 0
-async def reset_user_data(user_id: int) -> bool:
-    """Полностью удаляет все привычки и логи пользователя. Возвращает True, если успешно."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Удаляем логи
-        await db.execute("DELETE FROM habit_logs WHERE habit_id IN (SELECT habit_id FROM habits WHERE user_id = ?)", (user_id,))
-        # Удаляем привычки
-        await db.execute("DELETE FROM habits WHERE user_id = ?", (user_id,))
+async def purge_deleted_habits(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """Физически удаляет удалённые привычки и всё, что к ним относится.
+    Каждая порция — отдельная короткая транзакция, чтобы не задерживать другие записи;
+    прогресс хранится в самой БД (оставшиеся строки), поэтому переживает рестарт.
+    Возвращает число удалённых строк."""
+    purged = 0
+    async with connect() as db:
+        while True:
+            cursor = await db.execute(
+                "SELECT habit_id FROM habits WHERE deleted_at IS NOT NULL ORDER BY habit_id LIMIT 1"
+            )
+            row = await cursor.fetchone()
+            if not row:
+                break
+            habit_id = row[0]
+
+            # Сначала зависимые таблицы — порциями по batch_size строк
+            removed = 0
+            for sql in (
+                "DELETE FROM habit_logs WHERE log_id IN "
+                "(SELECT log_id FROM habit_logs WHERE habit_id = ? LIMIT ?)",
+                "DELETE FROM habit_daily_aggregates WHERE habit_id = ? AND date IN "
+                "(SELECT date FROM habit_daily_aggregates WHERE habit_id = ? LIMIT ?)",
+                "DELETE FROM habit_log_archive WHERE habit_id = ? AND year IN "
+                "(SELECT year FROM habit_log_archive WHERE habit_id = ? LIMIT ?)",
+            ):
+                params = (habit_id, batch_size) if sql.count("?") == 2 else (habit_id, habit_id, batch_size)
+                cursor = await db.execute(sql, params)
+                removed = cursor.rowcount
+                if removed:
+                    break
+
+            if not removed:
+                # Зависимых строк не осталось — удаляем саму привычку (каскаду уже нечего делать)
+                await db.execute("DELETE FROM habits WHERE habit_id = ?", (habit_id,))
+                removed = 1
+
+            await db.commit()
+            purged += removed
+            await asyncio.sleep(0)  # даём поработать обработчикам между порциями
+
+    if purged:
+        print(f"🧽 [DB] Вычищено строк удалённых привычек: {purged}")
+    return purged
+
+async def iter_user_history(user_id: int, habit_id: int | None = None):
+    """Построчно отдаёт историю пользователя: (habit_id, name, created_at, date, done),
+    внутри привычки — по возрастанию даты. Привычка без отметок отдаётся одной строкой с date = None.
+    Ничего не накапливает в памяти — строки читаются курсором порциями.
+    Если передан habit_id, которого нет у пользователя, — PermissionError."""
+    async with connect() as db:
+        if habit_id is not None and not await _habit_belongs_to_user(db, habit_id, user_id):
+            raise PermissionError(f"Привычка {habit_id} не принадлежит пользователю {user_id}")
+
+        habits_cursor = await db.execute(
+            "SELECT habit_id, name, created_at FROM habits WHERE user_id = ? AND (? IS NULL OR habit_id = ?) AND deleted_at IS NULL ORDER BY habit_id",
+            (user_id, habit_id, habit_id)
+        )
+        habits = await habits_cursor.fetchall()  # только список привычек, логи — потоком
+
+        for h_id, name, created_at in habits:
+            has_logs = False
+
+            # Архив (годовые битовые карты) и строки habit_logs — два потока, оба по дате.
+            # Сливаем их на ходу; день, дозаполненный задним числом, есть в обоих — строка главнее.
+            archived = _iter_archived_days(db, h_id)
+            logs_cursor = await db.execute(
+                "SELECT date, done FROM habit_logs WHERE habit_id = ? ORDER BY date",
+                (h_id,)
+            )
+            logs = aiter(logs_cursor)
+            archived_day = await anext(archived, None)
+            log = await anext(logs, None)
+            while archived_day or log:
+                has_logs = True
+                if log is None or (archived_day and archived_day[0] < log[0]):
+                    yield h_id, name, created_at, *archived_day
+                    archived_day = await anext(archived, None)
+                    continue
+                if archived_day and archived_day[0] == log[0]:
+                    archived_day = await anext(archived, None)
+                yield h_id, name, created_at, log[0], bool(log[1])
+                log = await anext(logs, None)
+
+            if not has_logs:
+                yield h_id, name, created_at, None, None
+
+async def _iter_archived_days(db, habit_id: int):
+    """Дни из архива привычки по порядку: (дата YYYY-MM-DD, сделано), по одному году за раз"""
+    cursor = await db.execute(
+        "SELECT year, bits FROM habit_log_archive WHERE habit_id = ? ORDER BY year",
+        (habit_id,)
+    )
+    async for year, bits in cursor:
+        for day, done in sorted(decode_year(year, bits).items()):
+            yield day.isoformat(), done
+
+async def compact_habit_logs(keep_days: int, batch_size: int = 100) -> int:
+    """Сворачивает логи старше keep_days дней в годовые битовые карты.
+    Работает пачками по batch_size привычек, чтобы не держать блокировку записи долго.
+    Возвращает количество свёрнутых строк."""
+    cutoff = (date.today() - timedelta(days=keep_days)).isoformat()
+    compacted = 0
+    last_habit_id = 0
+
+    async with connect() as db:
+        while True:
+            cursor = await db.execute(
+                "SELECT habit_id FROM habits WHERE habit_id > ? AND deleted_at IS NULL ORDER BY habit_id LIMIT ?",
+                (last_habit_id, batch_size)
+            )
+            habit_ids = [row[0] for row in await cursor.fetchall()]
+            if not habit_ids:
+                break
+            last_habit_id = habit_ids[-1]
+
+            for habit_id in habit_ids:
+                cursor = await db.execute(
+                    "SELECT date, done FROM habit_logs WHERE habit_id = ? AND date < ?",
+                    (habit_id, cutoff)
+                )
+                rows = await cursor.fetchall()
+                if not rows:
+                    continue
+
+                by_year: dict[int, dict[date, bool]] = {}
+                for log_date, done in rows:
+                    day = date.fromisoformat(log_date)
+                    by_year.setdefault(day.year, {})[day] = bool(done)
+
+                for year, days in by_year.items():
+                    cursor = await db.execute(
+                        "SELECT bits FROM habit_log_archive WHERE habit_id = ? AND year = ?",
+                        (habit_id, year)
+                    )
+                    row = await cursor.fetchone()
+                    await db.execute(
+                        """
+                        INSERT INTO habit_log_archive (habit_id, year, bits) VALUES (?, ?, ?)
+                        ON CONFLICT(habit_id, year) DO UPDATE SET bits = excluded.bits
+                        """,
+                        (habit_id, year, set_days(row[0] if row else None, days))
+                    )
+
+                await db.execute(
+                    "DELETE FROM habit_logs WHERE habit_id = ? AND date < ?",
+                    (habit_id, cutoff)
+                )
+                compacted += len(rows)
+
+            await db.commit()
+
+    print(f"🗜️ [DB] Свёрнуто в архив строк логов: {compacted}")
+    return compacted
+
+async def _get_state(db, key: str) -> str | None:
+    cursor = await db.execute("SELECT value FROM app_state WHERE key = ?", (key,))
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+async def _set_state(db, key: str, value: str):
+    await db.execute(
+        "INSERT INTO app_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value)
+    )
+
+async def refresh_daily_rollups(batch_size: int = 100) -> int:
+    """Досчитывает нарастающие итоги habit_daily_aggregates по позавчерашний (по UTC) день включительно:
+    у пользователей в разных поясах «вчера» разное, а этот день закончился уже везде.
+    Обычно это только один новый день отметок; для дозаполненных задним числом привычек —
+    пересчёт с самой ранней изменённой даты. Возвращает число обработанных привычек."""
+    until = datetime.now(timezone.utc).date() - timedelta(days=2)
+    processed = 0
+    last_habit_id = 0
+
+    async with connect() as db:
+        rolled_until = await _get_state(db, "rollup_rolled_until")
+        default_start = date.fromisoformat(rolled_until) + timedelta(days=1) if rolled_until else date.min
+
+        cursor = await db.execute("SELECT habit_id, from_date FROM habit_rollup_dirty")
+        dirty = {habit_id: date.fromisoformat(from_date) for habit_id, from_date in await cursor.fetchall()}
+
+        while True:
+            cursor = await db.execute(
+                "SELECT habit_id FROM habits WHERE habit_id > ? AND deleted_at IS NULL ORDER BY habit_id LIMIT ?",
+                (last_habit_id, batch_size)
+            )
+            habit_ids = [row[0] for row in await cursor.fetchall()]
+            if not habit_ids:
+                break
+            last_habit_id = habit_ids[-1]
+
+            for habit_id in habit_ids:
+                start = min(default_start, dirty.get(habit_id, default_start))
+                if start > until:
+                    continue
+
+                # Итог на день перед пересчитываемым отрезком
+                cursor = await db.execute(
+                    """
+                    SELECT done_total, skipped_total FROM habit_daily_aggregates
+                    WHERE habit_id = ? AND date < ? ORDER BY date DESC LIMIT 1
+                    """,
+                    (habit_id, start.isoformat())
+                )
+                row = await cursor.fetchone()
+                done_total, skipped_total = row if row else (0, 0)
+
+                await db.execute(
+                    "DELETE FROM habit_daily_aggregates WHERE habit_id = ? AND date >= ?",
+                    (habit_id, start.isoformat())
+                )
+
+                history = await _load_habit_history(db, habit_id, since=start)
+                totals = []
+                for day in sorted(d for d in history if d <= until):
+                    if history[day]:
+                        done_total += 1
+                    else:
+                        skipped_total += 1
+                    totals.append((habit_id, day.isoformat(), done_total, skipped_total))
+
+                await db.executemany(
+                    "INSERT INTO habit_daily_aggregates (habit_id, date, done_total, skipped_total) VALUES (?, ?, ?, ?)",
+                    totals
+                )
+                processed += 1
+
+            await db.commit()
+
+        # Снимаем только те отметки «грязных» дат, которые мы и пересчитали
+        await db.executemany(
+            "DELETE FROM habit_rollup_dirty WHERE habit_id = ? AND from_date = ?",
+            [(habit_id, from_date.isoformat()) for habit_id, from_date in dirty.items()]
+        )
+        await _set_state(db, "rollup_rolled_until", until.isoformat())
         await db.commit()
 
-        cursor = await db.execute("SELECT changes()")
-        changes = await cursor.fetchone()
-        return changes[0] > 0  # если 0 — значит, не было данных
+    print(f"📈 [DB] Агрегаты обновлены по {until.isoformat()}, привычек: {processed}")
+    return processed
 
-async def reset_user_stats_only(user_id: int) -> bool:
-    """Удаляет только логи выполнения, привычки остаются"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM habit_logs WHERE habit_id IN (SELECT habit_id FROM habits WHERE user_id = ?)", (user_id,))
+async def _count_marks(db, habit_id: int, start: date, end: date, rolled_until: date | None) -> tuple[int, int]:
+    """(сделано, пропущено) за отрезок [start, end]: разность нарастающих итогов
+    плюс свежие, ещё не свёрнутые в агрегаты дни"""
+    async def total_at(day: date) -> tuple[int, int]:
+        cursor = await db.execute(
+            """
+            SELECT done_total, skipped_total FROM habit_daily_aggregates
+            WHERE habit_id = ? AND date <= ? ORDER BY date DESC LIMIT 1
+            """,
+            (habit_id, day.isoformat())
+        )
+        row = await cursor.fetchone()
+        return row if row else (0, 0)
+
+    rolled_end = min(end, rolled_until) if rolled_until else None
+    done = skipped = 0
+    if rolled_end and rolled_end >= start:
+        end_done, end_skipped = await total_at(rolled_end)
+        start_done, start_skipped = await total_at(start - timedelta(days=1))
+        done, skipped = end_done - start_done, end_skipped - start_skipped
+
+    live_from = max(start, rolled_until + timedelta(days=1)) if rolled_until else start
+    if live_from <= end:
+        cursor = await db.execute(
+            """
+            SELECT COALESCE(SUM(done = 1), 0), COALESCE(SUM(done = 0), 0) FROM habit_logs
+            WHERE habit_id = ? AND date BETWEEN ? AND ?
+            """,
+            (habit_id, live_from.isoformat(), end.isoformat())
+        )
+        live_done, live_skipped = await cursor.fetchone()
+        done, skipped = done + live_done, skipped + live_skipped
+    return done, skipped
+
+async def get_user_period_stats(user_id: int, days: int) -> list[dict]:
+    """Статистика по каждой привычке за последние days дней (включая сегодня)
+    и за такой же период перед ним — для тренда"""
+    async with connect() as db:
+        today = await _user_today(db, user_id)
+        start = today - timedelta(days=days - 1)
+        prev_start = start - timedelta(days=days)
+        prev_end = start - timedelta(days=1)
+
+        rolled_until = await _get_state(db, "rollup_rolled_until")
+        rolled_until = date.fromisoformat(rolled_until) if rolled_until else None
+
+        cursor = await db.execute(
+            "SELECT habit_id, name, date(created_at), schedule_mask, per_week FROM habits "
+            "WHERE user_id = ? AND deleted_at IS NULL ORDER BY habit_id",
+            (user_id,)
+        )
+        result = []
+        for habit_id, name, created, mask, per_week in await cursor.fetchall():
+            created = date.fromisoformat(created) if created else start
+            done, skipped = await _count_marks(db, habit_id, start, today, rolled_until)
+            prev_done, _ = await _count_marks(db, habit_id, prev_start, prev_end, rolled_until)
+
+            # Долю считаем только по дням, когда привычка уже существовала
+            # и только по дням, когда её нужно было выполнять по расписанию
+            period_days = _due_days(mask, per_week, max(start, created), today)
+            prev_days = _due_days(mask, per_week, max(prev_start, created), prev_end)
+            result.append({
+                "habit_id": habit_id,
+                "name": name,
+                "done": done,
+                "skipped": skipped,
+                "rate": min(done / period_days, 1.0) if period_days > 0 else 0.0,
+                "prev_rate": min(prev_done / prev_days, 1.0) if prev_days > 0 else None,
+            })
+        return result
+
+async def _count_challenge_marks(db, changes: list[tuple[int, str, bool, bool]]):
+    """Сдвигает дневные счётчики челленджей по отметкам (habit_id, дата, было, стало)
+    и помечает их доски к перерисовке. Для обычных привычек — один поиск по первичному ключу."""
+    changes = [change for change in changes if change[2] != change[3]]
+    if not changes:
+        return
+    habit_ids = sorted({change[0] for change in changes})
+    cursor = await db.execute(
+        f"SELECT habit_id, challenge_id FROM habits WHERE habit_id IN ({','.join('?' * len(habit_ids))}) "
+        f"AND challenge_id IS NOT NULL",
+        habit_ids
+    )
+    linked = dict(await cursor.fetchall())
+    if not linked:
+        return
+
+    deltas: dict[tuple[int, str], int] = {}
+    for habit_id, day, old_done, new_done in changes:
+        if habit_id in linked:
+            key = (linked[habit_id], day)
+            deltas[key] = deltas.get(key, 0) + new_done - old_done
+    await db.executemany(
+        """
+        INSERT INTO challenge_daily (challenge_id, date, done_count) VALUES (?, ?, ?)
+        ON CONFLICT(challenge_id, date) DO UPDATE SET done_count = done_count + excluded.done_count
+        """,
+        [(challenge_id, day, delta) for (challenge_id, day), delta in deltas.items() if delta]
+    )
+    await db.executemany(
+        "INSERT OR IGNORE INTO challenge_board_dirty (challenge_id) VALUES (?)",
+        [(challenge_id,) for challenge_id in set(linked.values())]
+    )
+
+async def _leave_challenges(db, user_id: int, habit_ids: list[int]):
+    """Участник выходит из челленджей, к которым привязаны эти привычки (в транзакции вызывающего)"""
+    if not habit_ids:
+        return
+    cursor = await db.execute(
+        f"SELECT DISTINCT challenge_id FROM habits WHERE habit_id IN ({','.join('?' * len(habit_ids))}) "
+        f"AND challenge_id IS NOT NULL",
+        habit_ids
+    )
+    for (challenge_id,) in await cursor.fetchall():
+        cursor = await db.execute(
+            "DELETE FROM challenge_members WHERE challenge_id = ? AND user_id = ?", (challenge_id, user_id)
+        )
+        if cursor.rowcount > 0:
+            await db.execute(
+                "UPDATE challenges SET member_count = member_count - 1 WHERE challenge_id = ?", (challenge_id,)
+            )
+            await db.execute("INSERT OR IGNORE INTO challenge_board_dirty (challenge_id) VALUES (?)", (challenge_id,))
+
+async def create_challenge(owner_id: int, name: str) -> tuple[int, str] | None:
+    """Создаёт челлендж, код для вступления — случайный. Возвращает (challenge_id, code)
+    или None, если у создателя привычка с таким названием уже участвует в другом челлендже.
+    Создатель пока не участник — он вступает через join_challenge, как все."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT 1 FROM habits WHERE user_id = ? AND name = ? COLLATE NOCASE "
+            "AND deleted_at IS NULL AND challenge_id IS NOT NULL",
+            (owner_id, name)
+        )
+        if await cursor.fetchone():
+            return None
+        while True:
+            code = secrets.token_hex(3)
+            try:
+                cursor = await db.execute(
+                    "INSERT INTO challenges (name, owner_id, code) VALUES (?, ?, ?) RETURNING challenge_id",
+                    (name, owner_id, code)
+                )
+            except aiosqlite.IntegrityError:
+                continue  # такой код уже занят — берём другой
+            challenge_id = (await cursor.fetchone())[0]
+            await db.commit()
+            print(f"🏁 [DB] Челлендж '{name}' (ID: {challenge_id}) создан пользователем {owner_id}")
+            return challenge_id, code
+
+async def join_challenge(user_id: int, code: str) -> dict | None:
+    """Вступление в челлендж по коду: заводит участнику привычку с названием челленджа
+    (или привязывает уже существующую с тем же названием) и увеличивает счётчик участников.
+    Возвращает {"challenge_id", "name", "habit_id", "status"} или None, если кода нет.
+    status: "joined" — вступил, "member" — уже участник, "conflict" — привычка с таким
+    названием уже привязана к другому челленджу (её не трогаем)."""
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute("SELECT challenge_id, name FROM challenges WHERE code = ?", (code.lower(),))
+        challenge = await cursor.fetchone()
+        if not challenge:
+            await db.rollback()
+            return None
+        challenge_id, name = challenge
+
+        cursor = await db.execute(
+            "SELECT 1 FROM challenge_members WHERE challenge_id = ? AND user_id = ?", (challenge_id, user_id)
+        )
+        if await cursor.fetchone():
+            await db.rollback()
+            return {"challenge_id": challenge_id, "name": name, "habit_id": None, "status": "member"}
+
+        habit_id, _ = await _upsert_habit(db, user_id, name)
+        cursor = await db.execute(
+            "UPDATE habits SET challenge_id = ? WHERE habit_id = ? AND challenge_id IS NULL",
+            (challenge_id, habit_id)
+        )
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return {"challenge_id": challenge_id, "name": name, "habit_id": habit_id, "status": "conflict"}
+
+        await db.execute(
+            "INSERT INTO challenge_members (challenge_id, user_id) VALUES (?, ?)", (challenge_id, user_id)
+        )
+        await db.execute(
+            "UPDATE challenges SET member_count = member_count + 1 WHERE challenge_id = ?", (challenge_id,)
+        )
+        await db.execute("INSERT OR IGNORE INTO challenge_board_dirty (challenge_id) VALUES (?)", (challenge_id,))
+        await db.commit()
+        print(f"👥 [DB] Пользователь {user_id} вступил в челлендж {challenge_id}")
+        return {"challenge_id": challenge_id, "name": name, "habit_id": habit_id, "status": "joined"}
+
+async def leave_challenge(user_id: int, challenge_id: int) -> bool:
+    """Выход из челленджа: привычка остаётся у пользователя, но больше не общая"""
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute(
+            "SELECT habit_id FROM habits WHERE user_id = ? AND challenge_id = ? AND deleted_at IS NULL",
+            (user_id, challenge_id)
+        )
+        habit_ids = [row[0] for row in await cursor.fetchall()]
+        await _leave_challenges(db, user_id, habit_ids)
+        cursor = await db.execute(
+            "UPDATE habits SET challenge_id = NULL WHERE user_id = ? AND challenge_id = ?",
+            (user_id, challenge_id)
+        )
         await db.commit()
+        return cursor.rowcount > 0
 
-        cursor = await db.execute("SELECT changes()")
-        changes = await cursor.fetchone()
-        return changes[0] > 0
\ No newline at end of file
+async def get_user_challenges(user_id: int) -> list[tuple[int, str, str, int]]:
+    """Челленджи пользователя: [(challenge_id, name, code, member_count), ...]"""
+    async with connect() as db:
+        cursor = await db.execute(
+            """
+            SELECT c.challenge_id, c.name, c.code, c.member_count
+            FROM challenge_members m JOIN challenges c ON c.challenge_id = m.challenge_id
+            WHERE m.user_id = ?
+            ORDER BY c.challenge_id
+            """,
+            (user_id,)
+        )
+        return await cursor.fetchall()
+
+async def set_board_message(challenge_id: int, user_id: int, message_id: int | None):
+    """Запоминает (или забывает) закреплённую доску челленджа в личке участника"""
+    async with connect() as db:
+        await db.execute(
+            "UPDATE challenge_members SET board_message_id = ? WHERE challenge_id = ? AND user_id = ?",
+            (message_id, challenge_id, user_id)
+        )
+        await db.commit()
+
+async def get_challenge_board(challenge_id: int, days: int = 7) -> dict | None:
+    """Всё для доски челленджа — из счётчиков, без логов участников: участники, отметки
+    за последние days дней (по дате создателя) и куда рассылать доску."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT name, code, owner_id, member_count FROM challenges WHERE challenge_id = ?", (challenge_id,)
+        )
+        challenge = await cursor.fetchone()
+        if not challenge:
+            return None
+        name, code, owner_id, member_count = challenge
+
+        today = await _user_today(db, owner_id)
+        start = today - timedelta(days=days - 1)
+        cursor = await db.execute(
+            "SELECT date, done_count FROM challenge_daily WHERE challenge_id = ? AND date BETWEEN ? AND ?",
+            (challenge_id, start.isoformat(), today.isoformat())
+        )
+        counts = dict(await cursor.fetchall())
+        cursor = await db.execute(
+            "SELECT user_id, board_message_id FROM challenge_members "
+            "WHERE challenge_id = ? AND board_message_id IS NOT NULL",
+            (challenge_id,)
+        )
+        boards = await cursor.fetchall()
+
+    return {
+        "challenge_id": challenge_id,
+        "name": name,
+        "code": code,
+        "members": member_count,
+        "days": [
+            (start + timedelta(days=i), counts.get((start + timedelta(days=i)).isoformat(), 0))
+            for i in range(days)
+        ],
+        "boards": boards,
+    }
+
+async def take_dirty_challenges() -> list[int]:
+    """Забирает челленджи, чьи доски пора перерисовать (сразу снимая пометку)"""
+    async with connect() as db:
+        cursor = await db.execute("DELETE FROM challenge_board_dirty RETURNING challenge_id")
+        rows = await cursor.fetchall()
+        await db.commit()
+        return [row[0] for row in rows]
+
+async def mark_challenges_dirty(challenge_ids: list[int]):
+    """Возвращает челленджи в очередь на перерисовку (например, после RetryAfter)"""
+    async with connect() as db:
+        await db.executemany(
+            "INSERT OR IGNORE INTO challenge_board_dirty (challenge_id) VALUES (?)",
+            [(challenge_id,) for challenge_id in challenge_ids]
+        )
+        await db.commit()
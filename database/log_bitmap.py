@@ -0,0 +1,45 @@
+# database/log_bitmap.py
+from datetime import date, timedelta
+
+# Состояние дня — 2 бита
+DAY_MISSING = 0
+DAY_DONE = 1
+DAY_SKIPPED = 2
+
+# 366 дней × 2 бита = 92 байта на привычку за год
+YEAR_BYTES = 92
+
+
+def day_index(day: date) -> int:
+    """Номер дня внутри года, начиная с 0"""
+    return day.toordinal() - date(day.year, 1, 1).toordinal()
+
+
+def get_day(bits: bytes, index: int) -> int:
+    """Читает состояние дня из битовой карты"""
+    return (bits[index >> 2] >> ((index & 3) * 2)) & 3
+
+
+def set_days(bits: bytes | None, days: dict[date, bool]) -> bytes:
+    """Записывает отметки {дата: сделано} в битовую карту года (все даты — из одного года)"""
+    buf = bytearray(bits) if bits else bytearray(YEAR_BYTES)
+    for day, done in days.items():
+        index = day_index(day)
+        shift = (index & 3) * 2
+        state = DAY_DONE if done else DAY_SKIPPED
+        buf[index >> 2] = (buf[index >> 2] & ~(3 << shift)) | (state << shift)
+    return bytes(buf)
+
+
+def decode_year(year: int, bits: bytes) -> dict[date, bool]:
+    """Разворачивает битовую карту года обратно в {дата: сделано}"""
+    start = date(year, 1, 1)
+    result = {}
+    for byte_index, byte in enumerate(bits):
+        if not byte:
+            continue  # 4 пустых дня подряд — пропускаем разом
+        for offset in range(4):
+            state = (byte >> (offset * 2)) & 3
+            if state:
+                result[start + timedelta(days=byte_index * 4 + offset)] = state == DAY_DONE
+    return result
@@ -0,0 +1,215 @@
+# database/query_log.py
+import re
+import sys
+import time
+import weakref
+from functools import lru_cache
+
+# Какие запросы вообще имеет смысл прогонять через EXPLAIN QUERY PLAN
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+# Модули, которые пропускаем при поиске места вызова
+_SKIP_MODULES = ("database.", "aiosqlite", "asyncio", "contextlib")
+
+_COMMENT_RE = re.compile(r"--[^\n]*")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+# Накопленная статистика: нормализованный текст → [кол-во, сумма мс, макс мс, строк]
+_stats: dict[str, list] = {}
+
+
+@lru_cache(maxsize=512)
+def normalize_sql(sql: str) -> str:
+    """Приводит запрос к «шаблону»: без комментариев, литералов и лишних пробелов"""
+    text = _COMMENT_RE.sub(" ", sql)
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("(...)", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def find_call_site() -> tuple[str, str]:
+    """Возвращает (место вызова вне database, функция в database), например
+    ('handlers.habits.habit_done', 'database.db.mark_habit_done')"""
+    frame = sys._getframe(2)
+    db_function = ""
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        if module.startswith("database."):
+            if not db_function and module != __name__:
+                db_function = f"{module}.{frame.f_code.co_name}"
+        elif not module.startswith(_SKIP_MODULES):
+            return f"{module}.{frame.f_code.co_name}", db_function
+        frame = frame.f_back
+    return "?", db_function
+
+
+def _account(sql: str, elapsed: float, rows: int) -> float:
+    """Добавляет запрос в накопленную статистику, возвращает время в мс"""
+    elapsed_ms = elapsed * 1000
+    entry = _stats.setdefault(normalize_sql(sql), [0, 0.0, 0.0, 0])
+    entry[0] += 1
+    entry[1] += elapsed_ms
+    entry[2] = max(entry[2], elapsed_ms)
+    entry[3] += rows
+    return elapsed_ms
+
+
+def _account_unread(sql: str, progress: list):
+    """Курсор так и не дочитали, и он уже собран сборщиком мусора: учитываем то, что успели"""
+    _account(sql, progress[0], progress[1])
+
+
+def get_query_stats(limit: int = 10) -> list[dict]:
+    """Самые «дорогие» запросы по суммарному времени"""
+    rows = sorted(_stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return [
+        {"sql": sql, "count": count, "total_ms": total, "max_ms": worst, "rows": rows_total}
+        for sql, (count, total, worst, rows_total) in rows
+    ]
+
+
+class TracedCursor:
+    """Обёртка над курсором aiosqlite: считает время и количество прочитанных строк.
+    Запрос учитывается, когда курсор дочитан или закрыт; если его бросили недочитанным —
+    когда сборщик мусора освободит курсор (а вместе с ним и сам оператор SQLite)."""
+
+    def __init__(self, conn: "TracedConnection", cursor, sql: str, params, elapsed: float, call_site):
+        self._conn = conn
+        self._cursor = cursor
+        self._sql = sql
+        self._params = params
+        self._progress = [elapsed, 0]  # время, строк — общий список с финализатором
+        self._call_site = call_site
+        self._finished = False
+        # Финализатор не должен держать ни курсор, ни оператор — только текст и счётчики
+        self._finalizer = weakref.finalize(self, _account_unread, sql, self._progress)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    async def fetchone(self):
+        started = time.perf_counter()
+        row = await self._cursor.fetchone()
+        self._progress[0] += time.perf_counter() - started
+        if row is None:
+            await self._finish()
+        else:
+            self._progress[1] += 1
+        return row
+
+    async def fetchmany(self, size: int = None):
+        started = time.perf_counter()
+        rows = await (self._cursor.fetchmany(size) if size else self._cursor.fetchmany())
+        self._progress[0] += time.perf_counter() - started
+        self._progress[1] += len(rows)
+        if not rows:
+            await self._finish()
+        return rows
+
+    async def fetchall(self):
+        started = time.perf_counter()
+        rows = await self._cursor.fetchall()
+        self._progress[0] += time.perf_counter() - started
+        self._progress[1] += len(rows)
+        await self._finish()
+        return rows
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            # Порциями, как и сам aiosqlite (arraysize по умолчанию — 1 строка за переход в поток)
+            rows = await self.fetchmany(self._cursor.iter_chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    async def close(self):
+        await self._finish()
+        await self._cursor.close()
+
+    async def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._finalizer.detach()
+        rows = self._progress[1] if self._cursor.description else max(self._cursor.rowcount, 0)
+        await self._conn._record(self._sql, self._params, self._progress[0], rows, self._call_site)
+
+
+class TracedConnection:
+    """Прокси над соединением aiosqlite, которое трассирует каждый запрос"""
+
+    def __init__(self, db, slow_query_ms: float):
+        self._db = db
+        self._slow_query_ms = slow_query_ms
+        # Только слабые ссылки: брошенный недочитанным курсор должен освобождаться сразу,
+        # иначе его оператор остаётся «в процессе» и не даёт зафиксировать транзакцию
+        self._open_cursors: weakref.WeakSet[TracedCursor] = weakref.WeakSet()
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    async def execute(self, sql: str, parameters=()):
+        call_site = find_call_site()
+        started = time.perf_counter()
+        cursor = await self._db.execute(sql, parameters)
+        traced = TracedCursor(self, cursor, sql, parameters, time.perf_counter() - started, call_site)
+        if cursor.description is None:
+            await traced._finish()
+        else:
+            self._open_cursors.add(traced)
+        return traced
+
+    async def executemany(self, sql: str, parameters):
+        parameters = list(parameters)
+        call_site = find_call_site()
+        started = time.perf_counter()
+        cursor = await self._db.executemany(sql, parameters)
+        traced = TracedCursor(self, cursor, sql, parameters[0] if parameters else (),
+                              time.perf_counter() - started, call_site)
+        await traced._finish()
+        return traced
+
+    async def flush(self):
+        """Фиксирует запросы, курсоры которых так и не дочитали до конца"""
+        cursors, self._open_cursors = list(self._open_cursors), weakref.WeakSet()
+        for cursor in cursors:
+            await cursor._finish()
+
+    async def _record(self, sql: str, params, elapsed: float, rows: int, call_site):
+        elapsed_ms = _account(sql, elapsed, rows)
+        if elapsed_ms < self._slow_query_ms:
+            return
+
+        site, db_function = call_site
+        plan = await self._explain(sql, params)
+        print(f"🐌 [SLOWSQL] {elapsed_ms:.1f} мс, строк: {rows}, вызов: {site}"
+              + (f" → {db_function}" if db_function else ""))
+        print(f"    {normalize_sql(sql)}")
+        for line in plan:
+            print(f"    план: {line}")
+
+    async def _explain(self, sql: str, params) -> list[str]:
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return []
+        try:
+            cursor = await self._db.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[3] for row in await cursor.fetchall()]
+        except Exception as e:
+            return [f"не удалось получить план: {e}"]
@@ -0,0 +1,102 @@
+# handlers/admin.py
+import os
+from aiogram import Router, F
+from aiogram.types import Message, FSInputFile
+from aiogram.filters import Command, CommandObject
+from config.settings import ADMIN_IDS, QUERY_LOG_ENABLED
+from database.db import get_outbox_counts
+from database.query_log import get_query_stats
+from database.backup import backup_database, list_backups
+from utils.profiling import profiler
+from utils.loop_watchdog import watchdog
+from utils.leader import leader
+
+router = Router()
+# Все команды этого роутера — только для администраторов из ADMIN_IDS
+router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+@router.message(Command("outbox"))
+async def cmd_outbox(message: Message):
+    """Состояние очереди напоминаний"""
+    counts = await get_outbox_counts()
+    await message.answer(
+        "📬 *Очередь напоминаний:*\n\n"
+        f"⏳ Ожидают отправки: {counts['pending']}\n"
+        f"✅ Отправлено: {counts['sent']}\n"
+        f"❌ Не доставлено: {counts['failed']}",
+        parse_mode="Markdown"
+    )
+
+@router.message(Command("backup"))
+async def cmd_backup(message: Message):
+    """Делает резервную копию БД прямо сейчас и проверяет её"""
+    await message.answer("💾 Делаю резервную копию, это может занять время...")
+    try:
+        result = await backup_database()
+    except Exception as e:
+        print(f"❌ [BACKUP] Не удалось сделать копию: {e}")
+        await message.answer(f"❌ Не удалось сделать копию: {e}")
+        return
+
+    status = "✅ проверка пройдена" if result["ok"] else "❌ integrity_check не пройден"
+    await message.answer(
+        f"💾 Копия готова: {os.path.basename(result['path'])}\n"
+        f"📦 {result['size'] / 1024 / 1024:.1f} МБ (сжато), {result['pages']} страниц\n"
+        f"{status}\n"
+        f"🗂 Всего копий: {len(list_backups())}, удалено старых: {result['removed']}"
+    )
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    """Профилирование живого бота: /profile 30 — на 30 секунд, /profile 200u — на 200 апдейтов"""
+    arg = (command.args or "30").strip().lower()
+    try:
+        if arg.endswith("u"):
+            seconds, updates = None, int(arg[:-1])
+        else:
+            seconds, updates = float(arg.rstrip("s")), None
+    except ValueError:
+        await message.answer("❌ Формат: /profile 30 (секунды) или /profile 200u (апдейты)")
+        return
+
+    async def send_report(report: str, path: str):
+        await message.answer(report[:4000])
+        await message.answer_document(FSInputFile(path), caption="📎 Открыть: python -m pstats " + os.path.basename(path))
+
+    if not profiler.start(seconds=seconds, updates=updates, on_done=send_report):
+        await message.answer("⏳ Профилирование уже идёт — дождись отчёта")
+        return
+    limit = f"{updates} апдейтов" if updates else f"{seconds:.0f} с"
+    await message.answer(f"🔬 Профилирование включено ({limit}). Отчёт пришлю сюда.")
+
+def format_query_stats(limit: int = 5) -> str:
+    """Самые «дорогие» запросы с момента запуска — по суммарному времени"""
+    if not QUERY_LOG_ENABLED:
+        return "🗄 Трассировка SQL выключена (QUERY_LOG_ENABLED=0)"
+    stats = get_query_stats(limit)
+    if not stats:
+        return "🗄 Запросов пока не было"
+    text = "🗄 Самые дорогие запросы:\n"
+    for entry in stats:
+        sql = entry["sql"] if len(entry["sql"]) <= 120 else entry["sql"][:117] + "..."
+        text += (
+            f"\n{entry['total_ms']:.1f} мс всего, {entry['count']} раз, "
+            f"макс {entry['max_ms']:.1f} мс, строк: {entry['rows']}\n{sql}\n"
+        )
+    return text
+
+@router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    """Задержка цикла событий по последним замерам и самые дорогие SQL-запросы"""
+    lag = watchdog.percentiles()
+    await message.answer(
+        "📊 Задержка цикла событий:\n\n"
+        f"p50: {lag['p50']:.1f} мс\n"
+        f"p95: {lag['p95']:.1f} мс\n"
+        f"p99: {lag['p99']:.1f} мс\n"
+        f"максимум: {lag['max']:.1f} мс\n"
+        f"🐢 зависаний дольше порога: {lag['stalls']}\n"
+        f"замеров: {lag['samples']}\n\n"
+        f"{'👑 ведущий' if leader.is_leader else '💤 резервный'} экземпляр: {leader.holder}"
+    )
+    await message.answer(format_query_stats()[:4000])
@@ -0,0 +1,101 @@
+# handlers/challenges.py
+from aiogram import Router
+from aiogram.types import Message
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
+from database.db import (
+    create_challenge,
+    join_challenge,
+    leave_challenge,
+    get_user_challenges,
+    get_challenge_board,
+    set_board_message,
+)
+from utils.challenges import render_board
+from utils.habit_search import habit_search
+
+router = Router()
+
+CHALLENGE_HELP = (
+    "🏁 *Общие челленджи* — одна привычка на компанию и общая доска прогресса.\n\n"
+    "`/challenge new 10k шагов` — создать челлендж\n"
+    "`/challenge join КОД` — вступить по коду\n"
+    "`/challenge board ID` — прислать и закрепить доску\n"
+    "`/challenge leave ID` — выйти (привычка останется у тебя)\n\n"
+    "Отмечай привычку челленджа как обычно — через /today."
+)
+
+async def post_board(message: Message, challenge_id: int):
+    """Присылает доску челленджа и закрепляет её — дальше она обновляется сама"""
+    board = await get_challenge_board(challenge_id)
+    sent = await message.answer(render_board(board))
+    try:
+        await message.bot.pin_chat_message(message.chat.id, sent.message_id, disable_notification=True)
+    except TelegramBadRequest:
+        pass  # не получилось закрепить — доска всё равно будет обновляться
+    await set_board_message(challenge_id, message.from_user.id, sent.message_id)
+
+@router.message(Command("challenge"))
+async def cmd_challenge(message: Message, command: CommandObject):
+    """/challenge new|join|board|leave — общие челленджи"""
+    user_id = message.from_user.id
+    args = (command.args or "").split(maxsplit=1)
+    action = args[0].lower() if args else ""
+    arg = args[1].strip() if len(args) > 1 else ""
+
+    if action == "new":
+        if not 2 <= len(arg) <= 100:
+            await message.answer("❌ Название челленджа — от 2 до 100 символов: `/challenge new 10k шагов`", parse_mode="Markdown")
+            return
+        created = await create_challenge(user_id, arg)
+        if not created:
+            await message.answer(f"❌ Привычка «{arg}» уже участвует в другом челлендже. Выбери другое название.")
+            return
+        challenge_id, code = created
+        await join_challenge(user_id, code)
+        habit_search.invalidate(user_id)
+        await message.answer(
+            f"🏁 Челлендж «{arg}» создан! Код для друзей: `{code}`\n"
+            f"Пусть пишут мне `/challenge join {code}`.",
+            parse_mode="Markdown"
+        )
+        await post_board(message, challenge_id)
+
+    elif action == "join":
+        result = await join_challenge(user_id, arg) if arg else None
+        if not result:
+            await message.answer("❌ Челлендж с таким кодом не найден. Проверь код: `/challenge join КОД`", parse_mode="Markdown")
+            return
+        if result["status"] == "member":
+            await message.answer(f"🙂 Ты уже участвуешь в «{result['name']}».")
+            return
+        if result["status"] == "conflict":
+            await message.answer(f"❌ Твоя привычка «{result['name']}» уже участвует в другом челлендже.")
+            return
+        habit_search.invalidate(user_id)
+        await message.answer(
+            f"👥 Ты в челлендже «{result['name']}»! Привычка добавлена в твой список (ID: {result['habit_id']}) — "
+            "отмечай её через /today, и все участники увидят прогресс."
+        )
+        await post_board(message, result["challenge_id"])
+
+    elif action in ("board", "leave"):
+        mine = {challenge_id: name for challenge_id, name, _, _ in await get_user_challenges(user_id)}
+        challenge_id = int(arg) if arg.isdigit() else None
+        if challenge_id not in mine:
+            await message.answer("❌ Ты не участвуешь в челлендже с таким ID. Список: /challenge")
+            return
+        if action == "board":
+            await post_board(message, challenge_id)
+        else:
+            await leave_challenge(user_id, challenge_id)
+            await message.answer(f"👋 Ты вышел из челленджа «{mine[challenge_id]}». Привычка осталась в твоём списке.")
+
+    else:
+        challenges = await get_user_challenges(user_id)
+        text = CHALLENGE_HELP
+        if challenges:
+            text += "\n\n*Твои челленджи:*\n"
+            for challenge_id, name, code, members in challenges:
+                text += f"🔹 {name} (ID: {challenge_id}) — 👥 {members}, код `{code}`\n"
+        await message.answer(text, parse_mode="Markdown")
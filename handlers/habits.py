@@ -1,3 +1,5 @@
+import math
+import re
 from aiogram import Router, F
 from aiogram.types import (
     Message,
@@ -7,10 +9,14 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.filters import Command
-from keyboards.inline_kb import get_habit_action_buttons
+from aiogram.filters import Command, CommandObject
+from keyboards.inline_kb import get_habit_action_buttons, get_page_buttons
+from config.settings import HABITS_PAGE_SIZE
+from utils.leaderboard import refresh_user_streak
+from utils.habit_search import habit_search
+from utils.timezones import parse_timezone
 from database.db import (
-    DB_PATH,
+    connect,
     mark_habit_done,
     get_habit_streak,
     add_habit,
@@ -20,9 +26,19 @@ from database.db import (
     get_user_habits,
     reset_user_data,
     reset_user_stats_only,  # ← ЭТА СТРОКА ДОЛЖНА БЫТЬ
+    mark_habits_batch,
+    get_user_habits_page,
+    get_habits_due_today,
+    get_habit_schedule,
+    get_user_today,
+    set_user_timezone,
+    get_user_timezone,
+    set_habit_schedule,
+    set_habit_target,
+    log_habit_amount,
+    EVERY_DAY,
 )
-import aiosqlite
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from aiogram.exceptions import TelegramBadRequest
 
 
@@ -52,19 +68,12 @@ async def habit_name_entered(message: Message, state: FSMContext):
         await message.answer("❌ Название слишком длинное (макс. 100 символов). Попробуй сократить:")
         return
 
-    # Сохраняем (или получаем существующую)
-    habit_id = await add_habit(message.from_user.id, habit_name)
+    # Сохраняем (или получаем существующую) — одной записью в БД
+    habit_id, is_new = await add_habit(message.from_user.id, habit_name)
+    if is_new:
+        habit_search.invalidate(message.from_user.id)
 
     if habit_id:
-        # 🔥 Проверяем, новая это привычка или существующая
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT created_at FROM habits WHERE habit_id = ?",
-                (habit_id,)
-            )
-            row = await cursor.fetchone()
-            is_new = row and row[0]  # если есть created_at — значит, только что создали
-
         if is_new:
             response_text = (
                 f"✅ Отлично! Привычка *«{habit_name}»* добавлена (ID: {habit_id}).\n\n"
@@ -90,9 +99,9 @@ async def habit_name_entered(message: Message, state: FSMContext):
 async def habit_done(callback: CallbackQuery):
     user_id = callback.from_user.id
 
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         cursor = await db.execute(
-            "SELECT habit_id, name FROM habits WHERE user_id = ? ORDER BY habit_id DESC LIMIT 1",
+            "SELECT habit_id, name FROM habits WHERE user_id = ? AND deleted_at IS NULL ORDER BY habit_id DESC LIMIT 1",
             (user_id,)
         )
         row = await cursor.fetchone()
@@ -104,8 +113,8 @@ async def habit_done(callback: CallbackQuery):
     habit_id, habit_name = row
 
     # 🔥 Проверяем, не отмечено ли уже сегодня
-    today = date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    today = (await get_user_today(user_id)).isoformat()
+    async with connect() as db:
         cursor = await db.execute(
             "SELECT done FROM habit_logs WHERE habit_id = ? AND date = ?",
             (habit_id, today)
@@ -120,6 +129,7 @@ async def habit_done(callback: CallbackQuery):
     # Если не отмечено — сохраняем
     await mark_habit_done(habit_id, done=True)
     streak = await get_habit_streak(habit_id)
+    await refresh_user_streak(user_id)
 
     message_text = f"✅ Отлично! Ты сделал привычку *«{habit_name}»* сегодня!\n\n🔥 Цепочка: {streak} дней подряд"
 
@@ -150,9 +160,9 @@ async def habit_skip(callback: CallbackQuery):
     user_id = callback.from_user.id
 
     # Получаем последнюю привычку пользователя
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         cursor = await db.execute(
-            "SELECT habit_id, name FROM habits WHERE user_id = ? ORDER BY habit_id DESC LIMIT 1",
+            "SELECT habit_id, name FROM habits WHERE user_id = ? AND deleted_at IS NULL ORDER BY habit_id DESC LIMIT 1",
             (user_id,)
         )
         row = await cursor.fetchone()
@@ -164,8 +174,8 @@ async def habit_skip(callback: CallbackQuery):
     habit_id, habit_name = row
 
     # 🔥 Проверяем, не отмечено ли уже сегодня
-    today = date.today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
+    today = (await get_user_today(user_id)).isoformat()
+    async with connect() as db:
         cursor = await db.execute(
             "SELECT done FROM habit_logs WHERE habit_id = ? AND date = ?",
             (habit_id, today)
@@ -179,6 +189,7 @@ async def habit_skip(callback: CallbackQuery):
 
     # Если не отмечено — сохраняем как "не сделано"
     await mark_habit_done(habit_id, done=False)
+    await refresh_user_streak(user_id)
 
     message_text = f"❌ Ты пропустил привычку *«{habit_name}»* сегодня.\nНе переживай — завтра новый шанс! 🌱"
 
@@ -200,18 +211,21 @@ async def habit_skip(callback: CallbackQuery):
 async def cmd_today(message: Message):
     user_id = message.from_user.id
 
-    # Получаем список привычек пользователя
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT habit_id, name FROM habits WHERE user_id = ?",
-            (user_id,)
-        )
-        habits_list = await cursor.fetchall()
-
-    if not habits_list:
+    # Первая страница привычек пользователя
+    page = await render_today_page(user_id)
+    if not page:
         await message.answer("📝 У тебя ещё нет привычек. Добавь первую через /add")
         return
 
+    text, keyboard = page
+    await message.answer(text, reply_markup=keyboard)
+
+async def render_today_page(user_id: int, after_id: int = None, before_id: int = None):
+    """Текст и клавиатура одной страницы /today или None, если привычек нет"""
+    habits_list, has_prev, has_next = await get_user_habits_page(user_id, after_id, before_id, HABITS_PAGE_SIZE)
+    if not habits_list:
+        return None
+
     # Формируем сообщение со списком
     text = "📋 Твои привычки:\n\n"
     for habit_id, name in habits_list:
@@ -219,33 +233,56 @@ async def cmd_today(message: Message):
 
     text += "\n👉 Нажми на кнопку под сообщением, чтобы отметить выполнение."
 
-    # Создаём кнопки для каждой привычки
+    # Создаём кнопки для каждой привычки на странице
     buttons = []
     for habit_id, name in habits_list:
         buttons.append([
             InlineKeyboardButton(text=f"✅ {name}", callback_data=f"done_{habit_id}"),
             InlineKeyboardButton(text=f"❌ {name}", callback_data=f"skip_{habit_id}")
         ])
+    nav = get_page_buttons("today_page", habits_list[0][0], habits_list[-1][0], has_prev, has_next)
+    if nav:
+        buttons.append(nav)
+    # «Все» — только привычки этой страницы (границы — в callback_data), нужные сегодня
+    buttons.append([InlineKeyboardButton(
+        text="✅ Все на сегодня",
+        callback_data=f"mark_all_today:{habits_list[0][0]}:{habits_list[-1][0]}"
+    )])
+
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@router.callback_query(F.data.startswith("today_page:"))
+async def today_page(callback: CallbackQuery):
+    """Листание /today: подгружаем только соседнюю страницу"""
+    _, direction, habit_id = callback.data.split(":")
+    key = {"after_id" if direction == "next" else "before_id": int(habit_id)}
+    page = await render_today_page(callback.from_user.id, **key)
+
+    if not page:
+        await callback.answer("📝 Здесь больше нет привычек", show_alert=True)
+        return
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    text, keyboard = page
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
 
-    await message.answer(text, reply_markup=keyboard)
 @router.callback_query(F.data.startswith("done_"))
 async def today_done(callback: CallbackQuery):
     habit_id = int(callback.data.split("_")[1])
-    await mark_habit_done(habit_id, done=True)
+    streaks = await mark_habits_batch(callback.from_user.id, [(habit_id, (await get_user_today(callback.from_user.id)).isoformat(), True)])
 
-    # Получаем название привычки
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT name FROM habits WHERE habit_id = ?", (habit_id,))
-        row = await cursor.fetchone()
-
-    if not row:
+    if habit_id not in streaks:
         await callback.answer("❌ Привычка не найдена", show_alert=True)
         return
+    await refresh_user_streak(callback.from_user.id)
+
+    # Получаем название привычки
+    async with connect() as db:
+        cursor = await db.execute("SELECT name FROM habits WHERE habit_id = ? AND deleted_at IS NULL", (habit_id,))
+        row = await cursor.fetchone()
 
     habit_name = row[0]
-    streak = await get_habit_streak(habit_id)
+    streak = streaks[habit_id]
 
     message_text = f"✅ Ты сделал «{habit_name}» сегодня!\n🔥 Цепочка: {streak} дней"
 
@@ -262,19 +299,94 @@ async def today_done(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("skip_"))
 async def today_skip(callback: CallbackQuery):
     habit_id = int(callback.data.split("_")[1])
-    await mark_habit_done(habit_id, done=False)
+    streaks = await mark_habits_batch(callback.from_user.id, [(habit_id, (await get_user_today(callback.from_user.id)).isoformat(), False)])
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT name FROM habits WHERE habit_id = ?", (habit_id,))
-        row = await cursor.fetchone()
-
-    if not row:
+    if habit_id not in streaks:
         await callback.answer("❌ Привычка не найдена", show_alert=True)
         return
+    await refresh_user_streak(callback.from_user.id)
+
+    async with connect() as db:
+        cursor = await db.execute("SELECT name FROM habits WHERE habit_id = ? AND deleted_at IS NULL", (habit_id,))
+        row = await cursor.fetchone()
 
     habit_name = row[0]
     await callback.message.edit_text(f"❌ Ты пропустил «{habit_name}» сегодня. Завтра новый шанс!")
     await callback.answer()
+
+@router.callback_query(F.data.startswith("mark_all_today"))
+async def today_mark_all(callback: CallbackQuery):
+    """Кнопка «✅ Все на сегодня» — отмечает сделанными одной транзакцией привычки со страницы,
+    которые по расписанию нужны сегодня. Под старыми сообщениями кнопка без границ — берём все."""
+    user_id = callback.from_user.id
+    today = await get_user_today(user_id)
+    bounds = callback.data.split(":")[1:]
+    first_id, last_id = map(int, bounds) if bounds else (None, None)
+    habits_list = await get_habits_due_today(user_id, today, first_id, last_id)
+
+    if not habits_list:
+        await callback.answer("🌿 На сегодня здесь нечего отмечать — по расписанию день свободный", show_alert=True)
+        return
+
+    streaks = await mark_habits_batch(user_id, [(habit_id, today.isoformat(), True) for habit_id, _ in habits_list])
+    await refresh_user_streak(user_id)
+
+    text = "🎉 Привычки на сегодня отмечены!\n\n"
+    for habit_id, name in habits_list:
+        if habit_id in streaks:
+            text += f"✅ {name} — 🔥 {streaks[habit_id]} дн.\n"
+    text += "\n🐢 Степа гордится тобой!"
+
+    await callback.message.edit_text(text)
+    await callback.answer()
+
+@router.message(Command("backfill"))
+async def cmd_backfill(message: Message):
+    """Дозаполняет забытые дни: /backfill <ID|all> <ГГГГ-ММ-ДД> [ГГГГ-ММ-ДД]"""
+    args = message.text.split()
+    usage = (
+        "🗓️ Используй формат: `/backfill ID ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]`\n"
+        "Например: `/backfill 1 2025-04-01 2025-04-03`\n"
+        "Чтобы отметить все привычки — `/backfill all 2025-04-01`"
+    )
+    if len(args) not in (3, 4):
+        await message.answer(usage, parse_mode="Markdown")
+        return
+
+    try:
+        start = date.fromisoformat(args[2])
+        end = date.fromisoformat(args[3]) if len(args) == 4 else start
+        habit_ids = None if args[1].lower() in ("all", "все") else [int(args[1])]
+    except ValueError:
+        await message.answer(usage, parse_mode="Markdown")
+        return
+
+    if start > end:
+        start, end = end, start
+    if end > await get_user_today(message.from_user.id):
+        await message.answer("❌ Нельзя отметить день, который ещё не наступил 🙂")
+        return
+    if (end - start).days >= 366:
+        await message.answer("❌ За раз можно дозаполнить не больше года.")
+        return
+
+    user_id = message.from_user.id
+    if habit_ids is None:
+        habit_ids = [habit_id for habit_id, _ in await get_user_habits(user_id)]
+
+    days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    marks = [(habit_id, day, True) for habit_id in habit_ids for day in days]
+    streaks = await mark_habits_batch(user_id, marks)
+
+    if not streaks:
+        await message.answer("❌ Привычка с таким ID не найдена или не принадлежит тебе.")
+        return
+    await refresh_user_streak(user_id)
+
+    text = f"🗓️ Готово! Отмечено дней: {len(days)} × привычек: {len(streaks)}.\n\n"
+    text += "\n".join(f"🔥 ID {habit_id}: цепочка {streak} дн." for habit_id, streak in streaks.items())
+    await message.answer(text)
+
 @router.message(Command("remindme"))
 async def cmd_remindme(message: Message):
     args = message.text.split(maxsplit=1)
@@ -294,9 +406,9 @@ async def cmd_remindme(message: Message):
         await message.answer("🔕 Напоминания отключены. Возвращайся, когда захочешь — я всегда рядом 🐢")
         return
 
-    # Проверяем формат времени
+    # Проверяем формат времени (и приводим «9:30» к «09:30»)
     try:
-        datetime.strptime(time_str, "%H:%M")
+        time_str = datetime.strptime(time_str, "%H:%M").strftime("%H:%M")
     except ValueError:
         await message.answer("❌ Неверный формат времени. Используй ЧЧ:ММ, например: 19:30")
         return
@@ -304,7 +416,36 @@ async def cmd_remindme(message: Message):
     await set_user_reminder_time(message.from_user.id, time_str)
     await message.answer(
         f"✅ Отлично! Теперь я буду напоминать тебе каждый день в *{time_str}*.\n\n"
-        "🌿 Черепашка Степа позаботится, чтобы ты ничего не забыл!",
+        "🌿 Черепашка Степа позаботится, чтобы ты ничего не забыл!\n"
+        "🌍 Живёшь не по серверному времени? Укажи пояс: `/timezone Europe/Moscow` или `/timezone UTC+3`",
+        parse_mode="Markdown"
+    )
+
+@router.message(Command("timezone"))
+async def cmd_timezone(message: Message, command: CommandObject):
+    """Часовой пояс пользователя: от него зависят время напоминаний и граница «сегодня»"""
+    if not command.args:
+        current = await get_user_timezone(message.from_user.id)
+        today = await get_user_today(message.from_user.id)
+        await message.answer(
+            f"🌍 Твой часовой пояс: *{current or 'по умолчанию'}* (у тебя сейчас {today.strftime('%d.%m.%Y')})\n\n"
+            "Поменять: `/timezone Europe/Moscow` или `/timezone UTC+3`",
+            parse_mode="Markdown"
+        )
+        return
+
+    tz = parse_timezone(command.args)
+    if not tz:
+        await message.answer(
+            "❌ Не знаю такой пояс. Примеры: `Europe/Moscow`, `Asia/Almaty`, `UTC+5`",
+            parse_mode="Markdown"
+        )
+        return
+
+    await set_user_timezone(message.from_user.id, tz)
+    await refresh_user_streak(message.from_user.id)
+    await message.answer(
+        f"✅ Часовой пояс: *{tz}*. Напоминания и отметки «на сегодня» теперь по твоему времени 🐢",
         parse_mode="Markdown"
     )
 @router.message(Command("testreminder"))
@@ -321,40 +462,49 @@ async def cmd_test_reminder(message: Message):
     await message.answer("📬 Тестовое напоминание отправлено!")
 @router.message(Command("list"))
 async def cmd_list_habits(message: Message):
-    """Показывает список всех привычек пользователя с ID"""
+    """Показывает список всех привычек пользователя с ID (постранично)"""
     user_id = message.from_user.id
 
-    # Получаем привычки
-    habits = await get_user_habits(user_id)  # эта функция уже есть в db.py
+    # Получаем первую страницу привычек
+    page = await render_list_page(user_id)
 
-    if not habits:
+    if not page:
         await message.answer("📝 У тебя ещё нет привычек. Добавь первую через /add")
         return
 
+    text, keyboard = page
+    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+
+async def render_list_page(user_id: int, after_id: int = None, before_id: int = None):
+    """Текст и кнопки листания одной страницы /list или None, если привычек нет"""
+    habits, has_prev, has_next = await get_user_habits_page(user_id, after_id, before_id, HABITS_PAGE_SIZE)
+    if not habits:
+        return None
+
     text = "📋 *Твои привычки:*\n\n"
     for habit_id, name in habits:
         text += f"🔹 ID {habit_id}: *{name}*\n"
 
     text += "\n✏️ Чтобы изменить — `/edit ID новое название`\n🗑️ Чтобы удалить — `/delete ID`"
 
-    await message.answer(text, parse_mode="Markdown")
-async def update_habit_name(habit_id: int, new_name: str) -> bool:
-    """Обновляет название привычки. Возвращает True, если успешно."""
-    if len(new_name.strip()) < 2:
-        return False
-    if len(new_name) > 100:
-        return False
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE habits SET name = ? WHERE habit_id = ?",
-            (new_name.strip(), habit_id)
-        )
-        await db.commit()
+    nav = get_page_buttons("list_page", habits[0][0], habits[-1][0], has_prev, has_next)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+    return text, keyboard
+
+@router.callback_query(F.data.startswith("list_page:"))
+async def list_page(callback: CallbackQuery):
+    """Листание /list"""
+    _, direction, habit_id = callback.data.split(":")
+    key = {"after_id" if direction == "next" else "before_id": int(habit_id)}
+    page = await render_list_page(callback.from_user.id, **key)
 
-        cursor = await db.execute("SELECT changes()")
-        changes = await cursor.fetchone()
-        return changes[0] > 0  # если 0 — значит, не было такой привычки
+    if not page:
+        await callback.answer("📝 Здесь больше нет привычек", show_alert=True)
+        return
+
+    text, keyboard = page
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    await callback.answer()
 @router.message(Command("edit"))
 async def cmd_edit_habit(message: Message):
     """Редактирует название привычки: /edit <ID> <новое название>"""
@@ -376,9 +526,9 @@ async def cmd_edit_habit(message: Message):
         return
 
     # Проверяем, существует ли привычка и принадлежит ли пользователю
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         cursor = await db.execute(
-            "SELECT h.habit_id FROM habits h JOIN users u ON h.user_id = u.user_id WHERE h.habit_id = ? AND u.user_id = ?",
+            "SELECT h.habit_id FROM habits h JOIN users u ON h.user_id = u.user_id WHERE h.habit_id = ? AND u.user_id = ? AND h.deleted_at IS NULL",
             (habit_id, message.from_user.id)
         )
         row = await cursor.fetchone()
@@ -391,13 +541,177 @@ async def cmd_edit_habit(message: Message):
     success = await update_habit_name(habit_id, new_name)
 
     if success:
+        habit_search.invalidate(message.from_user.id)
         await message.answer(
             f"✅ Готово! Привычка теперь называется:\n*«{new_name}»*\n\n"
             "🌿 Черепашка Степа одобряет! Теперь отмечай с удовольствием 😊",
             parse_mode="Markdown"
         )
     else:
-        await message.answer("❌ Не удалось обновить название. Убедись, что оно от 2 до 100 символов.")
+        await message.answer("❌ Не удалось обновить название. Убедись, что оно от 2 до 100 символов и не совпадает с другой твоей привычкой.")
+
+WEEKDAYS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+def parse_schedule(text: str) -> tuple[int, int | None] | None:
+    """«пн ср пт» → маска дней, «3/нед» или «3 раза» → N раз в неделю, «каждый день» → все дни"""
+    text = text.lower().replace(",", " ").strip()
+    if text in ("каждый день", "ежедневно"):
+        return EVERY_DAY, None
+
+    match = re.fullmatch(r"([1-7])\s*(?:/\s*нед|раза?|x|р)\.?", text)
+    if match:
+        return EVERY_DAY, int(match.group(1))
+
+    mask = 0
+    for token in text.split():
+        if token[:2] not in WEEKDAYS:
+            return None
+        mask |= 1 << WEEKDAYS.index(token[:2])
+    return (mask, None) if mask else None
+
+def format_schedule(mask: int, per_week: int | None) -> str:
+    if per_week:
+        return f"{per_week} раз(а) в неделю"
+    if mask == EVERY_DAY:
+        return "каждый день"
+    return ", ".join(day for i, day in enumerate(WEEKDAYS) if mask >> i & 1)
+
+@router.message(Command("schedule"))
+async def cmd_schedule(message: Message, command: CommandObject):
+    """Расписание привычки: /schedule ID пн ср пт | 3/нед | каждый день"""
+    args = (command.args or "").split(maxsplit=1)
+    if not args or not args[0].isdigit():
+        await message.answer(
+            "📅 Используй формат:\n"
+            "`/schedule ID пн ср пт` — по дням недели\n"
+            "`/schedule ID 3/нед` — 3 раза в неделю, в любые дни\n"
+            "`/schedule ID каждый день` — как раньше\n\n"
+            "`/schedule ID` — посмотреть текущее расписание",
+            parse_mode="Markdown"
+        )
+        return
+
+    habit_id = int(args[0])
+    current = await get_habit_schedule(habit_id, message.from_user.id)
+    if not current:
+        await message.answer("❌ Привычка с таким ID не найдена или не принадлежит тебе.")
+        return
+
+    name, mask, per_week = current
+    if len(args) == 1:
+        await message.answer(f"📅 «{name}»: {format_schedule(mask, per_week)}")
+        return
+
+    schedule = parse_schedule(args[1])
+    if not schedule:
+        await message.answer("❌ Не понял расписание. Примеры: `пн ср пт`, `3/нед`, `каждый день`", parse_mode="Markdown")
+        return
+
+    await set_habit_schedule(habit_id, message.from_user.id, *schedule)
+    await refresh_user_streak(message.from_user.id)
+    await message.answer(
+        f"📅 Готово! «{name}»: {format_schedule(*schedule)}\n\n"
+        "🐢 В остальные дни цепочка не прервётся, и напоминать о привычке я не буду."
+    )
+
+def parse_amount(text: str) -> float | None:
+    """«0,5» / «2» / «-1» → число; None — если это не число"""
+    try:
+        value = float(text.replace(",", "."))
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+def format_progress(result: dict) -> str:
+    """«💧 Пить воду: 1.5 / 2 л» + отметка о достигнутой цели и цепочке"""
+    unit = f" {result['unit']}" if result["unit"] else ""
+    text = f"📏 «{result['name']}»: {result['value']:g}"
+    text += f" / {result['target']:g}{unit}" if result["target"] else unit
+    if result["reached"]:
+        text += f"\n✅ Цель на сегодня достигнута! 🔥 Цепочка: {result['streak']} дн."
+    elif result["target"]:
+        text += f"\nОсталось: {result['target'] - result['value']:g}{unit}"
+    return text
+
+def amount_buttons(habit_id: int, amount: float) -> InlineKeyboardMarkup:
+    """Повторить то же количество или отменить его — одним нажатием"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=f"➕ {amount:g}", callback_data=f"log:{habit_id}:{amount:g}"),
+        InlineKeyboardButton(text="↩️ Отменить", callback_data=f"log:{habit_id}:{-amount:g}"),
+    ]])
+
+@router.message(Command("target"))
+async def cmd_target(message: Message, command: CommandObject):
+    """Дневная цель количественной привычки: /target ID 2 л | /target ID off"""
+    args = (command.args or "").split(maxsplit=2)
+    if len(args) < 2 or not args[0].isdigit():
+        await message.answer(
+            "📏 Используй формат:\n"
+            "`/target ID 2 л` — цель 2 литра в день\n"
+            "`/target ID 30 стр` — 30 страниц в день\n"
+            "`/target ID off` — снова просто «сделал / не сделал»\n\n"
+            "Записывать количество: `/log ID 0,5`",
+            parse_mode="Markdown"
+        )
+        return
+
+    habit_id = int(args[0])
+    if args[1].lower() in ("off", "выкл"):
+        target, unit = None, None
+    else:
+        target = parse_amount(args[1])
+        unit = args[2].strip()[:20] if len(args) > 2 else None
+        if not target or target <= 0:
+            await message.answer("❌ Цель должна быть положительным числом, например `/target 1 2 л`", parse_mode="Markdown")
+            return
+
+    if not await set_habit_target(habit_id, message.from_user.id, target, unit):
+        await message.answer("❌ Привычка с таким ID не найдена или не принадлежит тебе.")
+        return
+
+    if target:
+        await message.answer(
+            f"📏 Готово! Цель: {target:g}{' ' + unit if unit else ''} в день.\n"
+            f"Записывай сделанное через `/log {habit_id} количество` — день засчитается, когда цель наберётся.",
+            parse_mode="Markdown"
+        )
+    else:
+        await message.answer("📏 Цель убрана — привычка снова отмечается кнопками ✅ / ❌.")
+
+@router.message(Command("log"))
+async def cmd_log(message: Message, command: CommandObject):
+    """Записывает количество за сегодня: /log ID 0,5 (отрицательное — поправить)"""
+    args = (command.args or "").split()
+    amount = parse_amount(args[1]) if len(args) == 2 and args[0].isdigit() else None
+    if amount is None or amount == 0:
+        await message.answer(
+            "📏 Используй формат: `/log ID количество`\n"
+            "Например: `/log 3 0,5` — ещё пол-литра воды\n\n"
+            "Цель на день: `/target ID 2 л`",
+            parse_mode="Markdown"
+        )
+        return
+
+    habit_id = int(args[0])
+    result = await log_habit_amount(message.from_user.id, habit_id, amount)
+    if not result:
+        await message.answer("❌ Привычка с таким ID не найдена или не принадлежит тебе.")
+        return
+    await refresh_user_streak(message.from_user.id)
+    await message.answer(format_progress(result), reply_markup=amount_buttons(habit_id, abs(amount)))
+
+@router.callback_query(F.data.startswith("log:"))
+async def log_amount(callback: CallbackQuery):
+    """Кнопки под ответом /log: ещё столько же или отменить"""
+    _, habit_id, amount = callback.data.split(":")
+    result = await log_habit_amount(callback.from_user.id, int(habit_id), float(amount))
+    if not result:
+        await callback.answer("❌ Привычка не найдена", show_alert=True)
+        return
+    await refresh_user_streak(callback.from_user.id)
+    await callback.message.edit_text(format_progress(result), reply_markup=amount_buttons(int(habit_id), abs(float(amount))))
+    await callback.answer()
+
 pending_deletions = set()
 
 @router.message(Command("delete"))
@@ -420,9 +734,9 @@ async def cmd_delete_habit(message: Message):
         return
 
     # Проверяем, существует ли привычка и принадлежит ли пользователю
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         cursor = await db.execute(
-            "SELECT name FROM habits WHERE habit_id = ? AND user_id = ?",
+            "SELECT name FROM habits WHERE habit_id = ? AND user_id = ? AND deleted_at IS NULL",
             (habit_id, message.from_user.id)
         )
         row = await cursor.fetchone()
@@ -457,6 +771,8 @@ async def confirm_delete(callback: CallbackQuery):
         return
 
     success = await delete_habit(habit_id, callback.from_user.id)
+    await refresh_user_streak(callback.from_user.id)
+    habit_search.invalidate(callback.from_user.id)
 
     if success:
         await callback.message.edit_text(
@@ -507,6 +823,8 @@ async def confirm_reset(callback: CallbackQuery):
         return
 
     success = await reset_user_data(user_id)
+    await refresh_user_streak(user_id)
+    habit_search.invalidate(user_id)
 
     if success:
         await callback.message.edit_text(
@@ -567,6 +885,8 @@ async def confirm_reset(callback: CallbackQuery):
         return
 
     success = await reset_user_data(user_id)
+    await refresh_user_streak(user_id)
+    habit_search.invalidate(user_id)
 
     if success:
         await callback.message.edit_text(
@@ -596,6 +916,7 @@ async def cancel_reset(callback: CallbackQuery):
 async def cmd_resetstats(message: Message):
     """Сбрасывает только статистику (логи), привычки остаются"""
     success = await reset_user_stats_only(message.from_user.id)
+    await refresh_user_streak(message.from_user.id)
 
     if success:
         await message.answer(
@@ -0,0 +1,58 @@
+# handlers/inline.py
+from aiogram import Router, F
+from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+)
+from database.db import get_user_today, mark_habits_batch
+from utils.habit_search import habit_search
+from utils.leaderboard import refresh_user_streak
+
+router = Router()
+
+@router.inline_query()
+async def inline_search(query: InlineQuery):
+    """@bot <текст> в любом чате — поиск по своим привычкам; выбранная отправляется с кнопкой «Сделано»"""
+    habits = await habit_search.search(query.from_user.id, query.query)
+
+    results = [
+        InlineQueryResultArticle(
+            id=str(habit_id),
+            title=name,
+            description="Отправить и отметить кнопкой ✅",
+            input_message_content=InputTextMessageContent(message_text=f"🐢 Привычка: «{name}»"),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="✅ Сделано", callback_data=f"inline_done_{habit_id}")
+            ]]),
+        )
+        for habit_id, name in habits
+    ]
+    # Ответ личный — Telegram не должен показывать его другим; свой кэш у нас уже есть
+    await query.answer(
+        results,
+        cache_time=5,
+        is_personal=True,
+        button=None if results else InlineQueryResultsButton(text="Привычки не найдены — добавить", start_parameter="add"),
+    )
+
+@router.callback_query(F.data.startswith("inline_done_"))
+async def inline_done(callback: CallbackQuery):
+    """Кнопка под сообщением из инлайн-режима. Отметить может только владелец привычки."""
+    habit_id = int(callback.data.rsplit("_", 1)[1])
+    user_id = callback.from_user.id
+    today = (await get_user_today(user_id)).isoformat()
+    streaks = await mark_habits_batch(user_id, [(habit_id, today, True)])
+
+    if habit_id not in streaks:
+        await callback.answer("❌ Это не твоя привычка или она удалена", show_alert=True)
+        return
+    await refresh_user_streak(user_id)
+
+    await callback.answer(f"✅ Отмечено! 🔥 Цепочка: {streaks[habit_id]} дн.")
+    if callback.inline_message_id:
+        await callback.bot.edit_message_reply_markup(inline_message_id=callback.inline_message_id, reply_markup=None)
@@ -4,12 +4,16 @@ from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import Command
 from .habits import cmd_add_habit, cmd_today
 from .stats import cmd_stats
+from database.db import set_user_blocked
 
 router = Router()
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     """Приветственное сообщение с меню"""
+    # Если раньше бот был заблокирован — раз пишет снова, можно опять напоминать
+    await set_user_blocked(message.from_user.id, False)
+
     kb = ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📚 Помощь"), KeyboardButton(text="📊 Статистика")],
@@ -37,15 +41,24 @@ async def cmd_help(message: Message):
         "`/add` — добавить новую привычку\n"
         "`/list` — показать все привычки с ID\n"
         "`/edit ID новое название` — переименовать привычку\n"
-        "`/delete ID` — удалить привычку (с подтверждением)\n\n"
+        "`/schedule ID пн ср пт` или `/schedule ID 3/нед` — расписание привычки\n"
+        "`/delete ID` — удалить привычку (с подтверждением)\n"
+        "`/challenge` — общие челленджи с друзьями и общая доска прогресса\n\n"
         "🔹 *Ежедневная практика:*\n"
         "`/today` — отметить выполнение привычек\n"
+        "`/backfill ID ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]` — отметить забытые дни задним числом\n"
+        "`/target ID 2 л` и `/log ID 0,5` — цель на день и сколько уже сделано\n"
         "`/remindme ЧЧ:ММ` — установить время напоминаний (например, `/remindme 19:30`)\n"
-        "`/remindme off` — отключить напоминания\n\n"
+        "`/remindme off` — отключить напоминания\n"
+        "`/timezone Europe/Moscow` — твой часовой пояс\n"
+        "`@бот текст` в любом чате — найти свою привычку и отметить её кнопкой\n\n"
         "🔹 *Статистика и прогресс:*\n"
         "`/stats` — показать твою статистику и цепочки\n"
+        "`/stats week`, `/stats month` — доля выполнения и тренд за неделю или месяц\n"
         "`/statsimg` — получить статистику в виде картинки 🖼️\n"
-        "`/resetstats` — сбросить только статистику (историю выполнения), привычки останутся\n\n"
+        "`/resetstats` — сбросить только статистику (историю выполнения), привычки останутся\n"
+        "`/top` — рейтинг самых длинных цепочек (`/top on` — участвовать)\n"
+        "`/export` — выгрузить всю историю в файл (`/export jsonl` — в формате JSON Lines)\n\n"
         "🔹 *Полный сброс:*\n"
         "`/reset` — удалить ВСЕ привычки и статистику (с подтверждением) 🗑️\n\n"
         "🔹 *Помощь и навигация:*\n"
@@ -2,16 +2,24 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.filters import Command
-from database.db import get_user_stats
+from database.db import get_user_stats, get_user_period_stats, set_leaderboard_opt_in, get_habit_totals
 import os
-from utils.image_gen import generate_stats_image
+from utils.export import EXPORT_FORMATS, export_user_history
+from utils.leaderboard import get_leaderboard, join_leaderboard, leave_leaderboard
 
 router = Router()
 
 @router.message(Command("stats"))
 async def cmd_stats(message: Message):
-    """Показывает текстовую статистику + кнопку для картинки"""
+    """Показывает текстовую статистику + кнопку для картинки.
+    /stats week и /stats month — доля выполнения и тренд по каждой привычке."""
     user_id = message.from_user.id
+
+    args = (message.text or "").split()
+    if len(args) > 1 and args[1].lower() in PERIODS:
+        await send_period_stats(message, args[1].lower())
+        return
+
     stats = await get_user_stats(user_id)
 
     text = "📊 *Твоя статистика за сегодня:*\n\n"
@@ -27,6 +35,17 @@ async def cmd_stats(message: Message):
         emoji = "🟢" if streak > 0 else "🔴"
         text += f"{emoji} Текущая цепочка: {streak} дней — *«{stats['current_streak']['name']}»*\n"
 
+    # Количественные привычки: итоги берём из нарастающих сумм, а не из логов
+    totals = await get_habit_totals(user_id)
+    if totals:
+        text += "\n📏 *Сколько набрано:*\n"
+        for habit in totals:
+            unit = f" {habit['unit']}" if habit['unit'] else ""
+            text += f"🔹 *{habit['name']}* — всего {habit['sum']:g}{unit}, в среднем {habit['avg']:.1f}{unit} в день"
+            if habit['target']:
+                text += f", цель {habit['target']:g}{unit} достигнута в {habit['hit_rate']:.0%} дней"
+            text += "\n"
+
     text += "\n💪 Продолжай в том же духе — каждый шаг имеет значение!"
     text += "\n\n🐢 *С уважением, Черепашка Степа* — твой спутник на пути к лучшей версии себя!"
 
@@ -37,12 +56,46 @@ async def cmd_stats(message: Message):
 
     await message.answer(text, parse_mode="Markdown", reply_markup=kb)
 
+# Период → (количество дней, заголовок)
+PERIODS = {
+    "week": (7, "за неделю"),
+    "month": (30, "за месяц"),
+}
+
+async def send_period_stats(message: Message, period: str):
+    """Доля выполнения каждой привычки за период и сравнение с предыдущим таким же периодом"""
+    days, title = PERIODS[period]
+    habits = await get_user_period_stats(message.from_user.id, days)
+
+    if not habits:
+        await message.answer("📝 У тебя ещё нет привычек. Добавь первую через /add")
+        return
+
+    text = f"📈 *Твоя статистика {title}:*\n\n"
+    for habit in habits:
+        text += f"🔹 *{habit['name']}* — {habit['done']}/{days} дн., {habit['rate']:.0%}"
+        if habit["prev_rate"] is not None:
+            diff = habit["rate"] - habit["prev_rate"]
+            if diff > 0.005:
+                text += f" 📈 +{diff:.0%}"
+            elif diff < -0.005:
+                text += f" 📉 {diff:.0%}"
+            else:
+                text += " ➖"
+        text += "\n"
+
+    text += "\n🐢 Тренд — сравнение с предыдущим таким же периодом."
+    await message.answer(text, parse_mode="Markdown")
+
 @router.message(Command("statsimg"))
 async def cmd_statsimg(message: Message):
     """Отправляет статистику в виде картинки"""
     user_id = message.from_user.id
 
     try:
+        # Pillow тяжёлый — подгружаем только при первой картинке, а не при старте бота
+        from utils.image_gen import generate_stats_image
+
         # Генерируем картинку
         image_path = await generate_stats_image(user_id)
 
@@ -69,6 +122,8 @@ async def show_stats_image(callback: CallbackQuery):
     user_id = callback.from_user.id
 
     try:
+        from utils.image_gen import generate_stats_image  # ленивый импорт Pillow
+
         image_path = await generate_stats_image(user_id)
         photo = FSInputFile(image_path)
         await callback.message.answer_photo(
@@ -85,4 +140,81 @@ async def show_stats_image(callback: CallbackQuery):
         print(f"[ERROR] {e}")
 
     # Отвечаем на callback, чтобы убрать "часики" на кнопке
-    await callback.answer()
\ No newline at end of file
+    await callback.answer()
+
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    """Выгружает всю историю привычек: /export [csv|jsonl] [ID]"""
+    args = message.text.split()[1:]
+    fmt = "csv"
+    habit_id = None
+
+    for arg in args:
+        if arg.lower() in EXPORT_FORMATS:
+            fmt = arg.lower()
+        elif arg.isdigit():
+            habit_id = int(arg)
+        else:
+            await message.answer(
+                "📦 Используй формат: `/export [csv|jsonl] [ID]`\n"
+                "Например: `/export` или `/export jsonl 3`",
+                parse_mode="Markdown"
+            )
+            return
+
+    try:
+        path = await export_user_history(message.from_user.id, fmt, habit_id)
+    except PermissionError:
+        await message.answer("❌ Привычка с таким ID не найдена или не принадлежит тебе.")
+        return
+    except Exception as e:
+        await message.answer("❌ Не удалось подготовить выгрузку. Попробуй позже.")
+        print(f"[ERROR] Ошибка выгрузки истории: {e}")
+        return
+
+    try:
+        await message.answer_document(
+            FSInputFile(path, filename=f"habits_{message.from_user.id}.{fmt}.gz"),
+            caption="📦 Вот вся твоя история привычек!\n\n🐢 Степа бережно всё сохранил."
+        )
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+@router.message(Command("top"))
+async def cmd_top(message: Message):
+    """Рейтинг самых длинных текущих цепочек: /top, /top on, /top off"""
+    user = message.from_user
+    args = message.text.split(maxsplit=1)
+    action = args[1].strip().lower() if len(args) > 1 else ""
+
+    if action == "on":
+        name = f"@{user.username}" if user.username else user.first_name
+        await set_leaderboard_opt_in(user.id, True, name)
+        await join_leaderboard(user.id, name)
+        await message.answer("🏆 Ты участвуешь в рейтинге! Смотри своё место через /top")
+        return
+
+    if action == "off":
+        await set_leaderboard_opt_in(user.id, False)
+        leave_leaderboard(user.id)
+        await message.answer("🙈 Ты больше не участвуешь в рейтинге. Вернуться — `/top on`", parse_mode="Markdown")
+        return
+
+    leaderboard = get_leaderboard()
+    top = leaderboard.top()
+    if not top:
+        text = "🏆 В рейтинге пока никого нет — стань первым!\n"
+    else:
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        text = "🏆 *Самые длинные цепочки:*\n\n"
+        for place, (_, name, streak) in enumerate(top, start=1):
+            text += f"{medals.get(place, f'{place}.')} {name} — 🔥 {streak} дн.\n"
+
+    if leaderboard.is_member(user.id):
+        rank = leaderboard.rank(user.id)
+        text += f"\nТвоё место: *{rank}* из {len(leaderboard)}" if rank else "\nУ тебя пока нет цепочки — отметь привычку через /today"
+    else:
+        text += "\nХочешь в рейтинг? Включи участие: `/top on`"
+
+    await message.answer(text, parse_mode="Markdown")
@@ -7,4 +7,13 @@ def get_habit_action_buttons():
             InlineKeyboardButton(text="✅ Сделал сегодня", callback_data="habit_done"),
             InlineKeyboardButton(text="❌ Пропустил", callback_data="habit_skip")
         ]
-    ])
\ No newline at end of file
+    ])
+
+def get_page_buttons(prefix: str, first_id: int, last_id: int, has_prev: bool, has_next: bool) -> list:
+    """Ряд кнопок «назад/вперёд» для постраничных списков (пустой, если страница одна)"""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{prefix}:prev:{first_id}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"{prefix}:next:{last_id}"))
+    return row
@@ -2,11 +2,28 @@
 import asyncio
 import logging
 import os
-from aiogram import Bot, Dispatcher
-from config.settings import BOT_TOKEN
-from database.db import init_db
-from handlers import start, habits, stats
-from utils.scheduler import scheduler, schedule_daily_reminders
+import sys
+from utils.startup_profile import profiler
+
+# Каждую группу импортов засекаем — отчёт печатается по флагу --profile-startup
+with profiler.phase("import aiogram"):
+    from aiogram import Bot, Dispatcher
+with profiler.phase("import config + database"):
+    from config.settings import BOT_TOKEN
+    from database.db import init_db
+with profiler.phase("import handlers"):
+    from handlers import start, habits, stats, admin, inline, challenges
+    from middlewares.single_flight import CallbackSingleFlightMiddleware
+    from middlewares.throttling import ThrottlingMiddleware
+    from middlewares.profiling import ProfilingMiddleware
+    from utils.send_scheduler import SendScheduler
+with profiler.phase("import scheduler + leaderboard"):
+    from utils.scheduler import scheduler, schedule_local_jobs, start_leader_jobs, stop_leader_jobs
+    from utils.leader import leader
+    from utils.leaderboard import rebuild_leaderboard
+    from utils.loop_watchdog import watchdog
+
+PROFILE_STARTUP = "--profile-startup" in sys.argv
 
 # Настройка логирования
 logging.basicConfig(level=logging.DEBUG)
@@ -15,27 +32,56 @@ logging.basicConfig(level=logging.DEBUG)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Все исходящие сообщения идут через общий планировщик с лимитами Telegram
+bot.session.middleware(SendScheduler())
+
+# Повторные нажатия одной и той же кнопки, пока первое не обработано, — не выполняем заново.
+# Самый первый: склеенные дубли не должны расходовать лимиты ограничителя ниже
+dp.update.outer_middleware(CallbackSingleFlightMiddleware())
+# Защита от флуда: лимиты на пользователя и на класс команд
+dp.update.outer_middleware(ThrottlingMiddleware())
+# Замеры обработчиков для /profile (пока окно закрыто — только проверка флага)
+dp.message.middleware(ProfilingMiddleware())
+dp.callback_query.middleware(ProfilingMiddleware())
+
 async def main():
     print("📂 [MAIN] Текущая рабочая директория:", os.getcwd())
     print("🐍 [MAIN] Путь к main.py:", os.path.abspath(__file__))
 
+    # Следим за задержками цикла событий с самого старта
+    watchdog.start()
+
     # 🟢 1. САМОЕ ПЕРВОЕ — инициализация базы данных
     print("⏳ [MAIN] Инициализация базы данных...")
-    await init_db()
+    with profiler.phase("init_db"):
+        await init_db()
     print("✅ [MAIN] База данных готова")
 
-    # Запускаем планировщик
-    scheduler.start()
-    schedule_daily_reminders(bot)
+    with profiler.phase("rebuild_leaderboard"):
+        await rebuild_leaderboard()
+
+    # Запускаем планировщик. Напоминания и служебные задачи выполняет только ведущий
+    # экземпляр (держатель аренды в БД) — остальные просто обслуживают апдейты
+    with profiler.phase("scheduler"):
+        scheduler.start()
+        schedule_local_jobs()
+        leader.start(on_elected=lambda: start_leader_jobs(bot), on_demoted=stop_leader_jobs)
     print("⏰ [MAIN] Планировщик напоминаний запущен")
 
     # 🟡 2. Подключаем роутеры
     print("🔌 [MAIN] Подключение обработчиков...")
-    dp.include_router(start.router)
-    dp.include_router(habits.router)
-    dp.include_router(stats.router)  # ← добавь эту строку
+    with profiler.phase("include routers"):
+        dp.include_router(start.router)
+        dp.include_router(habits.router)
+        dp.include_router(stats.router)  # ← добавь эту строку
+        dp.include_router(admin.router)
+        dp.include_router(inline.router)
+        dp.include_router(challenges.router)
     print("✅ [MAIN] Обработчики подключены")
 
+    if PROFILE_STARTUP:
+        profiler.report()
+
     # 🔵 3. Очищаем очередь и запускаем polling
     print("🧹 [MAIN] Очистка старых обновлений...")
     await bot.delete_webhook(drop_pending_updates=True)
@@ -44,9 +90,11 @@ async def main():
     try:
         await dp.start_polling(bot)
     finally:
+        await leader.stop()  # отпускаем аренду — резервный экземпляр подхватит задачи сразу
         scheduler.shutdown()  # корректно завершаем планировщик
+        watchdog.stop()
         print("🛑 [MAIN] Планировщик остановлен")
 
 if __name__ == "__main__":
     print("🏁 [MAIN] Запуск приложения...")
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
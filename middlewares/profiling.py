@@ -0,0 +1,29 @@
+# middlewares/profiling.py
+import time
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from utils.profiling import profiler
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика, но только пока открыто окно /profile.
+    Вешается как внутренний middleware — тогда в data уже известен выбранный обработчик."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not profiler.active:
+            return await handler(event, data)
+
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            if profiler.active:
+                profiler.record(name, time.perf_counter() - started)
@@ -0,0 +1,37 @@
+# middlewares/single_flight.py
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+
+class CallbackSingleFlightMiddleware(BaseMiddleware):
+    """Склеивает одинаковые нажатия кнопки одним пользователем, пока первое ещё обрабатывается.
+
+    Двойной/тройной тап по «✅ Сделал сегодня» или done_{id} запускает обработчик один раз,
+    а лишние нажатия сразу получают пустой ответ (чтобы на кнопке пропали «часики»).
+    Вешается на апдейты раньше ограничителя частоты: склеенные нажатия не тратят лимит.
+    """
+
+    def __init__(self):
+        self._in_flight: set[tuple[int, str]] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        callback = event.callback_query
+        if callback is None:
+            return await handler(event, data)
+
+        key = (callback.from_user.id, callback.data)
+        if key in self._in_flight:
+            await callback.answer()
+            return None
+
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
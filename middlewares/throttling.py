@@ -0,0 +1,71 @@
+# middlewares/throttling.py
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from config.settings import ADMIN_IDS, THROTTLE_CLASSES, THROTTLE_MAX_BUCKETS, THROTTLE_USER
+from utils.rate_limit import BucketLRU, TokenBucket
+
+# Дорогие действия: рендер картинок, выгрузки, массовые удаления и отметки
+HEAVY_COMMANDS = {"statsimg", "reset", "resetstats", "export", "backfill"}
+HEAVY_CALLBACKS = {"show_stats_image", "confirm_reset", "mark_all_today"}
+
+
+def classify(update: Update) -> tuple[int | None, str]:
+    """Определяет пользователя и класс действия: heavy / command / callback"""
+    if update.message and update.message.from_user:
+        text = update.message.text or ""
+        if text.startswith("/"):
+            command = text[1:].split(maxsplit=1)[0].split("@")[0].lower() if len(text) > 1 else ""
+            return update.message.from_user.id, "heavy" if command in HEAVY_COMMANDS else "command"
+        return update.message.from_user.id, "command"
+
+    if update.callback_query:
+        data = update.callback_query.data or ""
+        action = data.split(":", 1)[0]  # mark_all_today:<первый ID>:<последний ID>
+        return update.callback_query.from_user.id, "heavy" if action in HEAVY_CALLBACKS else "callback"
+
+    return None, "callback"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничивает частоту запросов от одного пользователя.
+
+    Два ведра на пользователя: общее и на класс действия (дорогие команды вроде /statsimg
+    получают лимит жёстче, чем дешёвые кнопки). Вёдра лежат в LRU ограниченного размера,
+    так что память не растёт с числом пользователей.
+    """
+
+    def __init__(self):
+        self._buckets = BucketLRU(THROTTLE_MAX_BUCKETS)
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        user_id, action_class = classify(event)
+        if user_id is None or user_id in ADMIN_IDS:
+            return await handler(event, data)
+
+        user_bucket = self._buckets.get((user_id, "*"), lambda: TokenBucket(*THROTTLE_USER))
+        class_bucket = self._buckets.get((user_id, action_class), lambda: TokenBucket(*THROTTLE_CLASSES[action_class]))
+        user_bucket.refill()
+        class_bucket.refill()
+
+        if user_bucket.can_consume() and class_bucket.can_consume():
+            user_bucket.consume()
+            class_bucket.consume()
+            user_bucket.warned = class_bucket.warned = False
+            return await handler(event, data)
+
+        await self._reject(event, max(user_bucket.delay(), class_bucket.delay()), class_bucket)
+        return None
+
+    async def _reject(self, event: Update, wait: float, bucket: TokenBucket):
+        """Сообщаем о лимите: на кнопку — всплывашкой, на сообщение — один раз за период"""
+        if event.callback_query:
+            await event.callback_query.answer(f"⏳ Слишком часто! Подожди {wait:.0f} с.")
+        elif event.message and not bucket.warned:
+            bucket.warned = True
+            await event.message.answer(f"⏳ Не так быстро 🐢 Попробуй снова через {max(wait, 1):.0f} с.")
@@ -0,0 +1,57 @@
+# utils/challenges.py
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from database.db import get_challenge_board, take_dirty_challenges, mark_challenges_dirty, set_board_message
+from utils.send_scheduler import bulk_sends
+
+WEEKDAY_NAMES = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+
+def render_board(board: dict) -> str:
+    """Текст доски челленджа: участники, отметки сегодня и за неделю"""
+    members = board["members"]
+    today, done_today = board["days"][-1]
+    done_today = min(done_today, members)  # вышедшие участники могли успеть отметиться
+    filled = round(10 * done_today / members) if members else 0
+
+    text = f"🏁 Челлендж «{board['name']}»\n\n"
+    text += f"👥 Участников: {members}\n"
+    text += f"✅ Сегодня отметились: {done_today} из {members}\n"
+    text += "🟩" * filled + "⬜" * (10 - filled) + "\n\n"
+    text += "📅 Последние дни: " + " · ".join(
+        f"{WEEKDAY_NAMES[day.weekday()]} {min(count, members)}" for day, count in board["days"]
+    )
+    text += f"\n\n👋 Позвать друга: /challenge join {board['code']}"
+    return text
+
+
+async def refresh_challenge_boards(bot: Bot):
+    """Перерисовывает доски челленджей, где были отметки, вступления или выходы.
+    Запускается по интервалу: сколько бы отметок ни пришло между запусками, каждая доска
+    перерисовывается один раз, а текст считается один раз на челлендж и рассылается всем
+    участникам фоновыми отправками (интерактивные ответы идут впереди)."""
+    dirty = await take_dirty_challenges()
+    for i, challenge_id in enumerate(dirty):
+        board = await get_challenge_board(challenge_id)
+        if not board:
+            continue
+        text = render_board(board)
+
+        with bulk_sends():
+            for user_id, message_id in board["boards"]:
+                try:
+                    await bot.edit_message_text(text, chat_id=user_id, message_id=message_id)
+                except TelegramRetryAfter:
+                    # Telegram просит подождать — оставшиеся доски перерисует следующий запуск
+                    await mark_challenges_dirty(dirty[i:])
+                    print(f"⏳ [CHALLENGE] Перерисовка досок отложена: {len(dirty) - i} челленджей")
+                    return
+                except TelegramBadRequest as e:
+                    if "message is not modified" in str(e):
+                        continue
+                    await set_board_message(challenge_id, user_id, None)  # доску удалили — забываем
+                except TelegramForbiddenError:
+                    await set_board_message(challenge_id, user_id, None)
+
+    if dirty:
+        print(f"🏁 [CHALLENGE] Перерисованы доски челленджей: {len(dirty)}")
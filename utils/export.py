@@ -0,0 +1,39 @@
+# utils/export.py
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from database.db import iter_user_history
+
+EXPORT_FORMATS = ("csv", "jsonl")
+CSV_HEADER = ["habit_id", "habit_name", "created_at", "date", "done"]
+
+
+async def export_user_history(user_id: int, fmt: str = "csv", habit_id: int | None = None) -> str:
+    """Выгружает историю пользователя в сжатый gzip-файл и возвращает путь к нему.
+    Строки пишутся по мере чтения из БД, поэтому память не зависит от объёма истории."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    fd, path = tempfile.mkstemp(prefix=f"export_{user_id}_", suffix=f".{fmt}.gz")
+    os.close(fd)
+
+    try:
+        with gzip.open(path, "wb") as gz, io.TextIOWrapper(gz, encoding="utf-8", newline="") as out:
+            writer = csv.writer(out) if fmt == "csv" else None
+            if writer:
+                writer.writerow(CSV_HEADER)
+
+            async for h_id, name, created_at, log_date, done in iter_user_history(user_id, habit_id):
+                if writer:
+                    writer.writerow([h_id, name, created_at, log_date or "", "" if done is None else int(done)])
+                else:
+                    record = dict(zip(CSV_HEADER, (h_id, name, created_at, log_date, done)))
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return path
@@ -0,0 +1,87 @@
+# utils/habit_search.py
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from config.settings import INLINE_CACHE_TTL, INLINE_CACHE_SIZE
+from database.db import search_user_habits
+
+INLINE_RESULTS_LIMIT = 50  # больше Telegram в ответ на инлайн-запрос не принимает
+
+
+def _fold(ch: str) -> str:
+    """Как unicode61 с remove_diacritics: диакритику снимаем только с латиницы (é → e, но й остаётся й)"""
+    base = unicodedata.normalize("NFKD", ch)[0]
+    return base if base.isascii() else ch
+
+
+def _words(text: str) -> list[str]:
+    """Слова так, как их видит поисковый индекс: без регистра, ё → е, é → e"""
+    text = "".join(_fold(ch) for ch in text.casefold().replace("ё", "е"))
+    return re.findall(r"[^\W_]+", text)
+
+
+def _matches(name: str, words: list[str]) -> bool:
+    name_words = _words(name)
+    return all(any(word.startswith(prefix) for word in name_words) for prefix in words)
+
+
+class HabitSearchCache:
+    """Кэш инлайн-поиска по привычкам: ключ — (пользователь, текст запроса).
+
+    Пока пользователь печатает, запрос растёт по букве. Если для более короткого префикса
+    уже есть полный ответ (меньше лимита — значит, в нём все подходящие привычки), то
+    результат для длинного запроса — его подмножество: фильтруем в памяти, не трогая БД.
+    Любое изменение привычек пользователя сбрасывает его записи (поколение в ключе).
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, list[tuple[int, str]]]] = OrderedDict()
+        self._generations: dict[int, int] = {}
+
+    def invalidate(self, user_id: int):
+        """Привычки пользователя изменились — старые ответы больше не годятся"""
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def _get(self, key: tuple) -> list[tuple[int, str]] | None:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        expires, results = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def _put(self, key: tuple, results: list[tuple[int, str]]):
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def search(self, user_id: int, text: str) -> list[tuple[int, str]]:
+        words = _words(text)
+        query = " ".join(words)
+        generation = self._generations.get(user_id, 0)
+
+        results = self._get((user_id, generation, query))
+        if results is not None:
+            return results
+
+        # Ищем самый длинный закэшированный префикс с полным ответом
+        for end in range(len(query) - 1, -1, -1):
+            shorter = self._get((user_id, generation, query[:end].rstrip()))
+            if shorter is not None and len(shorter) < INLINE_RESULTS_LIMIT:
+                results = [habit for habit in shorter if _matches(habit[1], words)]
+                break
+        else:
+            results = await search_user_habits(user_id, query, INLINE_RESULTS_LIMIT)
+
+        self._put((user_id, generation, query), results)
+        return results
+
+
+habit_search = HabitSearchCache(INLINE_CACHE_TTL, INLINE_CACHE_SIZE)
@@ -1,8 +1,15 @@
 # utils/image_gen.py
 from PIL import Image, ImageDraw, ImageFont
+import asyncio
+import io
 import os
 import re
-from database.db import get_user_stats, get_user_habits
+import time
+from config.settings import STATS_IMAGE_FORMAT, STATS_IMAGE_MAX_BYTES
+from database.db import get_user_stats
+
+# Форматы картинки статистики: палитровый PNG (текст остаётся чётким), WebP и JPEG
+IMAGE_FORMATS = ("png", "webp", "jpeg")
 
 # Пути к шрифтам
 FONT_PATH = os.path.join(os.path.dirname(__file__), "fonts", "DejaVuSans.ttf")
@@ -48,11 +55,8 @@ def draw_text_with_emoji(draw, text, x, y, font, emoji_font, fill=(0, 0, 0)):
         bbox = draw.textbbox((0, 0), char, font=current_font)
         x += bbox[2] - bbox[0]  # сдвигаем x
 
-async def generate_stats_image(user_id: int) -> str:
-    """Генерирует картинку со статистикой и возвращает путь к файлу"""
-    stats = await get_user_stats(user_id)
-    habits = await get_user_habits(user_id)
-
+def render_stats_image(stats: dict) -> Image.Image:
+    """Рисует картинку со статистикой (без сохранения)"""
     width, height = 600, 500
     img = Image.new('RGB', (width, height), color=(240, 248, 255))  # aliceblue
     draw = ImageDraw.Draw(img)
@@ -99,7 +103,81 @@ async def generate_stats_image(user_id: int) -> str:
     y += 25
     draw_text_with_emoji(draw, "Ты молодец — я в тебя верю!", 20, y, text_font, emoji_font, fill=(70, 130, 180))
 
+    return img
+
+def encode_image(img: Image.Image, fmt: str = "png", max_bytes: int | None = None) -> bytes:
+    """Кодирует картинку в выбранный формат, стараясь уложиться в max_bytes.
+    PNG — уменьшаем палитру, WebP/JPEG — качество (двоичным поиском).
+    Если бюджет недостижим — отдаём самый маленький вариант."""
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Неизвестный формат картинки: {fmt}")
+
+    def save(**params) -> bytes:
+        buffer = io.BytesIO()
+        if fmt == "png":
+            image = img.quantize(colors=params["colors"], method=Image.Quantize.MEDIANCUT)
+            image.save(buffer, "PNG", optimize=True)
+        elif fmt == "webp":
+            img.save(buffer, "WEBP", quality=params["quality"], method=4)
+        else:
+            img.save(buffer, "JPEG", quality=params["quality"], optimize=True, progressive=True)
+        return buffer.getvalue()
+
+    if fmt == "png":
+        data = b""
+        for colors in (256, 64, 32, 16):
+            data = save(colors=colors)
+            if max_bytes is None or len(data) <= max_bytes:
+                break
+        return data
+
+    best = save(quality=85)
+    if max_bytes is None or len(best) <= max_bytes:
+        return best
+    low, high = 20, 84
+    while low <= high:
+        quality = (low + high) // 2
+        data = save(quality=quality)
+        if len(data) <= max_bytes:
+            best, low = data, quality + 1
+        elif len(data) < len(best):
+            best, high = data, quality - 1
+        else:
+            high = quality - 1
+    return best
+
+async def generate_stats_image(user_id: int, fmt: str = STATS_IMAGE_FORMAT,
+                               max_bytes: int | None = STATS_IMAGE_MAX_BYTES) -> str:
+    """Генерирует картинку со статистикой и возвращает путь к файлу"""
+    stats = await get_user_stats(user_id)
+
+    # Рисование и кодирование занимают процессор — не держим на них цикл событий
+    img = await asyncio.to_thread(render_stats_image, stats)
+    data = await asyncio.to_thread(encode_image, img, fmt, max_bytes)
+
     # Сохраняем
-    output_path = f"stats_{user_id}.png"
-    img.save(output_path)
-    return output_path
\ No newline at end of file
+    output_path = f"stats_{user_id}.{'jpg' if fmt == 'jpeg' else fmt}"
+    with open(output_path, "wb") as f:
+        f.write(data)
+    return output_path
+
+def benchmark(rounds: int = 5):
+    """Сравнивает форматы по времени кодирования и размеру: python -m utils.image_gen"""
+    stats = {
+        "total_habits": 5, "done_today": 3, "skipped_today": 1,
+        "best_streak": {"name": "Читать 10 страниц", "value": 42},
+        "current_streak": {"name": "Прогулка 30 мин", "value": 7},
+    }
+    img = render_stats_image(stats)
+    print(f"🖼️ [IMAGE] {img.width}×{img.height}, бюджет {STATS_IMAGE_MAX_BYTES} байт, замеров: {rounds}")
+    for fmt in IMAGE_FORMATS:
+        for budget in (None, STATS_IMAGE_MAX_BYTES):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                data = encode_image(img, fmt, budget)
+            elapsed = (time.perf_counter() - started) / rounds
+            label = "без бюджета" if budget is None else "с бюджетом"
+            print(f"    {fmt:<5} {label:<12} {len(data):8} байт  {elapsed * 1000:7.1f} мс")
+
+if __name__ == "__main__":
+    benchmark()
\ No newline at end of file
@@ -0,0 +1,80 @@
+# utils/leader.py
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Callable
+from config.settings import LEADER_LEASE_TTL, LEADER_RENEW_SECONDS
+from database.db import acquire_lease, release_lease
+
+
+class LeaderLease:
+    """Выбор ведущего среди нескольких экземпляров бота через строку-аренду в SQLite.
+
+    Каждый экземпляр раз в renew_every секунд пытается взять или продлить аренду. Ведущий
+    продлевает свою; резервные ждут, пока она истечёт (ведущий упал или завис), и тогда один
+    из них забирает её — переключение занимает не больше ttl + renew_every секунд.
+    Если ведущий не смог продлить аренду до её истечения, он сам снимает с себя роль:
+    к этому моменту её уже мог забрать другой экземпляр.
+    """
+
+    def __init__(self, name: str = "scheduler", ttl: float = 10, renew_every: float = 3):
+        self.name = name
+        self.ttl = ttl
+        self.renew_every = renew_every
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self._valid_until = 0.0  # по time.monotonic — до каких пор аренда точно наша
+        self._task: asyncio.Task | None = None
+        self._on_elected: Callable[[], None] | None = None
+        self._on_demoted: Callable[[], None] | None = None
+
+    def start(self, on_elected: Callable[[], None], on_demoted: Callable[[], None]):
+        """Запускает цикл продления аренды в текущем цикле событий"""
+        if self._task:
+            return
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        print(f"🗳 [LEADER] Экземпляр {self.holder} участвует в выборе ведущего")
+
+    async def stop(self):
+        """Останавливает цикл и отпускает аренду, чтобы резервный экземпляр не ждал её истечения"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            self._demote("остановка")
+            try:
+                await release_lease(self.name, self.holder)
+            except Exception as e:
+                print(f"❌ [LEADER] Не удалось отпустить аренду: {e}")
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                ours = await acquire_lease(self.name, self.holder, self.ttl)
+            except Exception as e:
+                print(f"❌ [LEADER] Не удалось продлить аренду: {e}")
+                ours = None  # неизвестно: решаем по сроку прошлой аренды
+
+            if ours:
+                self._valid_until = started + self.ttl
+                if not self.is_leader:
+                    self.is_leader = True
+                    print(f"👑 [LEADER] {self.holder} стал ведущим")
+                    self._on_elected()
+            elif self.is_leader and (ours is False or time.monotonic() >= self._valid_until):
+                self._demote("аренда потеряна")
+
+            await asyncio.sleep(self.renew_every)
+
+    def _demote(self, reason: str):
+        self.is_leader = False
+        print(f"🔻 [LEADER] {self.holder} больше не ведущий: {reason}")
+        self._on_demoted()
+
+
+leader = LeaderLease("scheduler", LEADER_LEASE_TTL, LEADER_RENEW_SECONDS)
@@ -0,0 +1,172 @@
+# utils/leaderboard.py
+from bisect import bisect_left, insort
+from config.settings import LEADERBOARD_SIZE
+from database.db import get_leaderboard_members, get_user_live_streak
+
+
+class StreakLeaderboard:
+    """Рейтинг по текущим цепочкам, который живёт в памяти и обновляется при каждой отметке.
+
+    - корзины «цепочка → пользователи» (в порядке, в котором их достигли) + отсортированный
+      список непустых значений: топ-K читается за O(K) при любом числе участников;
+    - дерево Фенвика по значениям цепочек: место отдельного пользователя — за O(log max_streak).
+    """
+
+    def __init__(self, size: int = 10):
+        self.size = size
+        self._members: dict[int, str] = {}       # user_id → имя для показа (все, кто согласился)
+        self._scores: dict[int, int] = {}        # user_id → цепочка (только > 0)
+        self._buckets: dict[int, dict[int, None]] = {}
+        self._levels: list[int] = []             # непустые значения цепочек по возрастанию
+        self._tree = [0] * 1025                  # дерево Фенвика, индекс = длина цепочки
+
+    def __len__(self):
+        return len(self._scores)
+
+    def is_member(self, user_id: int) -> bool:
+        return user_id in self._members
+
+    def member_name(self, user_id: int) -> str | None:
+        return self._members.get(user_id)
+
+    def streak(self, user_id: int) -> int:
+        return self._scores.get(user_id, 0)
+
+    def add_member(self, user_id: int, name: str):
+        self._members[user_id] = name
+
+    def remove_member(self, user_id: int):
+        self.update(user_id, 0)
+        self._members.pop(user_id, None)
+
+    def update(self, user_id: int, streak: int):
+        """Ставит пользователю новую цепочку (0 — убирает из рейтинга)"""
+        old = self._scores.get(user_id, 0)
+        if old == streak or user_id not in self._members:
+            return
+        if streak >= len(self._tree):
+            self._grow(streak)
+
+        if old:
+            bucket = self._buckets[old]
+            del bucket[user_id]
+            if not bucket:
+                del self._buckets[old]
+                del self._levels[bisect_left(self._levels, old)]
+            self._add_count(old, -1)
+            del self._scores[user_id]
+
+        if streak > 0:
+            if streak not in self._buckets:
+                self._buckets[streak] = {}
+                insort(self._levels, streak)
+            self._buckets[streak][user_id] = None
+            self._add_count(streak, 1)
+            self._scores[user_id] = streak
+
+    def top(self, k: int | None = None) -> list[tuple[int, str, int]]:
+        """Первые k мест: [(user_id, имя, цепочка), ...]"""
+        k = k or self.size
+        result = []
+        for level in reversed(self._levels):
+            for user_id in self._buckets[level]:
+                result.append((user_id, self._members[user_id], level))
+                if len(result) == k:
+                    return result
+        return result
+
+    def rank(self, user_id: int) -> int | None:
+        """Место пользователя (1 — лучший) или None, если цепочки нет"""
+        streak = self._scores.get(user_id)
+        if not streak:
+            return None
+        return len(self._scores) - self._prefix(streak) + 1
+
+    def _add_count(self, streak: int, delta: int):
+        while streak < len(self._tree):
+            self._tree[streak] += delta
+            streak += streak & -streak
+
+    def _prefix(self, streak: int) -> int:
+        """Сколько участников с цепочкой ≤ streak"""
+        total = 0
+        streak = min(streak, len(self._tree) - 1)
+        while streak > 0:
+            total += self._tree[streak]
+            streak -= streak & -streak
+        return total
+
+    def _grow(self, streak: int):
+        """Расширяет дерево Фенвика и заново раскладывает в нём текущие корзины"""
+        size = len(self._tree) - 1
+        while size < streak:
+            size *= 2
+        self._tree = [0] * (size + 1)
+        for level, bucket in self._buckets.items():
+            self._add_count(level, len(bucket))
+
+
+leaderboard = StreakLeaderboard(LEADERBOARD_SIZE)
+
+# Пока идёт пересборка — кого за это время меняли: их свежее состояние есть только в старом рейтинге
+_changed_during_rebuild: set[int] | None = None
+
+
+def get_leaderboard() -> StreakLeaderboard:
+    """Текущий рейтинг. Ссылку не храни: пересборка подменяет объект целиком"""
+    return leaderboard
+
+
+def _mark_changed(user_id: int):
+    if _changed_during_rebuild is not None:
+        _changed_during_rebuild.add(user_id)
+
+
+async def rebuild_leaderboard():
+    """Собирает рейтинг заново из БД — при старте и после полуночи, когда цепочки «сгорают».
+    Новый рейтинг собирается в стороне, а старый до последнего момента отвечает на /top;
+    подмена — без await, так что неполного рейтинга никто не видит.
+    Рейтинг свой у каждого процесса: отметки, сделанные через другой экземпляр бота,
+    появятся здесь только после следующей пересборки."""
+    global leaderboard, _changed_during_rebuild
+    if _changed_during_rebuild is not None:
+        return  # пересборка уже идёт
+    _changed_during_rebuild = set()
+    try:
+        fresh = StreakLeaderboard(leaderboard.size)
+        for user_id, name in await get_leaderboard_members():
+            fresh.add_member(user_id, name)
+            fresh.update(user_id, await get_user_live_streak(user_id))
+
+        # Вступления, выходы и отметки по ходу пересборки старый рейтинг уже учёл — переносим
+        for user_id in _changed_during_rebuild:
+            fresh.remove_member(user_id)
+            if leaderboard.is_member(user_id):
+                fresh.add_member(user_id, leaderboard.member_name(user_id))
+                fresh.update(user_id, leaderboard.streak(user_id))
+        leaderboard = fresh
+    finally:
+        _changed_during_rebuild = None
+    print(f"🏆 [LEADERBOARD] Рейтинг пересобран: участников с цепочкой — {len(leaderboard)}")
+
+
+async def join_leaderboard(user_id: int, name: str):
+    """Участник согласился попасть в рейтинг (согласие в БД уже записано)"""
+    streak = await get_user_live_streak(user_id)
+    leaderboard.add_member(user_id, name)
+    leaderboard.update(user_id, streak)
+    _mark_changed(user_id)
+
+
+def leave_leaderboard(user_id: int):
+    leaderboard.remove_member(user_id)
+    _mark_changed(user_id)
+
+
+async def refresh_user_streak(user_id: int):
+    """Пересчитывает цепочку участника рейтинга после отметки (остальных не трогает)"""
+    if not leaderboard.is_member(user_id):
+        return
+    streak = await get_user_live_streak(user_id)
+    leaderboard.update(user_id, streak)  # после await — рейтинг могли успеть подменить
+    _mark_changed(user_id)
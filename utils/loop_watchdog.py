@@ -0,0 +1,87 @@
+# utils/loop_watchdog.py
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from config.settings import LOOP_LAG_THRESHOLD_MS, LOOP_WATCHDOG_INTERVAL
+
+
+class LoopWatchdog:
+    """Следит за задержкой цикла событий.
+
+    Корутина раз в interval секунд засыпает и меряет, насколько позже проснулась — это и есть
+    задержка цикла (её перцентили показывает /metrics). Отдельный поток смотрит на время
+    последнего «пульса»: если цикл молчит дольше порога, он снимает стек потока цикла —
+    видно ровно ту функцию, которая держит всех.
+    """
+
+    def __init__(self, threshold_ms: float = 200, interval: float = 0.1, window: int = 3000):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self._lags: deque[float] = deque(maxlen=window)  # последние замеры, с
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._stalls = 0
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Запускает пульс в текущем цикле событий и поток-наблюдатель"""
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        print(f"🐕 [WATCHDOG] Слежу за циклом событий: порог {self.threshold * 1000:.0f} мс")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._lags.append(max(now - started - self.interval, 0.0))
+            self._last_beat = now
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat
+            # Один отчёт на одно зависание: пока пульс тот же — не повторяемся
+            if stalled < self.threshold + self.interval or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self._stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "    стек недоступен\n"
+            print(f"🐢 [WATCHDOG] Цикл событий заблокирован уже {stalled * 1000:.0f} мс, сейчас выполняется:\n{stack}")
+
+    def percentiles(self) -> dict:
+        """Перцентили задержки цикла по последним замерам, мс"""
+        lags = sorted(self._lags)
+        if not lags:
+            return {"samples": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "stalls": self._stalls}
+
+        def pick(q: float) -> float:
+            return lags[min(int(q * len(lags)), len(lags) - 1)] * 1000
+
+        return {
+            "samples": len(lags),
+            "p50": pick(0.50),
+            "p95": pick(0.95),
+            "p99": pick(0.99),
+            "max": lags[-1] * 1000,
+            "stalls": self._stalls,
+        }
+
+
+watchdog = LoopWatchdog(LOOP_LAG_THRESHOLD_MS, LOOP_WATCHDOG_INTERVAL)
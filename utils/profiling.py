@@ -0,0 +1,115 @@
+# utils/profiling.py
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Awaitable, Callable
+from config.settings import PROFILE_DIR, PROFILE_MAX_SECONDS, PROFILE_TOP_N
+
+
+class LiveProfiler:
+    """Включаемое по команде профилирование работающего бота.
+
+    Пока окно открыто: cProfile на весь поток цикла событий (обработчики, тик напоминаний,
+    задачи планировщика), время каждого обработчика отдельно и снимки tracemalloc в начале
+    и в конце — чтобы увидеть, где растёт память. Окно закрывается через N секунд или после
+    N апдейтов. Когда выключено — middleware проверяет один флаг, больше ничего не делается.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._profile: cProfile.Profile | None = None
+        self._snapshot = None
+        self._handlers: dict[str, list[float]] = {}   # имя → [вызовов, сумма с, максимум с]
+        self._updates_left: int | None = None
+        self._started = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self._on_done: Callable[[str, str], Awaitable[None]] | None = None
+
+    def start(self, seconds: float | None = None, updates: int | None = None,
+              on_done: Callable[[str, str], Awaitable[None]] | None = None) -> bool:
+        """Открывает окно профилирования. False — если оно уже открыто."""
+        if self.active:
+            return False
+
+        seconds = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self._handlers = {}
+        self._updates_left = updates
+        self._on_done = on_done
+        self._started = time.perf_counter()
+
+        tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self.active = True
+
+        self._timer = asyncio.get_running_loop().call_later(seconds, self._finish)
+        print(f"🔬 [PROFILE] Профилирование включено: до {seconds:.0f} с" + (f" или {updates} апдейтов" if updates else ""))
+        return True
+
+    def record(self, name: str, elapsed: float):
+        """Учитывает один вызов обработчика; закрывает окно, если апдейты закончились"""
+        stats = self._handlers.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+        if self._updates_left is not None:
+            self._updates_left -= 1
+            if self._updates_left <= 0:
+                self._finish()
+
+    def _finish(self):
+        if not self.active:
+            return
+        self.active = False
+        self._profile.disable()
+        if self._timer:
+            self._timer.cancel()
+        memory = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+        tracemalloc.stop()
+        asyncio.get_running_loop().create_task(
+            self._report(self._profile, memory, time.perf_counter() - self._started, self._on_done)
+        )
+        self._profile = self._snapshot = None
+
+    async def _report(self, profile: cProfile.Profile, memory: list, duration: float, on_done):
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.pstats")
+        profile.dump_stats(path)
+
+        out = io.StringIO()
+        out.write(f"🔬 Профиль за {duration:.1f} с\n\n⏱ Обработчики (вызовов, всего, максимум):\n")
+        handlers = sorted(self._handlers.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (calls, total, worst) in handlers[:PROFILE_TOP_N]:
+            out.write(f"  {name}: {calls}, {total * 1000:.0f} мс, {worst * 1000:.0f} мс\n")
+        if not handlers:
+            out.write("  — ни одного апдейта\n")
+
+        out.write(f"\n🐍 Функции по суммарному времени (топ-{PROFILE_TOP_N}):\n")
+        stats = pstats.Stats(profile, stream=io.StringIO()).stats
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_N]
+        for (filename, line, func), (_, calls, _, cumulative, _) in top:
+            out.write(f"  {os.path.basename(filename)}:{line} {func} — {calls}×, {cumulative * 1000:.0f} мс\n")
+
+        out.write(f"\n🧠 Рост памяти (топ-{PROFILE_TOP_N}):\n")
+        for diff in memory[:PROFILE_TOP_N]:
+            frame = diff.traceback[0]
+            out.write(f"  {os.path.basename(frame.filename)}:{frame.lineno} {diff.size_diff / 1024:+.1f} КБ ({diff.count_diff:+d} объектов)\n")
+
+        report = out.getvalue()
+        print(report)
+        if on_done:
+            try:
+                await on_done(report, path)
+            except Exception as e:
+                print(f"❌ [PROFILE] Не удалось отправить отчёт: {e}")
+
+
+profiler = LiveProfiler()
@@ -0,0 +1,60 @@
+# utils/rate_limit.py
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class TokenBucket:
+    """Классическое «ведро с токенами»: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "warned")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.warned = False  # предупреждали ли уже о превышении лимита
+
+    def refill(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def can_consume(self, amount: float = 1) -> bool:
+        return self.tokens >= amount
+
+    def consume(self, amount: float = 1) -> bool:
+        """Забирает токены, если их хватает. Возвращает False, если лимит исчерпан."""
+        self.refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def delay(self, amount: float = 1) -> float:
+        """Сколько секунд ждать, пока накопится amount токенов"""
+        self.refill()
+        return max(0.0, (amount - self.tokens) / self.rate) if self.rate else float("inf")
+
+
+class BucketLRU:
+    """Хранилище вёдер с ограниченным размером: давно не использованные вытесняются.
+    Вытесненное ведро при следующем обращении создаётся заново — уже полным."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def get(self, key: Hashable, factory: Callable[[], TokenBucket]) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = factory()
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
@@ -1,29 +1,62 @@
 # utils/scheduler.py
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.triggers.cron import CronTrigger
 from aiogram import Bot
-import asyncio
-import aiosqlite
-from database.db import get_user_reminder_time, get_user_habits, DB_PATH
-from datetime import datetime
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+import time
+from database.db import (
+    get_user_reminder_time,
+    get_habits_due_today,
+    compact_habit_logs,
+    refresh_daily_rollups,
+    get_users_to_remind,
+    get_reminder_cursor,
+    set_user_blocked,
+    enqueue_reminders,
+    get_due_reminders,
+    mark_reminders_sent,
+    reschedule_reminder,
+    fail_reminder,
+    get_outbox_counts,
+    purge_old_reminders,
+    purge_deleted_habits,
+    refresh_reminder_buckets,
+)
+from config.settings import (
+    LOG_ARCHIVE_AFTER_DAYS,
+    PURGE_INTERVAL_SECONDS,
+    REMINDER_CATCHUP_MINUTES,
+    CHALLENGE_BOARD_INTERVAL,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_DRAIN_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BASE_BACKOFF,
+    OUTBOX_MAX_BACKOFF,
+)
+from database.backup import backup_database
+from utils.challenges import refresh_challenge_boards
+from utils.leaderboard import rebuild_leaderboard
+from utils.loop_watchdog import watchdog
+from utils.timezones import MINUTES_PER_DAY, local_date_at, local_today, utc_epoch_minute
+from utils.send_scheduler import bulk_sends
+from datetime import date, datetime
 
-scheduler = AsyncIOScheduler()
+# Задачи, которые должен выполнять только ведущий экземпляр (см. utils/leader.py), лежат в
+# отдельном хранилище: при потере аренды их снимают разом, при получении — ставят заново
+LEADER_JOBSTORE = 'leader'
+scheduler = AsyncIOScheduler(jobstores={'default': MemoryJobStore(), LEADER_JOBSTORE: MemoryJobStore()})
 
-async def send_daily_reminder(bot: Bot, user_id: int):
-    """Отправляет ежедневное напоминание пользователю"""
-    # Получаем время напоминания
-    reminder_time = await get_user_reminder_time(user_id)
-    if not reminder_time:
-        return  # Нет времени — не напоминаем
-
-    # Получаем список привычек
-    habits = await get_user_habits(user_id)
+async def build_reminder_text(user_id: int, day: date | None = None) -> str | None:
+    """Текст ежедневного напоминания или None, если напоминать не о чем"""
+    # Получаем привычки, которые по расписанию нужны сегодня (по времени пользователя)
+    habits = await get_habits_due_today(user_id, day)
     if not habits:
-        return  # Нет привычек — нечего напоминать
+        return None  # Сегодня нечего напоминать
 
     # Формируем сообщение
     habit_names = "\n".join([f"• {name}" for _, name in habits])
-    message_text = (
+    return (
         f"🌿 *Черепашка Степа напоминает:*\n\n"
         f"Не забудь сегодня поработать над своими привычками:\n\n"
         f"{habit_names}\n\n"
@@ -31,25 +64,193 @@ async def send_daily_reminder(bot: Bot, user_id: int):
         f"Ты молодец — я в тебя верю! 🐢💪"
     )
 
+async def send_daily_reminder(bot: Bot, user_id: int):
+    """Отправляет ежедневное напоминание пользователю сразу, мимо очереди (для /testreminder)"""
+    # Получаем время напоминания
+    reminder_time = await get_user_reminder_time(user_id)
+    if not reminder_time:
+        return  # Нет времени — не напоминаем
+
+    message_text = await build_reminder_text(user_id)
+    if not message_text:
+        return
+
     try:
         await bot.send_message(user_id, message_text, parse_mode="Markdown")
     except Exception as e:
         print(f"❌ [SCHEDULER] Не удалось отправить напоминание пользователю {user_id}: {e}")
 
+# До какого момента не трогаем Telegram после RetryAfter (общий флуд-контроль)
+_outbox_paused_until = 0.0
+
+async def drain_reminder_outbox(bot: Bot):
+    """Отправляет накопившиеся напоминания из очереди.
+    Успех — 'sent'; RetryAfter — ждём, сколько просит Telegram; бот заблокирован — помечаем
+    пользователя и больше его не выбираем; прочие ошибки — повтор с экспоненциальной паузой."""
+    global _outbox_paused_until
+    now = time.time()
+    if now < _outbox_paused_until:
+        return
+
+    due = await get_due_reminders(now, OUTBOX_BATCH_SIZE)
+    if not due:
+        return
+
+    sent = []
+    for outbox_id, user_id, reminder_date, text, attempts, tz in due:
+        if reminder_date < local_today(tz).isoformat():
+            await fail_reminder(outbox_id, "expired")  # вчерашнее напоминание уже ни к чему
+            continue
+        try:
+            with bulk_sends():  # рассылка уступает дорогу ответам пользователям
+                await bot.send_message(user_id, text, parse_mode="Markdown")
+            sent.append(outbox_id)
+        except TelegramRetryAfter as e:
+            _outbox_paused_until = time.time() + e.retry_after
+            await reschedule_reminder(outbox_id, _outbox_paused_until, f"retry after {e.retry_after}s", count_attempt=False)
+            print(f"⏳ [SCHEDULER] Telegram просит подождать {e.retry_after} с — приостанавливаем рассылку")
+            break
+        except TelegramForbiddenError as e:
+            await set_user_blocked(user_id, True)
+            print(f"🚫 [SCHEDULER] Пользователь {user_id} заблокировал бота: {e}")
+        except TelegramBadRequest as e:
+            await fail_reminder(outbox_id, str(e))  # повтор не поможет (например, чат не найден)
+        except Exception as e:
+            if attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+                await fail_reminder(outbox_id, str(e))
+                print(f"❌ [SCHEDULER] Напоминание {outbox_id} не доставлено после {attempts + 1} попыток: {e}")
+            else:
+                delay = min(OUTBOX_BASE_BACKOFF * 2 ** attempts, OUTBOX_MAX_BACKOFF)
+                await reschedule_reminder(outbox_id, time.time() + delay, str(e))
+
+    if sent:
+        await mark_reminders_sent(sent)
+    counts = await get_outbox_counts()
+    print(f"📬 [SCHEDULER] Отправлено: {len(sent)}, в очереди: {counts['pending']}, провалено: {counts['failed']}")
+
 def schedule_daily_reminders(bot: Bot):
     """Планирует ежедневные напоминания для всех пользователей"""
-    # Пример: проверяем каждые 60 секунд, не наступило ли время напоминания для кого-то
+    # Раз в минуту кладём в очередь напоминания тех, у кого наступило время.
+    # Время напоминаний хранится минутой суток по UTC — один запрос на тик для всех поясов.
+    # Тик разбирает все минуты от курсора до текущей: опоздавший, пропущенный (рестарт,
+    # блокировка цикла) или склеенный планировщиком запуск догоняет своё, а повторный
+    # запуск в ту же минуту ничего не делает.
     async def check_and_send():
-        from database.db import init_db  # ленивый импорт, чтобы избежать циклических зависимостей
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute("SELECT user_id, reminder_time FROM users WHERE reminder_time IS NOT NULL")
-            users = await cursor.fetchall()
+        now_minute = utc_epoch_minute()
+        last_done = await get_reminder_cursor()
+        if last_done is None:
+            last_done = now_minute - 1
+        if last_done >= now_minute:
+            return
+        first_minute = max(last_done + 1, now_minute - REMINDER_CATCHUP_MINUTES + 1)
+
+        reminders = []
+        for user_id, tz, last_reminded, bucket in await get_users_to_remind(first_minute, now_minute):
+            # Минута напоминания внутри окна: при догоне она может прийтись на вчерашний
+            # вечер по времени пользователя — такое напоминание уже ни к чему, а сегодняшнее
+            # придёт в свой срок
+            missed_minute = now_minute - (now_minute - bucket) % MINUTES_PER_DAY
+            day = local_date_at(missed_minute, tz)
+            if day != local_today(tz):
+                continue
+            if last_reminded == day.isoformat():
+                continue  # сегодня уже напоминали
+            text = await build_reminder_text(user_id, day)
+            if text:
+                reminders.append((user_id, day.isoformat(), text))
+
+        added = await enqueue_reminders(reminders, due_at=time.time(), cursor=now_minute)
+        if added:
+            caught_up = now_minute - first_minute
+            print(f"📥 [SCHEDULER] В очередь добавлено напоминаний: {added}" + (f" (догнали {caught_up} мин)" if caught_up else ""))
 
-        now = datetime.now()
-        current_time = now.strftime("%H:%M")
+    scheduler.add_job(
+        check_and_send, 'interval', seconds=60, id='reminder_checker', jobstore=LEADER_JOBSTORE,
+        max_instances=1, coalesce=True, misfire_grace_time=None
+    )
+
+    # Очередь разбираем часто и небольшими порциями
+    scheduler.add_job(
+        drain_reminder_outbox, 'interval', seconds=OUTBOX_DRAIN_SECONDS,
+        args=[bot], id='reminder_outbox', jobstore=LEADER_JOBSTORE, max_instances=1, coalesce=True
+    )
+
+def log_loop_metrics():
+    """Пишет в лог перцентили задержки цикла событий"""
+    lag = watchdog.percentiles()
+    print(
+        f"📊 [METRICS] loop_lag_ms p50={lag['p50']:.1f} p95={lag['p95']:.1f} p99={lag['p99']:.1f} "
+        f"max={lag['max']:.1f} stalls={lag['stalls']} samples={lag['samples']}"
+    )
+
+def schedule_local_jobs():
+    """Задачи, которые нужны каждому экземпляру бота, а не только ведущему"""
+    # Задержка цикла событий — в лог раз в 5 минут
+    scheduler.add_job(log_loop_metrics, 'interval', minutes=5, id='loop_metrics')
+
+    # После полуночи вчерашние несделанные цепочки «сгорают» — пересобираем рейтинг.
+    # Полночь у пользователей в разных поясах своя, поэтому каждый час.
+    # Рейтинг живёт в памяти процесса, так что пересобирает его каждый экземпляр.
+    scheduler.add_job(rebuild_leaderboard, CronTrigger(minute=1), id='leaderboard_rebuild')
+
+def schedule_maintenance():
+    """Планирует ночные служебные задачи"""
+    # Нарастающие итоги для /stats week|month — сразу после полуночи
+    # (и один раз при старте, чтобы догнать пропущенные ночи)
+    scheduler.add_job(
+        refresh_daily_rollups,
+        CronTrigger(hour=0, minute=5),
+        id='daily_rollups',
+        jobstore=LEADER_JOBSTORE,
+        next_run_time=datetime.now()
+    )
+
+    # Переход на летнее/зимнее время меняет смещение пояса — сдвигаем напоминания.
+    # Раз в 15 минут: у поясов со смещением :30 и :45 (Индия, Непал, часть Австралии)
+    # переход случается не в начале часа по UTC. Это по одному UPDATE на пояс — дёшево.
+    scheduler.add_job(
+        refresh_reminder_buckets, CronTrigger(minute='*/15'), id='reminder_buckets', jobstore=LEADER_JOBSTORE
+    )
+
+    # Чистим очередь напоминаний от старых отправленных/проваленных записей
+    scheduler.add_job(purge_old_reminders, CronTrigger(hour=3, minute=15), id='outbox_cleanup', jobstore=LEADER_JOBSTORE)
+
+    # Вычищаем логи удалённых привычек небольшими порциями (и сразу после старта —
+    # чтобы доделать то, что не успели до перезапуска)
+    scheduler.add_job(
+        purge_deleted_habits, 'interval', seconds=PURGE_INTERVAL_SECONDS,
+        id='habit_purge', jobstore=LEADER_JOBSTORE, max_instances=1, coalesce=True, next_run_time=datetime.now()
+    )
+
+    # Сворачиваем старые логи в битовые карты, когда нагрузка минимальна
+    scheduler.add_job(
+        compact_habit_logs,
+        CronTrigger(hour=3, minute=30),
+        args=[LOG_ARCHIVE_AFTER_DAYS],
+        id='log_compaction',
+        jobstore=LEADER_JOBSTORE
+    )
+
+    # Резервная копия БД — после сворачивания логов, пока бот почти не пишет
+    scheduler.add_job(backup_database, CronTrigger(hour=4, minute=0), id='db_backup', jobstore=LEADER_JOBSTORE, max_instances=1)
+
+def schedule_challenge_boards(bot: Bot):
+    """Доски общих челленджей: отметки копятся в challenge_board_dirty, а перерисовываем
+    их пачкой раз в CHALLENGE_BOARD_INTERVAL секунд — одна отметка не тянет за собой
+    N правок сообщений сразу"""
+    scheduler.add_job(
+        refresh_challenge_boards, 'interval', seconds=CHALLENGE_BOARD_INTERVAL,
+        args=[bot], id='challenge_boards', jobstore=LEADER_JOBSTORE, max_instances=1, coalesce=True
+    )
 
-        for user_id, reminder_time in users:
-            if reminder_time == current_time:
-                asyncio.create_task(send_daily_reminder(bot, user_id))
+def start_leader_jobs(bot: Bot):
+    """Экземпляр стал ведущим: ставим напоминания и служебные задачи"""
+    schedule_daily_reminders(bot)
+    schedule_maintenance()
+    schedule_challenge_boards(bot)
+    print("⏰ [SCHEDULER] Задачи ведущего запущены")
 
-    scheduler.add_job(check_and_send, 'interval', seconds=60, id='reminder_checker')
\ No newline at end of file
+def stop_leader_jobs():
+    """Экземпляр больше не ведущий: снимаем его задачи (уже идущие запуски доработают)"""
+    scheduler.remove_all_jobs(jobstore=LEADER_JOBSTORE)
+    print("⏸ [SCHEDULER] Задачи ведущего сняты")
@@ -0,0 +1,99 @@
+# utils/send_scheduler.py
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from config.settings import (
+    SEND_GLOBAL_RATE,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_GROUP_RATE_PER_MIN,
+    SEND_MAX_RETRIES,
+)
+from utils.rate_limit import BucketLRU, TokenBucket
+
+# Приоритет текущих отправок: ответы пользователям — интерактивные, рассылки — фоновые
+_bulk: ContextVar[bool] = ContextVar("send_bulk", default=False)
+
+
+@contextmanager
+def bulk_sends():
+    """Всё, что отправляется внутри блока, уступает дорогу ответам пользователям.
+    На 429 фоновая отправка не ждёт, а сразу пробрасывает TelegramRetryAfter —
+    повтор сделает тот, кто рассылает (например, очередь напоминаний)."""
+    token = _bulk.set(True)
+    try:
+        yield
+    finally:
+        _bulk.reset(token)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Общий для всего бота планировщик исходящих запросов.
+
+    - глобальный лимит (~30 сообщений/с) и лимит на чат (личка ~1/с, группа ~20/мин);
+    - пока ждут интерактивные ответы, фоновые отправки не получают токены;
+    - на TelegramRetryAfter чат «замораживается» на указанное время, интерактивный
+      запрос повторяется после паузы (до SEND_MAX_RETRIES раз).
+    Запросы без chat_id (answerCallbackQuery, getUpdates и т.п.) проходят без очереди.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_RATE)
+        self._chats = BucketLRU(50_000)
+        self._interactive_waiting = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        if isinstance(chat_id, int) and chat_id < 0:
+            return self._chats.get(chat_id, lambda: TokenBucket(SEND_GROUP_RATE_PER_MIN / 60, 3))
+        return self._chats.get(chat_id, lambda: TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST))
+
+    async def _acquire(self, chat_id, bulk: bool):
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            # Сначала ждём свой чат — это никому не мешает
+            chat_wait = chat_bucket.delay()
+            if chat_wait:
+                await asyncio.sleep(chat_wait)
+                continue
+
+            if bulk and self._interactive_waiting:
+                await asyncio.sleep(0.05)  # уступаем ответам пользователям
+                continue
+
+            global_wait = self._global.delay()
+            if global_wait == 0:
+                self._global.consume()
+                chat_bucket.consume()
+                return
+
+            # Общий лимит исчерпан: интерактивные встают «в голову» очереди
+            if not bulk:
+                self._interactive_waiting += 1
+            try:
+                await asyncio.sleep(global_wait)
+            finally:
+                if not bulk:
+                    self._interactive_waiting -= 1
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        bulk = _bulk.get()
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, bulk)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                # «Уводим ведро в минус»: следующий токен появится ровно через retry_after
+                bucket = self._chat_bucket(chat_id)
+                bucket.refill()
+                bucket.tokens = -e.retry_after * bucket.rate
+                attempt += 1
+                if bulk or attempt > SEND_MAX_RETRIES:
+                    raise
+                print(f"⏳ [SEND] 429 для чата {chat_id}, повтор через {e.retry_after} с")
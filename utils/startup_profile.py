@@ -0,0 +1,36 @@
+# utils/startup_profile.py
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """Засекает время фаз запуска (импорты, инициализация БД и т.д.).
+    Замеры стоят копейки, поэтому ведутся всегда, а печатаются только по --profile-startup."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        print("⏱️ [STARTUP] Время запуска по фазам:")
+        for name, elapsed in self.phases:
+            share = elapsed / total if total else 0
+            print(f"    {name:<32} {elapsed * 1000:8.1f} мс  {share:6.1%}")
+        print(f"    {'итого':<32} {total * 1000:8.1f} мс")
+        lazy = [name for name in ("PIL", "utils.image_gen") if name not in sys.modules]
+        if lazy:
+            print(f"    ещё не загружены (ленивые импорты): {', '.join(lazy)}")
+        print("    подробно по модулям: python -X importtime main.py")
+
+
+profiler = StartupProfiler()
@@ -0,0 +1,64 @@
+# utils/timezones.py
+import re
+import time
+from datetime import date, datetime, tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from config.settings import DEFAULT_TIMEZONE
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def get_zone(name: str | None) -> tzinfo:
+    """Часовой пояс пользователя; без настройки — DEFAULT_TIMEZONE, а если и его нет — пояс сервера
+    (так бот работал до появления часовых поясов)"""
+    name = name or DEFAULT_TIMEZONE
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return datetime.now().astimezone().tzinfo
+
+
+def parse_timezone(text: str) -> str | None:
+    """«Europe/Moscow» → как есть, «UTC+3» / «+3» → «Etc/GMT-3» (у Etc/GMT знак обратный).
+    None — если такого пояса нет."""
+    text = text.strip()
+    match = re.fullmatch(r"(?:UTC|GMT)?\s*([+-])(\d{1,2})", text, re.IGNORECASE)
+    if match:
+        hours = int(match.group(2))
+        if hours > 14:
+            return None
+        sign = "-" if match.group(1) == "+" else "+"
+        text = f"Etc/GMT{sign}{hours}" if hours else "UTC"
+    try:
+        ZoneInfo(text)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+    return text
+
+
+def local_today(name: str | None) -> date:
+    """Сегодняшняя дата в поясе пользователя"""
+    return datetime.now(get_zone(name)).date()
+
+
+def local_date_at(epoch_minute: int, name: str | None) -> date:
+    """Дата в поясе пользователя в заданную минуту от начала эпохи"""
+    return datetime.fromtimestamp(epoch_minute * 60, get_zone(name)).date()
+
+
+def utc_offset_minutes(name: str | None) -> int:
+    """Текущее смещение пояса от UTC в минутах (с учётом летнего времени)"""
+    return int(datetime.now(get_zone(name)).utcoffset().total_seconds() // 60)
+
+
+def to_utc_minute(local_time: str, name: str | None) -> int:
+    """«ЧЧ:ММ» в поясе пользователя → минута суток по UTC (0..1439)"""
+    hours, minutes = map(int, local_time.split(":"))
+    return (hours * 60 + minutes - utc_offset_minutes(name)) % MINUTES_PER_DAY
+
+
+def utc_epoch_minute() -> int:
+    """Номер текущей минуты от начала эпохи; по модулю 1440 — минута суток по UTC"""
+    return int(time.time() // 60)